@@ -0,0 +1,26 @@
+@echo off
+chcp 65001 >nul
+echo 正在测试本机最快的推理参数...
+echo ----------------------------------------------------
+
+if not exist "runtime\python.exe" (
+    echo [错误] 未找到运行环境！
+    echo 请先运行 setup_env.bat 初始化环境。
+    echo.
+    pause
+    exit /b 1
+)
+
+"runtime\python.exe" src\autotune.py %*
+
+if %errorlevel% neq 0 (
+    echo.
+    echo [错误] 调优过程中出现问题。
+) else (
+    echo.
+    echo [成功] 调优结果已保存到 modle\tuning.json，重启桌宠后生效。
+)
+
+echo.
+echo 按任意键退出...
+pause >nul
@@ -0,0 +1,13 @@
+# 各项自检共用的结果输出
+
+
+def check(name, condition, detail=""):
+    """打印一项检查的结果，返回是否通过"""
+    print(f"[{'ok' if condition else 'FAIL'}] {name}{': ' + detail if detail else ''}")
+    return condition
+
+
+def finish(results):
+    """打印总结，返回进程退出码"""
+    print("all checks passed" if all(results) else "some checks FAILED")
+    return 0 if all(results) else 1
@@ -0,0 +1,144 @@
+# 对话气泡的自检：在无界面的 Qt 平台上模拟流式回复逐字追加，
+# 对比原来的做法 (布局里的 QLabel + 阴影效果 + 每次 adjustSize 整个窗口) 和 SpeechBubble 的每次更新耗时，
+# 并确认 SpeechBubble 不改变桌宠窗口的尺寸、尺寸不变时只重绘变化的行。
+# 用法: python -m bench.bubble_check
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+from PySide6.QtWidgets import QApplication, QWidget, QLabel, QVBoxLayout, QGraphicsDropShadowEffect
+from PySide6.QtCore import Qt, QObject, QEvent
+from PySide6.QtGui import QColor
+
+from bubble import SpeechBubble
+from bench import check, finish
+
+# 桌宠窗口里精灵图的大小
+SPRITE_SIZE = 200
+REPLY = ("你好呀！今天过得怎么样？我刚刚在桌面上晒太阳，顺便帮你数了数没关的窗口，一共有七个呢。"
+         "要不要先休息一下，喝口水再继续？\n记得每隔一小时站起来活动活动哦~") * 2
+# 每次追加的字数 (流式回复每次收到的片段)
+CHUNK = 2
+
+
+def pet_window():
+    window = QWidget()
+    window.setWindowFlags(Qt.WindowType.FramelessWindowHint)
+    window.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
+    layout = QVBoxLayout(window)
+    layout.setContentsMargins(0, 0, 0, 0)
+    sprite = QLabel()
+    sprite.setFixedSize(SPRITE_SIZE, SPRITE_SIZE)
+    layout.addWidget(sprite)
+    window.show()
+    QApplication.processEvents()
+    return window
+
+
+class PaintRecorder(QObject):
+    """记录控件每次绘制的区域"""
+
+    def __init__(self, widget):
+        super().__init__(widget)
+        self.rects = []
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Type.Paint:
+            self.rects.append((event.rect(), watched.size()))
+        return False
+
+
+def stream(update):
+    """逐段追加文字，返回每次更新 (含处理事件和绘制) 的平均耗时 (毫秒)"""
+    start = time.perf_counter()
+    steps = 0
+    for end in range(CHUNK, len(REPLY) + CHUNK, CHUNK):
+        update(REPLY[:end])
+        QApplication.processEvents()
+        steps += 1
+    return (time.perf_counter() - start) / steps * 1000
+
+
+def old_bubble():
+    """原来 show_bubble 的做法"""
+    window = pet_window()
+    bubble = QLabel(window)
+    bubble.setStyleSheet("""
+        QLabel {
+            background-color: rgba(255, 192, 203, 220);
+            border-radius: 10px;
+            padding: 10px;
+            color: black;
+            font-family: "Microsoft YaHei";
+            border: 1px solid #FF69B4;
+        }
+    """)
+    bubble.setWordWrap(True)
+    shadow = QGraphicsDropShadowEffect()
+    shadow.setBlurRadius(5)
+    shadow.setColor(QColor(0, 0, 0, 100))
+    shadow.setOffset(2, 2)
+    bubble.setGraphicsEffect(shadow)
+    window.layout().insertWidget(0, bubble, 0, Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignHCenter)
+    bubble.setMaximumWidth(300)
+    bubble.setMinimumWidth(150)
+
+    def update(text):
+        bubble.setText(text)
+        width = bubble.fontMetrics().horizontalAdvance(text) + 40
+        if width > 300:
+            bubble.setFixedWidth(300)
+            bubble.setWordWrap(True)
+        else:
+            bubble.setFixedWidth(max(100, width))
+            bubble.setWordWrap(False)
+        bubble.adjustSize()
+        window.adjustSize()
+        bubble.show()
+
+    sizes = set()
+    ms = stream(lambda text: (update(text), sizes.add((window.width(), window.height()))))
+    window.close()
+    return ms, len(sizes)
+
+
+def new_bubble():
+    window = pet_window()
+    size = window.size()
+    bubble = SpeechBubble(window)
+    recorder = PaintRecorder(bubble)
+    ms = stream(bubble.set_text)
+    # 尺寸不变时的重绘区域比整个气泡小，就是只重绘了变化的行
+    partial = sum(1 for rect, widget_size in recorder.rects if rect.height() < widget_size.height())
+    resized = window.size() != size
+    fits = bubble.geometry().bottom() < window.height()
+    window.close()
+    return ms, resized, partial, len(recorder.rects), fits
+
+
+def main():
+    app = QApplication.instance() or QApplication(sys.argv)
+    results = []
+    old_ms, old_sizes = old_bubble()
+    new_ms, resized, partial, paints, fits = new_bubble()
+    print(f"old QLabel bubble: {old_ms:.3f}ms per update, window resized to {old_sizes} sizes")
+    print(f"SpeechBubble:      {new_ms:.3f}ms per update, {partial}/{paints} paints partial")
+    results.append(check("pet window not resized", not resized))
+    results.append(check("partial repaints while streaming", partial > 0, f"{partial}/{paints}"))
+    results.append(check("bubble stays inside the pet window", fits))
+    results.append(check("faster than the old bubble", new_ms < old_ms, f"{old_ms / max(new_ms, 1e-6):.1f}x"))
+    return finish(results)
+
+
+if __name__ == "__main__":
+    code = main()
+    # 本机的某些 PySide6 版本调用部分无返回值的方法 (QPainter.setBrush 等) 时会多减一次 None 的引用计数，
+    # 绘制次数多了会在解释器退出时崩溃；自检结束后直接退出进程
+    sys.stdout.flush()
+    os._exit(code)
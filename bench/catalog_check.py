@@ -0,0 +1,120 @@
+# 模型目录的自检：生成几个只有文件头、权重为零的假 GGUF，
+# 检查文件头解析、索引复用、不完整文件识别和按内存自动选择。
+# 用法: python -m bench.catalog_check
+import os
+import sys
+import time
+import struct
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+import gguf
+import model_catalog
+from model_catalog import ModelCatalog, estimate_memory, select_model, describe
+from bench import check, finish
+
+GIB = 1024 ** 3
+
+
+def _string(text):
+    data = text.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+
+def _kv(key, value):
+    if isinstance(value, str):
+        return _string(key) + struct.pack("<I", 8) + _string(value)
+    if isinstance(value, list):  # 字符串数组
+        return (_string(key) + struct.pack("<IIQ", 9, 8, len(value))
+                + b"".join(_string(item) for item in value))
+    return _string(key) + struct.pack("<II", 4, value)
+
+
+def write_gguf(path, name, n_layer, n_embd, n_head, n_head_kv, file_type=15, tensor_type=12,
+               vocab=1000, truncate=0):
+    """写一个结构像真模型的 GGUF：每层一个 n_embd × 4n_embd 的张量，权重内容为零"""
+    metadata = [
+        ("general.architecture", "llama"),
+        ("general.name", name),
+        ("general.file_type", file_type),
+        ("llama.context_length", 4096),
+        ("llama.block_count", n_layer),
+        ("llama.embedding_length", n_embd),
+        ("llama.attention.head_count", n_head),
+        ("llama.attention.head_count_kv", n_head_kv),
+        ("tokenizer.ggml.tokens", [f"t{i}" for i in range(vocab)]),
+        ("tokenizer.chat_template", "{{ messages }}" * 100),
+    ]
+    _, block, block_bytes = gguf.GGML_TYPES[tensor_type]
+    elements = n_embd * 4 * n_embd
+    size = elements // block * block_bytes
+    tensors = b""
+    for layer in range(n_layer):
+        tensors += _string(f"blk.{layer}.ffn") + struct.pack("<I2QIQ", 2, n_embd, 4 * n_embd, tensor_type, layer * size)
+    header = (gguf.GGUF_MAGIC + struct.pack("<IQQ", 3, n_layer, len(metadata))
+              + b"".join(_kv(k, v) for k, v in metadata) + tensors)
+    header += b"\0" * (-len(header) % gguf.DEFAULT_ALIGNMENT)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.truncate(len(header) + n_layer * size - truncate)  # 稀疏文件，不占磁盘
+    return n_layer * elements
+
+
+def main():
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        small = os.path.join(tmp, "a-small.gguf")
+        big = os.path.join(tmp, "b-big.gguf")
+        broken = os.path.join(tmp, "c-broken.gguf")
+        params = write_gguf(small, "Small", 24, 896, 14, 2)
+        write_gguf(big, "Big", 32, 4096, 32, 8)
+        write_gguf(broken, "Broken", 24, 896, 14, 2, truncate=1024)
+        with open(os.path.join(tmp, "d-notes.gguf"), "wb") as f:
+            f.write(b"not a model")
+
+        catalog = ModelCatalog(tmp)
+        start = time.perf_counter()
+        models = {os.path.basename(m["path"]): m for m in catalog.scan()}
+        first_scan = time.perf_counter() - start
+        info = models["a-small.gguf"]
+        results.append(check("header parsed", info["valid"] and info["parameter_count"] == params
+                             and info["quantization"] == "Q4_K_M" and info["vocab_size"] == 1000
+                             and info["head_count_kv"] == 2 and info["has_chat_template"],
+                             describe(info, estimate_memory(info, 2048))))
+        results.append(check("truncated file detected", not models["c-broken.gguf"]["complete"]))
+        results.append(check("non-GGUF rejected", not models["d-notes.gguf"]["valid"],
+                             models["d-notes.gguf"]["error"]))
+
+        # 第二次扫描直接使用索引 (换一个实例，从磁盘读索引)，不再解析文件
+        parsed = []
+        original = gguf.read_header
+        gguf.read_header = lambda path: parsed.append(path) or original(path)
+        start = time.perf_counter()
+        ModelCatalog(tmp).scan()
+        second_scan = time.perf_counter() - start
+        results.append(check("index reused", not parsed,
+                             f"first scan {first_scan * 1000:.1f} ms, cached {second_scan * 1000:.1f} ms"))
+        os.utime(small, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        ModelCatalog(tmp).scan()
+        gguf.read_header = original
+        results.append(check("changed file re-parsed", parsed == [small]))
+
+        # 按内存选择：内存充足时选大模型，不够时退回小模型，不完整的文件永远不选
+        model_list = list(models.values())
+        big_need = estimate_memory(models["b-big.gguf"], 2048)["total"]
+        chosen, _ = select_model(model_list, 2048, available=int(big_need / model_catalog.MEMORY_HEADROOM) + 1)
+        results.append(check("selects largest that fits", chosen["path"] == big,
+                             f"big needs {big_need / GIB:.2f} GB"))
+        chosen, estimate = select_model(model_list, 2048, available=big_need // 2)
+        results.append(check("falls back when memory is short", chosen["path"] == small,
+                             f"small needs {estimate['total'] / GIB:.2f} GB"))
+        longer = estimate_memory(models["b-big.gguf"], 8192)
+        results.append(check("estimate grows with n_ctx", longer["kv_cache"] == 4 * estimate_memory(models["b-big.gguf"], 2048)["kv_cache"]))
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# 对话记忆的自检：按字符数计 token，模拟一段长对话，检查超出预算时最早的几轮折叠进摘要
+# (作为一对 用户/助手 消息放在历史最前面)、装入的历史不超过预算、压缩后留出余量，
+# 接下来几轮不会再次压缩 (消息前缀不变，llama 可以复用已评估的部分)。
+# 用法: python -m bench.conversation_check
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+from conversation import ConversationMemory, SUMMARY_ACK, COMPACT_RATIO
+from bench import check, finish
+from bench.prompts import BENCH_PROMPTS
+
+# 历史的 token 预算 (按字符计)
+BUDGET = 300
+REPLY = "嗯嗯，我记住啦，主人今天也要开开心心的哦~"
+
+
+def count_chars(text):
+    return len(text)
+
+
+def main():
+    results = []
+    memory = ConversationMemory(count_chars, max_turns=100)
+    costs = []
+    compactions = []
+    first_messages = None
+    for i, prompt in enumerate(BENCH_PROMPTS * 3):
+        summary_before = list(memory.summary_lines)
+        messages = memory.pack(BUDGET)
+        costs.append(memory.token_cost())
+        if memory.summary_lines != summary_before:
+            compactions.append(i)
+        if first_messages is None and memory.summary_lines:
+            first_messages = messages
+        memory.add_turn(f"{prompt} ({i})", REPLY)
+
+    print(f"{len(BENCH_PROMPTS) * 3} turns, {len(compactions)} compaction(s) at turns {compactions}, "
+          f"{len(memory.turns)} turns kept, {len(memory.summary_lines)} summary lines")
+    results.append(check("old turns folded into the summary", bool(compactions) and memory.summary_lines
+                         and len(memory.turns) < len(BENCH_PROMPTS) * 3))
+    pair = first_messages or []
+    results.append(check("summary sent as a user/assistant pair", len(pair) >= 2
+                         and pair[0]["role"] == "user" and pair[1] == {"role": "assistant", "content": SUMMARY_ACK}
+                         and [m["role"] for m in pair] == ["user", "assistant"] * (len(pair) // 2)))
+    results.append(check("history stays under budget", max(costs) <= BUDGET, f"max {max(costs)} / {BUDGET}"))
+    gaps = [b - a for a, b in zip(compactions, compactions[1:])]
+    results.append(check("compaction leaves headroom", all(gap > 1 for gap in gaps),
+                         f"compacts to {COMPACT_RATIO:.0%} of the budget, turns between: {gaps}"))
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
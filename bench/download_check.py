@@ -0,0 +1,186 @@
+# 模型下载器的自检：在本机起一个支持 Range 的 HTTP 服务代替模型网站，
+# 检查分段下载、断点续传、连接中断重试、校验失败和不支持 Range 的服务器。
+# 用法: python -m bench.download_check
+import os
+import sys
+import time
+import struct
+import random
+import hashlib
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+import downloader
+from downloader import Downloader
+from bench import check, finish
+
+FILE_SIZE = 6 * 1024 * 1024 + 123
+
+
+def make_gguf(size, seed=0):
+    """文件头有效的假 GGUF 文件"""
+    rng = random.Random(seed)
+    header = b"GGUF" + struct.pack("<IQQ", 3, 1, 1)
+    return header + rng.randbytes(size - len(header))
+
+
+class FakeModelServer:
+    """
+    模型网站的替身。options:
+      ranges   是否支持 Range 请求
+      drop_at  每个响应最多发送多少字节后直接断开 (模拟网络不稳定)
+      corrupt  发出的内容与声明的 SHA-256 不一致
+      delay    每发送 64 KB 暂停的秒数 (模拟慢速网络)
+    """
+
+    def __init__(self, data, **options):
+        self.data = data
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self.options = options
+        self.requests = 0
+        self.range_requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self._respond(head=True)
+
+            def do_GET(self):
+                self._respond(head=False)
+
+            def _respond(self, head):
+                opts = server.options
+                data = server.data
+                if opts.get("corrupt"):
+                    data = data[:-1] + bytes([data[-1] ^ 0xFF])
+                start, end = 0, len(data) - 1
+                range_header = self.headers.get("Range")
+                if not head:
+                    server.requests += 1
+                if range_header and opts.get("ranges", True):
+                    server.range_requests += not head
+                    first, last = range_header.split("=")[1].split("-")
+                    start, end = int(first), int(last) if last else len(data) - 1
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+                else:
+                    self.send_response(200)
+                if opts.get("ranges", True):
+                    self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("ETag", '"v1"')
+                self.send_header("X-Linked-Etag", f'"{server.sha256}"')
+                self.end_headers()
+                if head:
+                    return
+                body = data[start:end + 1]
+                drop_at = opts.get("drop_at")
+                if drop_at is not None and len(body) > drop_at:
+                    self.wfile.write(body[:drop_at])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                delay = opts.get("delay")
+                try:
+                    for offset in range(0, len(body), 64 * 1024):
+                        self.wfile.write(body[offset:offset + 64 * 1024])
+                        if delay:
+                            time.sleep(delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端取消下载
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/model.gguf"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def main():
+    # 用小文件和小分段把各种情况都跑一遍
+    downloader.MIN_SEGMENT_BYTES = 1024 * 1024
+    downloader.WRITE_BUFFER_BYTES = 256 * 1024
+    downloader.CHUNK_BYTES = 64 * 1024
+    downloader.RETRY_DELAY = 0.05
+    data = make_gguf(FILE_SIZE)
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = os.path.join(tmp, "model.gguf")
+
+        # 1. 多连接下载
+        with FakeModelServer(data) as server:
+            start = time.perf_counter()
+            ok = Downloader(server.url, dest, segments=4).run()
+            elapsed = time.perf_counter() - start
+            results.append(check("parallel download", ok and read(dest) == data,
+                                 f"{server.range_requests} range requests, {elapsed:.2f}s"))
+            results.append(check("no leftovers", not os.path.exists(dest + ".part")
+                                 and not os.path.exists(dest + ".part.json")))
+        os.remove(dest)
+
+        # 2. 中途停止后续传：第二次只下载剩下的部分
+        with FakeModelServer(data, delay=0.05) as server:
+            first = Downloader(server.url, dest, segments=4)
+
+            def stop_early(done, total, speed):
+                if done > total // 4:
+                    first.cancel()
+
+            first.progress_callback = stop_early
+            stopped = not first.run()
+            results.append(check("cancel keeps .part", stopped and os.path.exists(dest + ".part")
+                                 and not os.path.exists(dest)))
+            second = Downloader(server.url, dest, segments=4)
+            ok = second.run()
+            results.append(check("resume", ok and read(dest) == data and 0 < second.resumed_bytes < len(data),
+                                 f"resumed at {second.resumed_bytes} of {len(data)} bytes"))
+        os.remove(dest)
+
+        # 3. 每个响应只发 300 KB 就断开：自动重试并从断点继续
+        with FakeModelServer(data, drop_at=300 * 1024) as server:
+            ok = Downloader(server.url, dest, segments=3).run()
+            results.append(check("flaky connection", ok and read(dest) == data,
+                                 f"{server.requests} requests"))
+        os.remove(dest)
+
+        # 4. 内容与 SHA-256 不一致：不生成目标文件，也不留下 .part
+        with FakeModelServer(data, corrupt=True) as server:
+            ok = Downloader(server.url, dest).run()
+            results.append(check("sha256 mismatch rejected", not ok and not os.path.exists(dest)
+                                 and not os.path.exists(dest + ".part")))
+
+        # 5. 文件头不是 GGUF (例如下载到的是错误页面)
+        html = b"<html>not found</html>" * 1000
+        with FakeModelServer(html) as server:
+            ok = Downloader(server.url, dest).run()
+            results.append(check("bad header rejected", not ok and not os.path.exists(dest)))
+
+        # 6. 不支持 Range 的服务器：单连接下载
+        with FakeModelServer(data, ranges=False) as server:
+            ok = Downloader(server.url, dest, segments=4).run()
+            results.append(check("no range support", ok and read(dest) == data and server.requests == 1))
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+import os
+import mmap
+import time
+import hashlib
+
+# 确定性的 Llama 替身：不加载任何权重，按字符“分词”，回复内容只由提示词决定。
+# 与真实 llama-cpp 一样会复用与上一次输入的最长公共前缀，只为新增的部分付出评估时间，
+# 因此可以在没有模型的机器上测试前缀缓存、流式输出、取消等逻辑的开销和回归。
+# 传入 draft_model 时按 llama-cpp 的方式做投机解码：一次前向验证全部草稿，只为这一次前向计时。
+# map_weights 时像 use_mmap 的真实模型一样映射整个模型文件并读入每一页，close() 后释放。
+
+EOS_TOKEN = 0
+ASSISTANT_MARK = "<|assistant|>"
+# 加噪声的草稿模型猜错时给出的 token
+WRONG_TOKEN = ord("？")
+# 与真实模型一样的词表大小 (按字符分词，覆盖全部 Unicode)
+VOCAB_SIZE = 0x110000
+
+FAKE_REPLIES = [
+    "我是海小棠呀，今天也要开开心心的哦~",
+    "嗯嗯，我在听呢，主人慢慢说~",
+    "这个我不太清楚呢，不过我会陪着你的！",
+    "啦啦啦~ 春天的花儿开啦~",
+    "主人辛苦啦，要记得休息一下哦~",
+]
+
+
+class _Scores(list):
+    """logits 的最小替身：下标 0 为 EOS，下标 1 为“继续生成下一个字”"""
+
+    def fill(self, value):
+        self[:] = [value] * len(self)
+
+
+class _Row:
+    """scores 的一行，只支持 argmax"""
+
+    def __init__(self, token):
+        self.token = token
+
+    def argmax(self):
+        return self.token
+
+
+class _ScoreRows:
+    """按位置给出 logits 行：第 i 行的最大值就是看到前 i+1 个 token 后的下一个 token"""
+
+    def __init__(self, llama):
+        self.llama = llama
+
+    def __getitem__(self, index):
+        return _Row(self.llama.next_token(self.llama.input_ids[:index + 1]))
+
+
+class FakeState:
+    def __init__(self, input_ids):
+        self.input_ids = list(input_ids)
+        self.n_tokens = len(input_ids)
+
+
+class FakeLlama:
+    def __init__(self, model_path, n_ctx=2048, prompt_ms_per_token=0.0, gen_ms_per_token=0.0,
+                 load_seconds=0.0, draft_model=None, error_every=0, ramble=0, map_weights=False, **kwargs):
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.prompt_ms_per_token = prompt_ms_per_token
+        self.gen_ms_per_token = gen_ms_per_token
+        self.draft_model = draft_model
+        # 每隔多少个字故意预测错一次 (模拟能力较弱的草稿模型)
+        self.error_every = error_every
+        # 回复后面再多写几句 (模拟不听“简短回答”的模型)
+        self.ramble = ramble
+        self.chat_format = "fake"
+        self.metadata = {}
+        self.verbose = False
+        self.input_ids = []
+        self.n_tokens = 0
+        # 统计
+        self.evaluated_tokens = 0
+        self.generated_tokens = 0
+        self.forward_passes = 0
+        # 是否按主模型的贪心结果验证草稿 (关闭时盲目接受草稿，用来确认自检能发现验证出错)
+        self.verify_drafts = True
+        self.weights = None
+        if map_weights:
+            with open(model_path, "rb") as f:
+                self.weights = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # 读一遍让每一页都常驻，与推理时访问全部权重一样计入 RSS
+            sum(self.weights[i] for i in range(0, len(self.weights), mmap.PAGESIZE))
+        if load_seconds:
+            time.sleep(load_seconds)
+
+    def close(self):
+        if self.weights is not None:
+            self.weights.close()
+            self.weights = None
+
+    # --- 与 llama_cpp.Llama 兼容的接口 ---
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def n_vocab(self):
+        return VOCAB_SIZE
+
+    @property
+    def scores(self):
+        return _ScoreRows(self)
+
+    def token_eos(self):
+        return EOS_TOKEN
+
+    def token_bos(self):
+        return EOS_TOKEN
+
+    def tokenize(self, text, add_bos=True, special=False):
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="ignore")
+        return [ord(c) for c in text]
+
+    def detokenize(self, tokens, prev_tokens=None, special=False):
+        return "".join(chr(t) for t in tokens if t != EOS_TOKEN).encode("utf-8")
+
+    def reset(self):
+        self.input_ids = []
+        self.n_tokens = 0
+
+    def save_state(self):
+        return FakeState(self.input_ids[:self.n_tokens])
+
+    def load_state(self, state):
+        self.input_ids = list(state.input_ids)
+        self.n_tokens = state.n_tokens
+
+    def eval(self, tokens):
+        self.evaluated_tokens += len(tokens)
+        if self.prompt_ms_per_token:
+            time.sleep(len(tokens) * self.prompt_ms_per_token / 1000.0)
+        self.input_ids = self.input_ids[:self.n_tokens] + list(tokens)
+        self.n_tokens = len(self.input_ids)
+
+    @staticmethod
+    def format_messages(messages):
+        return "".join(f"<|{m['role']}|>{m['content']}\n" for m in messages) + "<|assistant|>"
+
+    def create_chat_completion(self, messages, stream=False, **kwargs):
+        completion = self.create_completion(self.format_messages(messages), stream=stream, **kwargs)
+        if not stream:
+            text = completion["choices"][0]["text"]
+            return {
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": completion["choices"][0]["finish_reason"]}],
+                "usage": completion["usage"],
+            }
+        return self._chat_chunks(completion)
+
+    @staticmethod
+    def _chat_chunks(chunks):
+        yield {"choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]}
+        for chunk in chunks:
+            choice = chunk["choices"][0]
+            delta = {"content": choice["text"]} if choice["text"] else {}
+            yield {"choices": [{"index": 0, "delta": delta, "finish_reason": choice["finish_reason"]}]}
+
+    def create_completion(self, prompt, max_tokens=16, stream=False, stop=None,
+                          logits_processor=None, stopping_criteria=None, **kwargs):
+        tokens = prompt if isinstance(prompt, list) else self.tokenize(prompt)
+        chunks = self._generate(tokens, max_tokens, stop or [], logits_processor, stopping_criteria)
+        if stream:
+            return chunks
+        text = ""
+        finish_reason = "length"
+        for chunk in chunks:
+            text += chunk["choices"][0]["text"]
+            finish_reason = chunk["choices"][0]["finish_reason"] or finish_reason
+        return {
+            "choices": [{"index": 0, "text": text, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": len(tokens), "completion_tokens": len(self.tokenize(text))},
+        }
+
+    def reply_for(self, tokens):
+        """回复内容只由提示词决定"""
+        digest = hashlib.sha256(self.detokenize(tokens)).digest()
+        return "".join(FAKE_REPLIES[(digest[0] + i) % len(FAKE_REPLIES)] for i in range(self.ramble + 1))
+
+    def next_token(self, ids):
+        """按上下文给出下一个 token：最后一个 assistant 标记之前是提示词，之后是已经生成的部分"""
+        text = self.detokenize(ids).decode("utf-8")
+        mark = text.rfind(ASSISTANT_MARK)
+        if mark < 0:
+            return EOS_TOKEN
+        end = mark + len(ASSISTANT_MARK)
+        reply = self.reply_for(ids[:end])
+        position = len(ids) - end
+        if position >= len(reply):
+            return EOS_TOKEN
+        if self.error_every and (position + 1) % self.error_every == 0:
+            return WRONG_TOKEN
+        return ord(reply[position])
+
+    def _forward(self, position, reply):
+        """
+        一次前向产出的 token。没有草稿时只有主模型自己的下一个 token；有草稿时与 llama-cpp 一样，
+        用已有的上下文向草稿要候选，逐个与主模型在该位置的贪心结果比较，只接受连续相同的前缀，
+        再加上主模型在第一个不同的位置 (或全部候选之后) 自己的 token。
+        输出来自被接受的草稿，验证出错时回复就会变。
+        """
+        def greedy(p):
+            return ord(reply[p]) if p < len(reply) else EOS_TOKEN
+
+        self.forward_passes += 1
+        if self.draft_model is None or position == 0:
+            if self.gen_ms_per_token:
+                time.sleep(self.gen_ms_per_token / 1000.0)
+            return [greedy(position)]
+        draft = [int(token) for token in self.draft_model(self.input_ids[:self.n_tokens])]
+        accepted = []
+        for token in draft:
+            if self.verify_drafts and token != greedy(position + len(accepted)):
+                break
+            accepted.append(token)
+        # 一次前向的耗时：生成一个 token + 顺带评估的草稿 token
+        if self.gen_ms_per_token or self.prompt_ms_per_token:
+            time.sleep((self.gen_ms_per_token + len(draft) * self.prompt_ms_per_token) / 1000.0)
+        return accepted + [greedy(position + len(accepted))]
+
+    def _generate(self, tokens, max_tokens, stop, logits_processor, stopping_criteria):
+        # 与 llama-cpp 一样只评估和上一次输入不同的部分
+        prefix = 0
+        limit = min(self.n_tokens, len(tokens))
+        while prefix < limit and self.input_ids[prefix] == tokens[prefix]:
+            prefix += 1
+        if prefix == len(tokens):
+            prefix -= 1  # 至少评估最后一个 token 以得到 logits
+        self.n_tokens = max(prefix, 0)
+        self.eval(tokens[self.n_tokens:])
+
+        reply = self.reply_for(tokens)
+        text = ""
+        ready = []  # 上一次前向已经产出、还没有输出的 token
+        position = 0
+        while True:
+            if max_tokens and position >= max_tokens:
+                yield self._chunk("", "length")
+                return
+            scores = _Scores([0.0, 1.0])
+            for processor in logits_processor or []:
+                scores = processor(self.input_ids, scores)
+            if scores[EOS_TOKEN] >= scores[1]:
+                yield self._chunk("", "stop")
+                return
+            if not ready:
+                ready = self._forward(position, reply)
+            token = ready.pop(0)
+            if token == EOS_TOKEN:
+                yield self._chunk("", "stop")
+                return
+            char = chr(token)
+            position += 1
+            self.generated_tokens += 1
+            self.input_ids.append(token)
+            self.n_tokens += 1
+            text += char
+            if any(s and s in text for s in stop):
+                yield self._chunk("", "stop")
+                return
+            if stopping_criteria and any(c(self.input_ids, scores) for c in stopping_criteria):
+                yield self._chunk(char, "stop")
+                return
+            yield self._chunk(char, None)
+
+    @staticmethod
+    def _chunk(text, finish_reason):
+        return {"choices": [{"index": 0, "text": text, "finish_reason": finish_reason}]}
+
+
+def fake_llama_factory(prompt_ms_per_token=0.0, gen_ms_per_token=0.0, load_seconds=0.0,
+                       draft_error_every=0, draft_speed=0.1, ramble=0, map_weights=False):
+    """
+    生成可传给 LLMClient(llama_cls=...) 的工厂，固定假模型的速度参数。
+    文件名含 draft 的模型作为草稿模型：速度是主模型的 draft_speed 倍耗时，每 draft_error_every 个字猜错一次。
+    ramble 为每次回复后面多写的句数；map_weights 时主模型映射并读入整个模型文件。
+    """
+    def factory(**kwargs):
+        if "draft" in os.path.basename(kwargs.get("model_path", "")):
+            return FakeLlama(prompt_ms_per_token=prompt_ms_per_token * draft_speed,
+                             gen_ms_per_token=gen_ms_per_token * draft_speed,
+                             error_every=draft_error_every, ramble=ramble, n_ctx=kwargs.pop("n_ctx", 2048),
+                             **kwargs)
+        return FakeLlama(prompt_ms_per_token=prompt_ms_per_token, gen_ms_per_token=gen_ms_per_token,
+                         load_seconds=load_seconds, ramble=ramble, map_weights=map_weights,
+                         n_ctx=kwargs.pop("n_ctx", 2048), **kwargs)
+    return factory
+
+
+def make_fake_model(tmp_dir, name="fake-model.gguf"):
+    """假模型也需要一个存在的文件作为模型路径 (用于指纹和前缀缓存 key)；已经存在时不覆盖"""
+    os.makedirs(tmp_dir, exist_ok=True)
+    model_path = os.path.join(tmp_dir, name)
+    if not os.path.exists(model_path):
+        with open(model_path, "wb") as f:
+            f.write(b"GGUF")
+    return model_path
+
+
+def make_fake_client(tmp_dir, config=None, cache_dir=None, llama_cls=None, **options):
+    """
+    使用假模型的 LLMClient：模型文件放在 tmp_dir 下，前缀缓存默认放在 tmp_dir/cache。
+    config 缺省时关闭回复缓存；options 传给 fake_llama_factory。
+    """
+    # 调用方已经把 src 加入 sys.path
+    from llm_client import LLMClient
+
+    client = LLMClient(make_fake_model(tmp_dir), config={"reply_cache_mode": "off"} if config is None else config,
+                       llama_cls=llama_cls or fake_llama_factory(**options))
+    client.cache_dir = cache_dir or os.path.join(tmp_dir, "cache")
+    return client
@@ -0,0 +1,188 @@
+# HTTP 后端的自检：在本机起一个 OpenAI 兼容的替身服务 (SSE 流式、分块传输、keep-alive)，
+# 检查回复与进程内的假模型一致、连接复用、取消、失败重试和超时。
+# 用法: python -m bench.http_check
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+import http_backend
+from http_backend import HttpLLMClient
+from bench import check, finish
+from bench.fake_llama import FakeLlama, make_fake_client
+from bench.prompts import BENCH_PROMPTS
+
+CONFIG = {"reply_cache_mode": "off", "reply_budget": "off"}
+
+
+class StubLLMServer:
+    """
+    OpenAI 兼容服务的替身，回复由假模型按消息决定。options:
+      fail_first  前几个请求返回 503
+      delay       开始回复前等待的秒数
+      chunk_delay 每个字之间等待的秒数
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.fake = FakeLlama("stub")
+        self.requests = 0
+        self.connections = set()
+        self.aborted = 0
+        self.payloads = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                server.requests += 1
+                server.connections.add(self.client_address)
+                self._json(200, {"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+
+            def do_POST(self):
+                server.requests += 1
+                server.connections.add(self.client_address)
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server.payloads.append(payload)
+                opts = server.options
+                if opts.get("fail_first", 0) >= server.requests:
+                    self._json(503, {"error": "loading"})
+                    return
+                if opts.get("delay"):
+                    time.sleep(opts["delay"])
+                fake = server.fake
+                reply = fake.reply_for(fake.tokenize(FakeLlama.format_messages(payload["messages"])))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for char in reply[:payload.get("max_tokens") or None]:
+                        event = {"choices": [{"index": 0, "delta": {"content": char}, "finish_reason": None}]}
+                        self._chunk(b"data: " + json.dumps(event).encode("utf-8") + b"\n\n")
+                        if opts.get("chunk_delay"):
+                            time.sleep(opts["chunk_delay"])
+                    self._chunk(b"data: [DONE]\n\n")
+                    self._chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    server.aborted += 1
+                    self.close_connection = True
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def client_for(server, tmp, **config):
+    client = HttpLLMClient(None, config=dict(CONFIG, http_url=server.url, **config))
+    client.cache_dir = tmp
+    return client
+
+
+def main():
+    http_backend.RETRY_DELAY = 0.05
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # 参考结果：进程内的假模型
+        local = make_fake_client(tmp, CONFIG, cache_dir=tmp)
+        local.load_model()
+        expected = [local.chat(p) for p in BENCH_PROMPTS]
+
+        # 1. 流式和非流式交替，回复与进程内一致，全程只用一个连接
+        with StubLLMServer() as server:
+            client = client_for(server, tmp)
+            ok = client.load_model()
+            replies = [("".join(client.chat_stream(p)).strip() if i % 2 else client.chat(p))
+                       for i, p in enumerate(BENCH_PROMPTS)]
+            results.append(check("replies match in-process model", ok and replies == expected,
+                                 f"model {client.model_name}, {replies[0]!r}"))
+            results.append(check("keep-alive connection reused", len(server.connections) == 1,
+                                 f"{server.requests} requests over {len(server.connections)} connection(s)"))
+            payload = server.payloads[-1]
+            results.append(check("sampling options sent", payload["stream"] and payload["model"] == "stub-model"
+                                 and payload["max_tokens"] == 64 and payload["stop"] == ["[", "\n\n"]))
+
+        # 2. 取消：收到第一段后取消，服务端看到连接断开，回复不记入历史
+        with StubLLMServer(chunk_delay=0.02) as server:
+            client = client_for(server, tmp)
+            client.load_model()
+            cancel = threading.Event()
+            parts = []
+            for delta in client.chat_stream("你好呀", cancel_event=cancel):
+                parts.append(delta)
+                cancel.set()
+            time.sleep(0.2)
+            results.append(check("cancel closes the stream", len(parts) == 1 and not client.memory.turns
+                                 and server.aborted == 1))
+
+        # 3. 服务端暂时不可用 (503)：自动重试
+        with StubLLMServer(fail_first=3) as server:
+            client = client_for(server, tmp)
+            ok = client.load_model()
+            reply = client.chat(BENCH_PROMPTS[0])
+            results.append(check("retries on 503", ok and reply == expected[0],
+                                 f"{client.request_stats['retries']} retries"))
+
+        # 4. 服务端卡住：超过读取超时后放弃，不会一直等
+        with StubLLMServer(delay=1.0) as server:
+            client = client_for(server, tmp, http_timeout=0.2)
+            client.load_model()
+            start = time.perf_counter()
+            reply = client.chat(BENCH_PROMPTS[0])
+            elapsed = time.perf_counter() - start
+            results.append(check("read timeout", reply.startswith("我想不出来了") and elapsed < 3,
+                                 f"gave up after {elapsed:.2f}s"))
+
+        # 5. 没有服务：加载失败，不会卡住界面
+        client = client_for(server, tmp)
+        start = time.perf_counter()
+        ok = client.load_model()
+        results.append(check("server down", not ok and client.llm is None,
+                             f"{time.perf_counter() - start:.2f}s"))
+
+        # 6. 按字数预算提前断开
+        with StubLLMServer() as server:
+            client = client_for(server, tmp, reply_budget={"chat": 1, "greeting": 1, "question": 1, "request": 1})
+            client.load_model()
+            reply = client.chat("晚安，明天见~")
+            time.sleep(0.2)
+            results.append(check("reply budget stops the stream", 0 < len(reply) < len(expected[-1]),
+                                 f"{reply!r}"))
+            results.append(check("reply budget recorded", client.reply_budget.stats["stopped"] == 1,
+                                 f"{client.reply_budget.last}"))
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
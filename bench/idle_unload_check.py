@@ -0,0 +1,74 @@
+# 空闲卸载的自检：用映射整个模型文件的假模型，在推理线程的任务里卸载、再重新加载，
+# 检查卸载后常驻内存下降、重新加载跳过预读并从磁盘恢复前缀 (不重新评估)、对话记忆保留，
+# 并打印卸载前后和重新加载后的 RSS。
+# 用法: python -m bench.idle_unload_check
+import os
+import sys
+import time
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+import memstat
+from bench import check, finish
+from bench.fake_llama import make_fake_client
+from bench.prompts import BENCH_PROMPTS
+
+# 假模型文件大小 (MB)：足够让 RSS 的变化明显
+MODEL_MB = 128
+# 卸载后 RSS 至少要下降的比例 (相对模型大小)
+MIN_FREED = 0.8
+
+
+def main():
+    # 与 metrics_check 一样直接在本线程里执行推理线程的任务，不启动线程
+    from inference_worker import InferenceWorker
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, "fake-model.gguf")
+        with open(model_path, "wb") as f:
+            f.write(b"GGUF")
+            block = os.urandom(1024 * 1024)
+            for _ in range(MODEL_MB):
+                f.write(block)
+        # 模型文件已经存在，make_fake_client 直接使用它
+        client = make_fake_client(tmp, prompt_ms_per_token=0.5, map_weights=True)
+        worker = InferenceWorker(client)
+        unloaded = []
+        worker.model_unloaded.connect(unloaded.append)
+
+        worker._run_load()
+        client.chat(BENCH_PROMPTS[0])
+        turns = len(client.memory.turns)
+
+        worker._run_unload()
+        info = unloaded[0] if unloaded else {}
+        freed = info.get("rss_before", 0) - info.get("rss_after", 0)
+        print(f"unload: rss {memstat.format_bytes(info.get('rss_before', 0))} -> "
+              f"{memstat.format_bytes(info.get('rss_after', 0))}")
+        results.append(check("unload frees the model", client.llm is None and freed >= MODEL_MB * 1024 * 1024 * MIN_FREED,
+                             f"freed {memstat.format_bytes(freed)} of a {MODEL_MB} MB model"))
+
+        start = time.perf_counter()
+        worker._run_load(reload=True)
+        seconds = time.perf_counter() - start
+        print(f"reload: {seconds * 1000:.0f}ms, rss {memstat.format_bytes(memstat.current_rss())}, "
+              f"timings {', '.join(f'{k}={v * 1000:.0f}ms' for k, v in client.load_timings.items())}")
+        results.append(check("reload skips prefetch", client.llm is not None and "prefetch" not in client.load_timings))
+        results.append(check("prefix restored from disk", client.llm.evaluated_tokens == 0,
+                             f"{client.llm.evaluated_tokens} prefix tokens evaluated"))
+        results.append(check("conversation memory kept", len(client.memory.turns) == turns, f"{turns} turns"))
+        reply = client.chat(BENCH_PROMPTS[1])
+        results.append(check("chat after reload", bool(reply) and not reply.startswith("呜呜")))
+
+        client.unload()
+        client.close()
+        worker.deleteLater()
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
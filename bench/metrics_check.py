@@ -0,0 +1,127 @@
+# 性能统计的自检：关闭时的开销、分位数、跟踪文件的写入和轮转 (由写盘线程写入)，
+# 以及推理线程用假模型对话时记录的排队、首字延迟、生成速度和加载阶段。
+# 用法: python -m bench.metrics_check
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+import metrics
+from metrics import Metrics, METRICS
+from bench import check, finish
+from bench.fake_llama import make_fake_client
+from bench.prompts import BENCH_PROMPTS
+
+CALLS = 200000
+# 关闭时每次调用允许的开销 (微秒)
+MAX_DISABLED_US = 1.0
+WORKER_PROMPTS = 4
+
+
+def disabled_overhead():
+    """关闭时 record + timer 每次调用的平均耗时 (微秒)"""
+    m = Metrics()
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        m.record("x", 1.0)
+        with m.timer("y"):
+            pass
+    return (time.perf_counter() - start) / CALLS * 1e6
+
+
+def run_worker(tmp):
+    """直接在本线程里执行推理线程的任务 (不启动线程)，看各项统计是否记录"""
+    # 只用几条问题：本机的某些 PySide6 版本在没有事件循环时大量 emit 会在退出时崩溃
+    from inference_worker import InferenceWorker, InferenceJob
+
+    client = make_fake_client(tmp, prompt_ms_per_token=0.5, gen_ms_per_token=2.0)
+    worker = InferenceWorker(client)
+    worker._run_load()
+    for i, prompt in enumerate(BENCH_PROMPTS[:WORKER_PROMPTS]):
+        worker._run_chat(InferenceJob("chat", i, text=prompt, stream=bool(i % 2)))
+    client.close()
+    worker.deleteLater()
+
+
+def main():
+    results = []
+    overhead = disabled_overhead()
+    results.append(check("near-zero cost when disabled", overhead < MAX_DISABLED_US,
+                         f"{overhead:.3f}us per record+timer"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        m = Metrics(os.path.join(tmp, "trace.jsonl"))
+        m.configure({"metrics": True})
+        for value in range(1, 101):
+            m.record("v", float(value))
+        m.count("c", 3)
+        stats = m.snapshot()["series"]["v"]
+        results.append(check("percentiles", (stats["p50"], stats["p90"], stats["p99"], stats["max"]) == (50, 90, 99, 100)
+                             and m.snapshot()["counters"]["c"] == 3,
+                             f"p50={stats['p50']} p90={stats['p90']} p99={stats['p99']}"))
+
+        # 轮转：把上限调小，写够几轮后只保留固定个数的备份 (每批都写盘，批的大小不取决于写盘线程何时醒来)
+        max_bytes = metrics.TRACE_MAX_BYTES
+        metrics.TRACE_MAX_BYTES = 2000
+        try:
+            for i in range(2000):
+                m.record("v", float(i))
+                if (i + 1) % metrics.FLUSH_LINES == 0:
+                    m.flush()
+            m.flush()
+        finally:
+            metrics.TRACE_MAX_BYTES = max_bytes
+        files = sorted(os.listdir(tmp))
+        with open(os.path.join(tmp, "trace.jsonl"), encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        results.append(check("rotating JSONL trace", files == ["trace.1.jsonl", "trace.2.jsonl", "trace.3.jsonl", "trace.jsonl"]
+                             and lines and lines[-1]["name"] == "v" and lines[-1]["value"] == 1999.0,
+                             ", ".join(files)))
+
+        # 写文件不在记录的线程上：攒够一批后由写盘线程写入
+        writers = []
+        flush = m.flush
+        m.flush = lambda: (writers.append(threading.current_thread()), flush())
+        size = os.path.getsize(os.path.join(tmp, "trace.jsonl"))
+        for i in range(metrics.FLUSH_LINES):
+            m.record("v", float(i))
+        deadline = time.monotonic() + 2.0
+        while os.path.getsize(os.path.join(tmp, "trace.jsonl")) == size and time.monotonic() < deadline:
+            time.sleep(0.01)
+        m.flush = flush
+        results.append(check("trace written off the recording thread", bool(writers)
+                             and threading.current_thread() not in writers,
+                             f"written by {writers[0].name if writers else 'nobody'}"))
+
+        # 关闭写文件后不再追加
+        m.configure({"metrics": True, "metrics_trace": False})
+        size = os.path.getsize(os.path.join(tmp, "trace.jsonl"))
+        m.record("v", 1.0)
+        m.flush()
+        results.append(check("trace off", os.path.getsize(os.path.join(tmp, "trace.jsonl")) == size))
+
+        METRICS.trace_path = os.path.join(tmp, "worker", "trace.jsonl")
+        METRICS.configure({"metrics": True})
+        run_worker(tmp)
+        METRICS.flush()
+        series = METRICS.snapshot()["series"]
+        expected = ("load.prefetch", "load.init", "load.prefix", "queue.wait", "chat.first_token",
+                    "chat.tokens_per_s", "chat.total")
+        missing = [name for name in expected if name not in series]
+        results.append(check("worker records load, queue and generation", not missing,
+                             f"missing {missing}" if missing else
+                             f"first token p50 {series['chat.first_token']['p50']:.1f}ms, "
+                             f"{series['chat.tokens_per_s']['p50']:.0f} tok/s"))
+        results.append(check("worker trace written", os.path.exists(METRICS.trace_path)))
+        METRICS.configure({"metrics": False})
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
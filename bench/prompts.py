@@ -0,0 +1,11 @@
+# 固定的基准测试问题，覆盖问候、提问、请求和较长的输入
+BENCH_PROMPTS = [
+    "你好呀",
+    "你是谁？",
+    "早上好，今天天气怎么样？",
+    "给我唱首歌吧",
+    "我今天工作好累，能安慰我一下吗？",
+    "海棠花一般什么时候开？",
+    "讲一个很短的小故事",
+    "晚安，明天见~",
+]
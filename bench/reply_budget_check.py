@@ -0,0 +1,62 @@
+# 提前结束的自检：假模型在回复后面还会多写几句，
+# 检查开启字数预算后回复停在完整的句子上、生成的 token 变少，并报告节省的比例。
+# 用法: python -m bench.reply_budget_check
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+from reply_budget import classify, sentence_complete
+from bench import check, finish
+from bench.fake_llama import make_fake_client
+from bench.prompts import BENCH_PROMPTS
+
+RAMBLE = 2
+
+
+def run(tmp_dir, reply_budget):
+    client = make_fake_client(tmp_dir, {"reply_cache_mode": "off", "reply_budget": reply_budget}, ramble=RAMBLE)
+    if not client.load_model():
+        raise RuntimeError("failed to load fake model")
+    replies = []
+    for i, prompt in enumerate(BENCH_PROMPTS * 2):
+        # 每次清空历史，两种设置下的提示词完全相同，回复才能逐条比较
+        client.memory.clear()
+        if i % 2:
+            replies.append(client.chat(prompt))
+        else:
+            replies.append("".join(client.chat_stream(prompt)).strip())
+    return replies, client.llm.generated_tokens, client.reply_budget.report()
+
+
+def main():
+    results = []
+    kinds = {prompt: classify(prompt) for prompt in BENCH_PROMPTS}
+    results.append(check("question types", kinds["你好呀"] == "greeting" and kinds["你是谁？"] == "question"
+                         and kinds["讲一个很短的小故事"] == "request",
+                         ", ".join(f"{p}={k}" for p, k in kinds.items())))
+    results.append(check("sentence boundaries", sentence_complete("好呀~") and sentence_complete("我在呢！(蹭蹭)")
+                         and sentence_complete("“晚安。”") and not sentence_complete("嗯嗯，")))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        full, full_tokens, _ = run(os.path.join(tmp, "off"), "off")
+        short, short_tokens, report = run(os.path.join(tmp, "on"), None)
+
+    results.append(check("replies are sentence prefixes",
+                         all(f.startswith(s) and sentence_complete(s) for f, s in zip(full, short)),
+                         f"e.g. {short[0]!r}"))
+    results.append(check("fewer tokens generated", short_tokens < full_tokens,
+                         f"{full_tokens} -> {short_tokens} "
+                         f"({(1 - short_tokens / full_tokens) * 100:.0f}% measured)"))
+    estimated = report["saved"]
+    results.append(check("saved tokens recorded", report["stopped"] > 0 and estimated > 0,
+                         f"stopped early {report['stopped']}/{report['replies']}, "
+                         f"estimated {estimated} saved vs measured {full_tokens - short_tokens}"))
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# 回复缓存的自检：按 LRU 淘汰、每个问题的回答条数上限、不够 min_variants 条时不命中、
+# 写入磁盘后重新加载内容和淘汰顺序不变，以及 LLMClient 只在没有对话历史时使用缓存。
+# 用法: python -m bench.reply_cache_check
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+from reply_cache import ReplyCache
+from bench import check, finish
+from bench.fake_llama import make_fake_client
+from bench.prompts import BENCH_PROMPTS
+
+FINGERPRINT = "check"
+QUESTIONS = ["你好呀", "你是谁？", "给我唱首歌吧", "晚安，明天见~"]
+
+
+def main():
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "replies.json")
+
+        # 1. 容量满时淘汰最久没用的问题：用过一次的第一个问题留下，第二个被淘汰
+        cache = ReplyCache(path, max_entries=3, max_variants=2)
+        keys = [cache.make_key(q, FINGERPRINT) for q in QUESTIONS]
+        for key in keys[:3]:
+            cache.add(key, f"回答{key[:4]}。")
+        cache.get(keys[0])
+        cache.add(keys[3], "新的回答。")
+        results.append(check("LRU eviction at capacity", list(cache.entries) == [keys[2], keys[0], keys[3]],
+                             f"{len(cache.entries)} entries kept"))
+
+        # 2. 每个问题只保留最新的 max_variants 条不同回答，重复的回答不算
+        for reply in ("一。", "二。", "二。", "三。"):
+            cache.add(keys[3], reply)
+        results.append(check("variants capped", cache.entries[keys[3]]["replies"] == ["二。", "三。"]))
+
+        # 3. 回答不够 min_variants 条时不命中 (并计入未命中)，够了才命中
+        misses = cache.misses
+        none = cache.get(keys[3], min_variants=3)
+        hit = cache.get(keys[3], min_variants=2)
+        results.append(check("no hit below min_variants", none is None and cache.misses == misses + 1
+                             and hit in ("二。", "三。"), f"hit {hit!r}"))
+
+        # 4. 写入磁盘后重新加载：内容和 LRU 顺序不变，容量更小时按顺序淘汰
+        cache.flush()
+        loaded = ReplyCache(path, max_entries=3, max_variants=2)
+        same = [(k, e["replies"]) for k, e in loaded.entries.items()] == \
+               [(k, e["replies"]) for k, e in cache.entries.items()]
+        smaller = ReplyCache(path, max_entries=2, max_variants=1)
+        results.append(check("round trip through the cache file", same and list(smaller.entries) == [keys[0], keys[3]]
+                             and smaller.entries[keys[3]]["replies"] == ["三。"],
+                             f"{os.path.getsize(path)} bytes"))
+
+        # 5. 客户端：没有对话历史时命中缓存，有历史时既不使用也不记录
+        client = make_fake_client(tmp, {"reply_cache_mode": "serve", "reply_cache_min_variants": 1,
+                                        "reply_cache_serve_ratio": 1.0})
+        client.load_model()
+        first = client.chat(BENCH_PROMPTS[0])
+        client.memory.clear()
+        generated = client.llm.generated_tokens
+        served = client.chat(BENCH_PROMPTS[0])
+        from_cache = served == first and client.llm.generated_tokens == generated
+        entries = len(client.reply_cache.entries)
+        client.chat(BENCH_PROMPTS[1])
+        results.append(check("client serves only without history", from_cache
+                             and len(client.reply_cache.entries) == entries,
+                             f"{client.reply_cache.stats()['hits']} hit(s)"))
+        client.close()
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 与 main.py 一样把 src 加入路径
+sys.path.append(os.path.join(ROOT, "src"))
+
+from llm_client import LLMClient, HAS_LLAMA
+import memstat
+from bench.fake_llama import make_fake_client
+from bench.prompts import BENCH_PROMPTS
+
+RESULT_VERSION = 1
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def summarize(values):
+    if not values:
+        return {}
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "min": min(values),
+        "max": max(values),
+    }
+
+
+def measure_chat(client, prompt):
+    """流式跑一次对话：首 token 之前算提示词评估，之后算生成"""
+    start = time.perf_counter()
+    first = None
+    parts = []
+    for delta in client.chat_stream(prompt):
+        if first is None:
+            first = time.perf_counter()
+        parts.append(delta)
+    end = time.perf_counter()
+    if first is None:
+        first = end
+
+    text = "".join(parts)
+    tokens = len(client.llm.tokenize(text.encode("utf-8"), add_bos=False)) if text else 0
+    generation = end - first
+    return {
+        "prompt": prompt,
+        "reply": text,
+        "ttft": first - start,
+        "prompt_eval": first - start,
+        "generation": generation,
+        "total": end - start,
+        "tokens": tokens,
+        "tokens_per_second": (tokens - 1) / generation if tokens > 1 and generation > 0 else 0.0,
+    }
+
+
+def run_benchmark(client, prompts, repeats=1, warmup=True):
+    """加载模型并依次跑完所有问题，返回可以保存为 JSON 的结果"""
+    rss_before = memstat.current_rss()
+    start = time.perf_counter()
+    if not client.load_model():
+        raise RuntimeError(f"Failed to load model: {client.model_path}")
+    load_seconds = time.perf_counter() - start
+    rss_loaded = memstat.current_rss()
+
+    if warmup:
+        measure_chat(client, prompts[0])
+
+    runs = []
+    for _ in range(repeats):
+        for prompt in prompts:
+            runs.append(measure_chat(client, prompt))
+
+    summary = {}
+    for key in ("ttft", "prompt_eval", "generation", "total", "tokens", "tokens_per_second"):
+        summary[key] = summarize([run[key] for run in runs])
+
+    return {
+        "version": RESULT_VERSION,
+        "meta": {
+            "model": os.path.basename(client.model_path),
+            "runtime": client.runtime_options(),
+            "sampling": client.sampling_options(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "load": {"seconds": load_seconds, "phases": dict(client.load_timings)},
+        "memory": {
+            "rss_before_load": rss_before,
+            "rss_after_load": rss_loaded,
+            "peak_rss": memstat.peak_rss(),
+        },
+        "speculative": client.speculative_report(),
+        "reply_budget": client.reply_budget.report(),
+        "summary": summary,
+        "runs": runs,
+    }
+
+
+def print_report(result):
+    print(f"model: {result['meta']['model']}")
+    print(f"load: {result['load']['seconds']:.3f}s  " +
+          "  ".join(f"{k}={v:.3f}s" for k, v in result["load"]["phases"].items()))
+    memory = result["memory"]
+    print(f"rss: before {memstat.format_bytes(memory['rss_before_load'])}, "
+          f"after load {memstat.format_bytes(memory['rss_after_load'])}, "
+          f"peak {memstat.format_bytes(memory['peak_rss'])}")
+    speculative = result.get("speculative")
+    if speculative and speculative["enabled"]:
+        print(f"speculative: acceptance {speculative['acceptance_rate'] * 100:.1f}%, "
+              f"{speculative['tokens_per_pass']:.2f} tokens per pass")
+    budget = result.get("reply_budget")
+    if budget and budget["replies"]:
+        print(f"reply budget: stopped early {budget['stopped']}/{budget['replies']}, "
+              f"~{budget['saved']} tokens saved ({budget['saved_ratio'] * 100:.1f}%)")
+    for key, stats in result["summary"].items():
+        if stats:
+            print(f"{key:<18} mean {stats['mean']:.4f}  p50 {stats['p50']:.4f}  p90 {stats['p90']:.4f}")
+
+
+def compare(result, baseline):
+    """与之前保存的结果比较 p50"""
+    print(f"-- compared with {baseline['meta']['model']} @ {baseline['meta']['time']} --")
+    for key, stats in result["summary"].items():
+        old = baseline.get("summary", {}).get(key)
+        if not stats or not old or not old.get("p50"):
+            continue
+        change = (stats["p50"] - old["p50"]) / old["p50"] * 100
+        print(f"{key:<18} p50 {old['p50']:.4f} -> {stats['p50']:.4f} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="LLMClient 无界面基准测试")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--model", help="本地 GGUF 模型路径")
+    source.add_argument("--fake", action="store_true", help="使用确定性的假模型 (不需要模型文件)")
+    parser.add_argument("--fake-prompt-ms", type=float, default=0.0, help="假模型每个提示词 token 的评估耗时")
+    parser.add_argument("--fake-gen-ms", type=float, default=0.0, help="假模型每个生成 token 的耗时")
+    parser.add_argument("--fake-ramble", type=int, default=0, help="假模型在回复后面多写的句数")
+    parser.add_argument("--config", help="额外的运行参数 JSON 文件 (格式同 modle/config.json)")
+    parser.add_argument("--repeats", type=int, default=1, help="每个问题重复次数")
+    parser.add_argument("--no-warmup", action="store_true", help="不做预热对话")
+    parser.add_argument("--cold", action="store_true", help="使用空的前缀缓存目录，测量冷启动")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果比较")
+    args = parser.parse_args(argv)
+
+    config = {}
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    # 基准测试测的是生成速度，默认不使用回复缓存
+    config.setdefault("reply_cache_mode", "off")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.fake:
+            client = make_fake_client(tmp_dir, config, prompt_ms_per_token=args.fake_prompt_ms,
+                                      gen_ms_per_token=args.fake_gen_ms, ramble=args.fake_ramble)
+        else:
+            if not HAS_LLAMA:
+                print("llama-cpp-python is not installed, use --fake to test without it.")
+                return 1
+            client = LLMClient(args.model, config=config)
+            if args.cold:
+                client.cache_dir = os.path.join(tmp_dir, "cache")
+
+        result = run_benchmark(client, BENCH_PROMPTS, repeats=args.repeats, warmup=not args.no_warmup)
+
+    print_report(result)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.output}")
+    return 0
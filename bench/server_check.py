@@ -0,0 +1,217 @@
+# 推理服务的自检：在本进程的线程里起一个使用假模型的 ModelServer，两个桌宠通过瘦客户端连上去，
+# 检查只加载一份模型、各自的对话互不干扰且与进程内结果相同、各自的配置互不影响、
+# 不同角色设定轮流对话时不重新评估前缀、非法消息不会让读取线程退出、带着排队中的请求重连、取消、
+# 服务退出后的本地回退和重连。
+# 用法: python -m bench.server_check
+import os
+import sys
+import time
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+from multiprocessing.connection import Client
+
+from model_server import ModelServer, ServerLLMClient
+from persona import Persona
+from bench import check, finish
+from bench.fake_llama import fake_llama_factory, make_fake_model, make_fake_client
+
+AUTHKEY = b"server-check"
+CONFIG = {"reply_cache_mode": "off"}
+PROMPTS = {
+    "a": ["你好呀", "你是谁？", "给我唱首歌吧"],
+    "b": ["晚安，明天见~", "讲一个很短的小故事", "海棠花一般什么时候开？"],
+}
+
+
+class CountingFactory:
+    """记录创建了几个模型实例"""
+
+    def __init__(self, **options):
+        self.factory = fake_llama_factory(**options)
+        self.created = 0
+
+    def __call__(self, **kwargs):
+        self.created += 1
+        return self.factory(**kwargs)
+
+
+def start_server(tmp, factory, address=("127.0.0.1", 0)):
+    server = ModelServer(address, AUTHKEY, config=CONFIG, llama_cls=factory)
+    server.client.cache_dir = os.path.join(tmp, "server-cache")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
+
+
+def make_pet(tmp, model_path, address, factory):
+    pet = ServerLLMClient(model_path, config=CONFIG, llama_cls=factory, address=address, authkey=AUTHKEY)
+    pet.cache_dir = os.path.join(tmp, "pet-cache")
+    return pet
+
+
+def main():
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = make_fake_model(tmp)
+
+        # 进程内的参考结果：每个桌宠各自的对话历史
+        expected = {}
+        for name, prompts in PROMPTS.items():
+            local = make_fake_client(tmp, CONFIG, cache_dir=os.path.join(tmp, "local-cache"))
+            local.load_model()
+            expected[name] = [local.chat(p) for p in prompts]
+
+        server_factory = CountingFactory(gen_ms_per_token=2.0)
+        server, thread = start_server(tmp, server_factory)
+        pet_factory = CountingFactory()
+        pets = {name: make_pet(tmp, model_path, server.address, pet_factory) for name in PROMPTS}
+        loaded = all(pet.load_model() for pet in pets.values())
+        results.append(check("two pets share one model", loaded and server_factory.created == 1
+                             and pet_factory.created == 0 and all(p.remote for p in pets.values()),
+                             f"{len(server.sessions)} sessions"))
+
+        # 两个桌宠同时聊天 (一个流式一个非流式)，服务轮流处理
+        replies = {}
+
+        def talk(name):
+            pet = pets[name]
+            replies[name] = [("".join(pet.chat_stream(p)).strip() if name == "a" else pet.chat(p))
+                             for p in PROMPTS[name]]
+
+        threads = [threading.Thread(target=talk, args=(name,)) for name in PROMPTS]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        results.append(check("sessions isolated, same replies as in-process", replies == expected,
+                             f"a: {replies['a'][0]!r}"))
+
+        # 每个桌宠的配置只用于自己的请求：第三个桌宠限制回复长度，服务和其它桌宠的配置不变
+        short = make_pet(tmp, model_path, server.address, pet_factory)
+        short.config["max_tokens"] = 3
+        short.load_model()
+        short_reply = short.chat(PROMPTS["a"][0])
+        short.close()
+        other = server.sessions[pets["b"].session_id]
+        results.append(check("per-pet config not shared", len(short_reply) <= 3 and "max_tokens" not in server.config
+                             and "max_tokens" not in other.config,
+                             f"short reply {short_reply!r}"))
+
+        # 不同角色设定的两个桌宠轮流对话：每个设定的前缀只在第一次对话时评估，之后切换时从内存恢复；
+        # 回复缓存模式跟着各自的配置切换
+        personas = []
+        for name, character in (("c", "你叫'小棠'，是一朵海棠花。"), ("d", "你叫'阿海'，是一只海鸥。")):
+            path = os.path.join(tmp, f"character-{name}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(character)
+            pet = make_pet(tmp, model_path, server.address, pet_factory)
+            pet.persona = Persona(path)
+            personas.append(pet)
+        personas[1].config["reply_cache_mode"] = "fill"
+        for pet in personas:
+            pet.load_model()
+        evaluated = []
+        save_state = server.client.llm.save_state
+        server.client.llm.save_state = lambda: evaluated.append(1) or save_state()
+        modes = []
+        for prompt in PROMPTS["a"]:
+            for pet in personas:
+                pet.chat(prompt)
+                modes.append(server.client.reply_cache_mode)
+        server.client.llm.save_state = save_state
+        for pet in personas:
+            pet.close()
+        results.append(check("persona prefixes kept while pets take turns", len(evaluated) == len(personas)
+                             and modes == ["off", "fill"] * len(PROMPTS["a"]),
+                             f"{len(evaluated)} prefix evaluations over {len(modes)} replies, cache modes {modes[:2]}"))
+
+        # 非法消息：读取线程忽略它们并继续处理同一连接上的请求
+        raw = Client(server.address, authkey=AUTHKEY)
+        raw.send({"op": "hello", "session": "raw"})
+        raw.recv()
+        raw.send("not a dict")
+        raw.send({"op": "chat"})
+        raw.send({"op": "cancel", "id": 1})
+        time.sleep(0.2)
+        alive = "raw" in server.sessions
+        raw.send({"op": "bye"})
+        raw.close()
+        results.append(check("invalid messages ignored", alive))
+
+        # 带着排队中的请求重连：推理线程忙时旧连接发来的请求作废，推理线程不会因此退出
+        with server.client.lock:
+            # 先让推理线程卡在一次对话上，之后的请求只能排队
+            busy = Client(server.address, authkey=AUTHKEY)
+            busy.send({"op": "hello", "session": "busy"})
+            busy.recv()
+            busy.send({"op": "chat", "id": 1, "text": "你好呀"})
+            time.sleep(0.1)
+            old = Client(server.address, authkey=AUTHKEY)
+            old.send({"op": "hello", "session": "dup"})
+            old.recv()
+            old.send({"op": "chat", "id": 1, "text": "你是谁？"})
+            time.sleep(0.1)
+            new = Client(server.address, authkey=AUTHKEY)
+            new.send({"op": "hello", "session": "dup"})
+            new.recv()
+            old.close()
+            time.sleep(0.1)
+        new.send({"op": "chat", "id": 2, "text": "你是谁？"})
+        answered = False
+        while new.poll(5.0):
+            event = new.recv()
+            if event.get("event") == "done":
+                answered = event.get("id") == 2 and bool(event.get("text"))
+                break
+        for conn in (busy, new):
+            conn.send({"op": "bye"})
+            conn.close()
+        results.append(check("reconnect with a pending request", answered,
+                             "new connection answered" if answered else "no answer"))
+
+        # 取消：收到第一段后取消，回复被截断且不记入历史
+        cancel = threading.Event()
+        turns = len(pets["a"].memory.turns)
+        parts = []
+        for delta in pets["a"].chat_stream("你好呀", cancel_event=cancel):
+            parts.append(delta)
+            cancel.set()
+        results.append(check("cancel", 0 < len(parts) < len(expected["a"][0]) and len(pets["a"].memory.turns) == turns,
+                             f"stopped after {len(parts)} chunk(s)"))
+
+        # 服务退出：下一次对话重连失败，退回本进程加载模型，历史仍然保留
+        address = server.address
+        server.stop()
+        thread.join(5)
+        start = time.perf_counter()
+        reply = pets["b"].chat("早上好，今天天气怎么样？")
+        local = make_fake_client(tmp, CONFIG, cache_dir=os.path.join(tmp, "local-cache"))
+        local.load_model()
+        for user_text, assistant_text in zip(PROMPTS["b"], expected["b"]):
+            local.memory.add_turn(user_text, assistant_text)
+        results.append(check("falls back in-process", not pets["b"].remote and pet_factory.created == 1
+                             and reply == local.chat("早上好，今天天气怎么样？"),
+                             f"{reply!r} after {time.perf_counter() - start:.2f}s"))
+
+        # 服务重新启动 (同一端口)：桌宠 a 重连，把对话历史带给新的服务
+        server_factory = CountingFactory()
+        server, thread = start_server(tmp, server_factory, address)
+        reply = pets["a"].chat("你是谁？")
+        session = server.sessions.get(pets["a"].session_id)
+        results.append(check("reconnects to restarted server", pets["a"].remote and reply
+                             and session is not None and len(session.memory.turns) == len(PROMPTS["a"]) + 1,
+                             f"history restored: {len(session.memory.turns) if session else 0} turns"))
+        for pet in pets.values():
+            pet.close()
+        server.stop()
+        thread.join(5)
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# 投机解码的自检：用确定性的假模型分别以 不开启 / 提示词查找 / 草稿模型 三种方式跑同一组问题，
+# 检查贪心采样下回复逐字相同，并报告接受率和实际加速。
+# 假模型按自己的贪心结果验证草稿、输出被接受的草稿 token；另外用每个字都猜错的草稿确认错误的草稿全部被拒绝，
+# 并关掉假模型的验证确认这项检查能发现验证出错。
+# 用法: python -m bench.speculative_check
+import os
+import sys
+import time
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src"))
+
+from bench import check, finish
+from bench.fake_llama import make_fake_model, make_fake_client
+from bench.prompts import BENCH_PROMPTS
+
+PROMPT_MS = 0.5
+GEN_MS = 20.0
+# 重复两轮，第二轮的历史里已经有相同的回复，提示词查找更容易命中
+ROUNDS = 2
+
+MODES = {
+    "off": None,
+    "prompt_lookup": "prompt_lookup",
+    # 每 5 个字猜错一次的草稿模型
+    "draft": {"mode": "draft", "draft_model": "fake-draft.gguf"},
+}
+# 每 5 个字猜错一次；错误草稿的检查里每个字都猜错
+DRAFT_ERROR_EVERY = 5
+WRONG_DRAFT_ERROR_EVERY = 1
+
+
+def run(tmp_dir, speculative, draft_error_every=DRAFT_ERROR_EVERY, verify=True):
+    draft_path = make_fake_model(tmp_dir, "fake-draft.gguf")
+    config = {"reply_cache_mode": "off", "temperature": 0.0, "top_k": 1}
+    if isinstance(speculative, dict):
+        speculative = dict(speculative, draft_model=draft_path)
+    if speculative:
+        config["speculative"] = speculative
+    client = make_fake_client(tmp_dir, config, prompt_ms_per_token=PROMPT_MS, gen_ms_per_token=GEN_MS,
+                              draft_error_every=draft_error_every)
+    if not client.load_model():
+        raise RuntimeError("failed to load fake model")
+    client.llm.verify_drafts = verify
+
+    replies = []
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for prompt in BENCH_PROMPTS:
+            # 流式和非流式各跑一半
+            if len(replies) % 2:
+                replies.append(client.chat(prompt))
+            else:
+                replies.append("".join(client.chat_stream(prompt)).strip())
+    elapsed = time.perf_counter() - start
+    return replies, elapsed, client.speculative_report(), client.llm.forward_passes
+
+
+def main():
+    results = []
+    outcomes = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode, speculative in MODES.items():
+            outcomes[mode] = run(os.path.join(tmp, mode), speculative)
+        outcomes["wrong_draft"] = run(os.path.join(tmp, "wrong_draft"), MODES["draft"],
+                                      draft_error_every=WRONG_DRAFT_ERROR_EVERY)
+        outcomes["unverified"] = run(os.path.join(tmp, "unverified"), MODES["draft"], verify=False)
+
+    baseline, base_seconds, _, base_passes = outcomes["off"]
+    results.append(check("baseline replies", all(baseline), f"{len(baseline)} replies, {base_seconds:.2f}s"))
+    for mode in ("prompt_lookup", "draft"):
+        replies, seconds, report, passes = outcomes[mode]
+        results.append(check(f"{mode} output identical", replies == baseline))
+        results.append(check(f"{mode} fewer forward passes", report["enabled"] and passes < base_passes,
+                             f"acceptance {report['acceptance_rate'] * 100:.1f}%, "
+                             f"{report['tokens_per_pass']:.2f} tokens per pass, "
+                             f"passes {base_passes} -> {passes}, "
+                             f"speedup {base_seconds / seconds:.2f}x"))
+
+    replies, _, report, passes = outcomes["wrong_draft"]
+    results.append(check("wrong draft rejected", replies == baseline and report["acceptance_rate"] == 0.0,
+                         f"acceptance {report['acceptance_rate'] * 100:.1f}%, passes {base_passes} -> {passes}"))
+    replies = outcomes["unverified"][0]
+    results.append(check("unverified draft changes output", replies != baseline,
+                         f"{sum(a != b for a, b in zip(replies, baseline))}/{len(baseline)} replies differ"))
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# 冷启动的自检：导入 main.py 的模块时不应该加载重模块 (llama_cpp、numpy、设置窗口、requests)，
+# 并在无界面的 Qt 平台上跑一次 --profile-startup，打印启动时间线。
+# 用法: python -m bench.startup_check
+import os
+import sys
+import subprocess
+
+from bench import check, finish
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+
+# 第一次用到时才导入的模块
+LAZY_MODULES = ("llama_cpp", "numpy", "settings_ui", "requests", "http_backend", "model_server")
+# 等待时间线的最长时间 (秒)，打印后桌宠立即退出
+PROFILE_TIMEOUT = 30
+
+
+def imported_modules():
+    code = ("import sys; sys.path.insert(0, %r); import main; "
+            "print('loaded:', *[m for m in %r if m in sys.modules])" % (SRC, LAZY_MODULES))
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=SRC)
+    for line in result.stdout.splitlines():
+        if line.startswith("loaded:"):
+            return line.split()[1:]
+    return ["(main.py failed to import)"]
+
+
+def profile_startup():
+    """启动一次桌宠，打印时间线后退出"""
+    code = ("import sys; sys.path.insert(0, %r); sys.argv = ['main.py', '--profile-startup']\n"
+            "import startup\n"
+            "report = startup.StartupProfile.report\n"
+            "def report_and_quit(self):\n"
+            "    report(self)\n"
+            "    if self.reported:\n"
+            "        from PySide6.QtWidgets import QApplication\n"
+            "        QApplication.quit()\n"
+            "startup.StartupProfile.report = report_and_quit\n"
+            "import main; main.main()" % SRC)
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    try:
+        result = subprocess.run([sys.executable, "-u", "-c", code], capture_output=True, text=True,
+                                cwd=SRC, env=env, timeout=PROFILE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return []
+    lines = result.stdout.splitlines()
+    if "Startup timeline:" not in lines:
+        return []
+    timeline = []
+    for line in lines[lines.index("Startup timeline:"):]:
+        if timeline and not line.startswith(" "):
+            break
+        timeline.append(line)
+    return timeline
+
+
+def main():
+    results = []
+    loaded = imported_modules()
+    results.append(check("heavy modules not imported at startup", not loaded,
+                         f"imported: {', '.join(loaded)}" if loaded else ", ".join(LAZY_MODULES)))
+
+    timeline = profile_startup()
+    results.append(check("startup profile", bool(timeline) and any("first paint" in line for line in timeline)))
+    for line in timeline:
+        print(line)
+
+    return finish(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
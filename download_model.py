@@ -1,32 +1,42 @@
 import os
-import requests
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import gguf
+from downloader import Downloader
+from config_store import ConfigStore
+
 # 模型下载地址 (Qwen1.5-0.5B-Chat-GGUF, tiny and fast)
 MODEL_URL = "https://hf-mirror.com/Qwen/Qwen1.5-0.5B-Chat-GGUF/resolve/main/qwen1_5-0_5b-chat-q4_k_m.gguf"
 MODEL_DIR = "modle" # Note: User's folder is named 'modle' based on workspace into
 MODEL_FILENAME = "qwen1_5-0_5b-chat-q4_k_m.gguf"
 
+# 模型文件的 SHA-256。留空时使用服务器 (Hugging Face) 在 X-Linked-Etag 中给出的值
+MODEL_SHA256 = ""
+
+def print_progress(done, total, speed):
+    if total:
+        sys.stdout.write(f"\rProgress: {done * 100 / total:.2f}%  {speed / 1024 / 1024:.1f} MB/s   ")
+    else:
+        sys.stdout.write(f"\rDownloaded: {done / 1024 / 1024:.1f} MB  {speed / 1024 / 1024:.1f} MB/s   ")
+    sys.stdout.flush()
+
 def download_file(url, dest_path):
     print(f"Downloading model from {url}...")
+    downloader = Downloader(url, dest_path, sha256=MODEL_SHA256 or None, progress_callback=print_progress)
     try:
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            total_size = int(r.headers.get('content-length', 0))
-            downloaded = 0
-            with open(dest_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total_size:
-                        percent = (downloaded / total_size) * 100
-                        sys.stdout.write(f"\rProgress: {percent:.2f}%")
-                        sys.stdout.flush()
-        print("\nDownload complete!")
-        return True
+        if downloader.run():
+            print("Download complete!")
+            return True
+    except KeyboardInterrupt:
+        print("\nDownload paused. Run this script again to resume.")
+        return False
     except Exception as e:
         print(f"\nDownload failed: {e}")
-        return False
+    if os.path.exists(downloader.part_path):
+        print("Run this script again to resume the download.")
+    return False
 
 def main():
     # 确定项目根目录
@@ -39,26 +49,31 @@ def main():
     dest_path = os.path.join(model_dir, MODEL_FILENAME)
     
     if os.path.exists(dest_path):
-        print(f"Model already exists at {dest_path}")
-        return
+        ok, reason = gguf.check_header(dest_path)
+        if ok:
+            print(f"Model already exists at {dest_path}")
+            return 0
+        # 旧版本下载中断时会在这里留下不完整的文件
+        print(f"Existing model file is broken ({reason}), downloading again.")
+        os.remove(dest_path)
 
     print("Desktop Pet requires a GGUF model to chat.")
     print("Attempting to download Qwen1.5-0.5B (approx 400MB)...")
     
-    if download_file(MODEL_URL, dest_path):
-        print(f"Model saved to {dest_path}")
-        print("Please ensure your config.json points to this file.")
-        
-        # update config if exists
-        config_path = os.path.join(model_dir, "config.json")
-        if os.path.exists(config_path):
-            import json
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-            # Update path to be relative to project root or absolute
-            # config["model_path"] = f"modle/{MODEL_FILENAME}" 
-            # actually better to use relative path for portability
-            pass
+    if not download_file(MODEL_URL, dest_path):
+        return 1
+    print(f"Model saved to {dest_path}")
+
+    # 配置中还没有可用的模型时，指向刚下载的文件 (相对路径，方便整体搬移)
+    config = ConfigStore(os.path.join(model_dir, "config.json"))
+    current = config.get("model_path", "")
+    if current and not os.path.isabs(current):
+        current = os.path.join(project_root, current)
+    if not current or not os.path.exists(current):
+        config.set("model_path", f"{MODEL_DIR}/{MODEL_FILENAME}")
+        config.flush()
+        print(f"config.json now points to {MODEL_DIR}/{MODEL_FILENAME}")
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
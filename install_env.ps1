@@ -94,6 +94,13 @@ if (Test-Path $ReqFile) {
     Write-Host "[Warning] requirements.txt not found, skip install" -ForegroundColor Red
 }
 
+# 6. Build sprite bundle (optional, the pet falls back to raw PNGs without it)
+Write-Host "[+] Building sprite bundle..." -ForegroundColor Gray
+$BundleProc = Start-Process -FilePath "$RuntimeDir\python.exe" -ArgumentList "`"$CurrentDir\src\sprite_bundle.py`"" -Wait -NoNewWindow -PassThru
+if ($BundleProc.ExitCode -ne 0) {
+    Write-Host "      Sprite bundle build failed, raw PNGs will be used" -ForegroundColor Yellow
+}
+
 Write-Host "`n>>> Build Success!" -ForegroundColor Cyan
 Write-Host "You can now distribute this folder."
 Write-Host "Users can run Start_Pet.bat directly." -ForegroundColor White
@@ -0,0 +1,116 @@
+import os
+import re
+import glob
+import time
+from PySide6.QtCore import QObject, QTimer, Signal
+
+# 帧序列 (一组编号的 PNG) 默认帧率
+DEFAULT_SEQUENCE_FPS = 10
+
+
+def _natural_key(path):
+    """按文件名中的数字排序：frame2.png 排在 frame10.png 前面"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", os.path.basename(path))]
+
+
+def sequence_files(path):
+    """
+    帧序列：目录下的所有 PNG，或 wave_*.png 这样的通配符，按编号排序。
+    不是帧序列时返回 None。
+    """
+    if os.path.isdir(path):
+        files = glob.glob(os.path.join(path, "*.png"))
+    elif "*" in os.path.basename(path):
+        files = glob.glob(path)
+    else:
+        return None
+    return sorted(files, key=_natural_key)
+
+
+class Clip:
+    """一段动画：[(图片路径, 帧序号, 显示时长毫秒)]。静态图只有一帧，时长为 None"""
+
+    def __init__(self, name, frames):
+        self.name = name
+        self.frames = frames
+        self.total_ms = sum(duration or 0 for _, _, duration in frames)
+
+    @property
+    def static(self):
+        return len(self.frames) <= 1 or not self.total_ms
+
+    def position(self, elapsed_ms):
+        """循环播放时，elapsed_ms 时刻应显示的帧序号，以及距离下一帧的毫秒数"""
+        if self.static:
+            return 0, None
+        t = elapsed_ms % self.total_ms
+        for index, (_, _, duration) in enumerate(self.frames):
+            if t < duration:
+                return index, duration - t
+            t -= duration
+        return len(self.frames) - 1, 1
+
+
+class Animator(QObject):
+    """
+    按单调时钟播放 Clip：每一帧该显示哪张由经过的时间决定，
+    界面线程卡顿时直接跳到当前应显示的帧，而不是把落下的帧补播一遍。
+    同一时间只有一个单次计时器，静态图不需要计时器。
+    """
+    frame_changed = Signal(str, int)  # 图片路径, 帧序号
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._advance)
+        self.clip = None
+        self.index = -1
+        self._started = 0.0
+        self._paused_at = None
+        # 统计
+        self.frames_shown = 0
+        self.frames_skipped = 0
+
+    def play(self, clip):
+        """从第一帧开始播放 (暂停状态下只显示第一帧，恢复后再继续)"""
+        self.timer.stop()
+        self.clip = clip
+        self.index = -1
+        self._started = time.monotonic()
+        if self._paused_at is not None:
+            self._paused_at = self._started
+        self._advance()
+
+    def stop(self):
+        self.timer.stop()
+        self.clip = None
+
+    def pause(self):
+        if self._paused_at is None:
+            self._paused_at = time.monotonic()
+            self.timer.stop()
+
+    def resume(self):
+        if self._paused_at is None:
+            return
+        # 暂停的时间不算进播放进度
+        self._started += time.monotonic() - self._paused_at
+        self._paused_at = None
+        self._advance()
+
+    def _advance(self):
+        clip = self.clip
+        if clip is None:
+            return
+        elapsed = ((self._paused_at or time.monotonic()) - self._started) * 1000
+        index, remaining = clip.position(elapsed)
+        if index != self.index:
+            if self.index >= 0:
+                self.frames_skipped += (index - self.index - 1) % len(clip.frames)
+            self.index = index
+            self.frames_shown += 1
+            path, frame, _ = clip.frames[index]
+            self.frame_changed.emit(path, frame)
+        if remaining is not None and self._paused_at is None:
+            self.timer.start(max(1, int(remaining + 0.5)))
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+# 确保src目录在路径中
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from llm_client import (LLMClient, HAS_LLAMA, APP_ROOT, save_tuning_profile,
+                        model_file_key)
+from config_store import ConfigStore
+
+# 基准测试使用的问题，和真实聊天一样带上系统提示词与示例对话
+BENCH_QUESTION = "今天天气真好，我们出去走走吧？"
+
+
+def thread_candidates():
+    """候选线程数：1、2 的幂以及全部逻辑核心"""
+    cpu_count = os.cpu_count() or 1
+    candidates = {1, cpu_count, max(1, cpu_count // 2)}
+    n = 2
+    while n < cpu_count:
+        candidates.add(n)
+        n *= 2
+    return sorted(candidates)
+
+
+def parse_int_list(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def measure_reply(client, llm, gen_tokens):
+    """清空上下文后完整跑一次回复，返回首 token 时间、生成速度等指标"""
+    llm.reset()
+    messages = client.build_prefix_messages() + [{"role": "user", "content": BENCH_QUESTION}]
+    start = time.perf_counter()
+    first = None
+    generated = 0
+    for chunk in llm.create_chat_completion(messages=messages, max_tokens=gen_tokens,
+                                            temperature=0.0, stream=True):
+        if chunk["choices"][0]["delta"].get("content"):
+            if first is None:
+                first = time.perf_counter()
+            generated += 1
+    end = time.perf_counter()
+    if first is None:
+        first = end
+    prompt_tokens = max(1, llm.n_tokens - generated)
+    return {
+        "total": end - start,
+        "ttft": first - start,
+        "prompt_tokens_per_second": prompt_tokens / max(first - start, 1e-6),
+        "gen_tokens_per_second": (generated - 1) / (end - first) if generated > 1 and end > first else 0.0,
+    }
+
+
+def bench_options(client, options, gen_tokens, repeats):
+    """用给定参数加载模型并测量，多次取最快的一次"""
+    start = time.perf_counter()
+    llm = client.create_llama(options)
+    load_time = time.perf_counter() - start
+    try:
+        best = None
+        for _ in range(repeats):
+            result = measure_reply(client, llm, gen_tokens)
+            if best is None or result["total"] < best["total"]:
+                best = result
+    finally:
+        del llm
+    best["load"] = load_time
+    return best
+
+
+def describe(options, result):
+    return (f"threads={options['n_threads']:<3} batch={options['n_batch']:<4} "
+            f"mmap={int(options['use_mmap'])} mlock={int(options['use_mlock'])} | "
+            f"load {result['load']:.2f}s  ttft {result['ttft']:.2f}s  "
+            f"prompt {result['prompt_tokens_per_second']:.1f} tok/s  "
+            f"gen {result['gen_tokens_per_second']:.1f} tok/s  total {result['total']:.2f}s")
+
+
+def autotune(client, threads, batches, gen_tokens, repeats):
+    """依次调优线程数、批大小和 mmap/mlock，返回最快的参数组合和测量结果"""
+    base = client.runtime_options()
+    base["verbose"] = False
+    base["use_mmap"] = True
+    base["use_mlock"] = False
+
+    # 1. 线程数 (同时决定 prompt 评估和生成速度)
+    print("== threads ==")
+    best_options, best_result = None, None
+    for n in threads:
+        options = dict(base, n_threads=n, n_threads_batch=n)
+        result = bench_options(client, options, gen_tokens, repeats)
+        print(describe(options, result))
+        if best_result is None or result["total"] < best_result["total"]:
+            best_options, best_result = options, result
+
+    # 2. 批大小 (主要影响 prompt 评估)
+    print("== batch ==")
+    for n_batch in batches:
+        if n_batch == best_options["n_batch"]:
+            continue
+        options = dict(best_options, n_batch=n_batch)
+        result = bench_options(client, options, gen_tokens, repeats)
+        print(describe(options, result))
+        if result["total"] < best_result["total"]:
+            best_options, best_result = options, result
+
+    # 3. mmap / mlock (主要影响加载时间；mlock 可能因权限不足失败)
+    print("== mmap / mlock ==")
+    for use_mmap, use_mlock in ((True, True), (False, False), (False, True)):
+        options = dict(best_options, use_mmap=use_mmap, use_mlock=use_mlock)
+        try:
+            result = bench_options(client, options, gen_tokens, 1)
+        except Exception as e:
+            print(f"mmap={int(use_mmap)} mlock={int(use_mlock)} failed: {e}")
+            continue
+        print(describe(options, result))
+        # 生成速度不能明显变慢
+        if (result["load"] < best_result["load"]
+                and result["total"] <= best_result["total"] * 1.05):
+            best_options = options
+            best_result = dict(best_result, load=result["load"])
+
+    return best_options, best_result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本机上测试并保存最快的推理参数")
+    parser.add_argument("--model", help="GGUF 模型路径，默认使用 modle/config.json 中的 model_path")
+    parser.add_argument("--threads", type=parse_int_list, default=None, help="候选线程数，例如 1,2,4,8")
+    parser.add_argument("--batches", type=parse_int_list, default=[64, 128, 256, 512], help="候选批大小")
+    parser.add_argument("--gen-tokens", type=int, default=32, help="每次测量生成的 token 数")
+    parser.add_argument("--repeats", type=int, default=2, help="每组参数测量次数，取最快一次")
+    parser.add_argument("--dry-run", action="store_true", help="只测量，不保存结果")
+    args = parser.parse_args()
+
+    if not HAS_LLAMA:
+        print("llama-cpp-python is not installed.")
+        return 1
+
+    config = ConfigStore(os.path.join(APP_ROOT, "modle", "config.json"))
+    model_path = args.model or config.get("model_path", "")
+    if model_path and not os.path.isabs(model_path):
+        model_path = os.path.join(APP_ROOT, model_path)
+    if not model_path or not os.path.exists(model_path):
+        print(f"Model not found at {model_path}")
+        return 1
+
+    # 只保留配置中的上下文长度，其余参数都由调优决定
+    client = LLMClient(model_path, config={"context_window": config.get("context_window", 2048)})
+    threads = args.threads or thread_candidates()
+    print(f"Tuning {model_path} on {os.cpu_count()} logical CPUs")
+    options, result = autotune(client, threads, args.batches, args.gen_tokens, args.repeats)
+
+    profile = {
+        "n_threads": options["n_threads"],
+        "n_threads_batch": options["n_threads_batch"],
+        "n_batch": options["n_batch"],
+        "use_mmap": options["use_mmap"],
+        "use_mlock": options["use_mlock"],
+        "load_seconds": round(result["load"], 3),
+        "ttft_seconds": round(result["ttft"], 3),
+        "prompt_tokens_per_second": round(result["prompt_tokens_per_second"], 2),
+        "gen_tokens_per_second": round(result["gen_tokens_per_second"], 2),
+        "cpu_count": os.cpu_count(),
+        "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    print("== best ==")
+    print(json.dumps(profile, indent=4, ensure_ascii=False))
+    if not args.dry_run:
+        save_tuning_profile(model_path, profile)
+        print(f"Saved profile for {model_file_key(model_path)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+from llm_client import LLMClient
+
+# 推理后端，由配置 llm_backend 选择：
+#   "llama"   在桌宠进程中用 llama-cpp 加载 GGUF (默认)
+#   "server"  连接本地推理服务 (model_server.py)，多个桌宠共用一份模型
+#   "http"    OpenAI 兼容的 HTTP 服务 (llama.cpp server 等)，桌宠进程不加载模型
+BACKENDS = ("llama", "server", "http")
+
+
+def backend_name(config):
+    name = config.get("llm_backend")
+    if name in BACKENDS:
+        return name
+    if name:
+        print(f"Unknown llm_backend {name!r}, using llama")
+    # 只设置了 model_server 的旧配置
+    if config.get("model_server") in ("connect", "auto"):
+        return "server"
+    return "llama"
+
+
+def create_llm_client(model_path, config):
+    """
+    按配置创建客户端，各后端的接口都与 LLMClient 相同。
+    server 后端的 model_server 为 "auto" 时连不上会自动启动服务进程，"connect" 时只连接已经运行的服务。
+    """
+    name = backend_name(config)
+    if name == "http":
+        from http_backend import HttpLLMClient
+        return HttpLLMClient(model_path, config=config)
+    if name == "server":
+        from model_server import ServerLLMClient
+        return ServerLLMClient(model_path, config=config, spawn=config.get("model_server") == "auto")
+    return LLMClient(model_path, config=config)
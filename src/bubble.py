@@ -0,0 +1,193 @@
+from PySide6.QtWidgets import QWidget
+from PySide6.QtCore import Qt, QRect, QRectF, QPointF
+from PySide6.QtGui import QPainter, QPixmap, QColor, QPen, QFont, QFontMetrics, QTextLayout, QTextOption
+from metrics import METRICS
+
+# 对话气泡：浮在桌宠窗口上方的子控件，不在布局里，显示和改字都不会调整桌宠窗口。
+# 文字排版结果缓存到下一次改字；背景和阴影预先画成九宫格图片，绘制时只是贴图；
+# 流式回复追加文字时只重绘变化的行。
+
+FILL_COLOR = QColor(255, 192, 203, 220)  # 浅粉色背景
+BORDER_COLOR = QColor("#FF69B4")         # 深粉色边框
+TEXT_COLOR = QColor(Qt.GlobalColor.black)
+SHADOW_COLOR = QColor(0, 0, 0, 100)
+RADIUS = 10
+PADDING = 10
+BORDER = 1
+# 阴影：模糊半径和向右下的偏移，四周留出的透明边距要能容纳它们
+SHADOW_BLUR = 5
+SHADOW_OFFSET = 2
+MARGIN = SHADOW_BLUR + SHADOW_OFFSET
+# 气泡 (不含阴影边距) 的宽度范围，超过最大宽度时换行
+MIN_WIDTH = 150
+MAX_WIDTH = 300
+FONT_FAMILY = "Microsoft YaHei"
+
+
+def nine_patch(dpr):
+    """预先画好的背景 + 阴影：四个角原样贴，边和中间拉伸"""
+    corner = MARGIN + RADIUS
+    size = corner * 2 + 1
+    pixmap = QPixmap(int(size * dpr), int(size * dpr))
+    pixmap.setDevicePixelRatio(dpr)
+    pixmap.fill(Qt.GlobalColor.transparent)
+    painter = QPainter(pixmap)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    body = QRectF(MARGIN, MARGIN, size - MARGIN * 2, size - MARGIN * 2)
+    # 一层层向外扩的半透明圆角矩形叠出模糊的阴影
+    painter.setPen(Qt.PenStyle.NoPen)
+    layer = QColor(SHADOW_COLOR)
+    layer.setAlpha(SHADOW_COLOR.alpha() // (SHADOW_BLUR + 1) + 4)
+    painter.setBrush(layer)
+    for spread in range(SHADOW_BLUR, -1, -1):
+        rect = body.adjusted(-spread, -spread, spread, spread).translated(SHADOW_OFFSET, SHADOW_OFFSET)
+        painter.drawRoundedRect(rect, RADIUS + spread, RADIUS + spread)
+    painter.setPen(QPen(BORDER_COLOR, BORDER))
+    painter.setBrush(FILL_COLOR)
+    painter.drawRoundedRect(body.adjusted(0.5, 0.5, -0.5, -0.5), RADIUS, RADIUS)
+    painter.end()
+    return pixmap
+
+
+def draw_nine_patch(painter, pixmap, rect):
+    corner = MARGIN + RADIUS
+    dpr = pixmap.devicePixelRatio()
+    size = pixmap.width() / dpr
+    xs = [(0, corner, rect.left(), corner), (corner, 1, rect.left() + corner, rect.width() - corner * 2),
+          (size - corner, corner, rect.right() + 1 - corner, corner)]
+    ys = [(0, corner, rect.top(), corner), (corner, 1, rect.top() + corner, rect.height() - corner * 2),
+          (size - corner, corner, rect.bottom() + 1 - corner, corner)]
+    for sx, sw, tx, tw in xs:
+        for sy, sh, ty, th in ys:
+            if tw > 0 and th > 0:
+                painter.drawPixmap(QRectF(tx, ty, tw, th), pixmap, QRectF(sx * dpr, sy * dpr, sw * dpr, sh * dpr))
+
+
+class SpeechBubble(QWidget):
+    """
+    桌宠的对话气泡。set_text() 重新排版并只重绘变化的部分；
+    宽度在 MIN_WIDTH 到 MAX_WIDTH 之间随文字变化，高度超出桌宠窗口时只显示最后几行。
+    """
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        # 鼠标事件交给桌宠 (拖动、双击)
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        font = QFont(self.font())
+        font.setFamily(FONT_FAMILY)
+        self.setFont(font)
+        self.text = ""
+        self.top = 0             # 气泡上边缘在桌宠窗口中的位置
+        self._layout = None      # 当前文字的 QTextLayout
+        self._lines = []         # 每行 (起始位置, 长度)，用来找出变化的行
+        self._line_tops = []     # 每行的 y 坐标 (相对文字区域)
+        self._text_height = 0
+        self._scroll = 0         # 文字比可用高度高时，向上滚动的距离
+        self._patch = None
+        self.hide()
+
+    # --- 排版 ---
+
+    def _chrome(self):
+        """文字区域到控件边缘的距离"""
+        return MARGIN + BORDER + PADDING
+
+    def _layout_text(self, text, width):
+        # QTextLayout 不认 "\n"，换成行分隔符 (U+2028) 才会换行
+        layout = QTextLayout(text.replace("\n", "\u2028"), self.font())
+        option = QTextOption()
+        option.setWrapMode(QTextOption.WrapMode.WrapAtWordBoundaryOrAnywhere)
+        layout.setTextOption(option)
+        lines, tops = [], []
+        y = 0.0
+        layout.beginLayout()
+        while True:
+            line = layout.createLine()
+            if not line.isValid():
+                break
+            line.setLineWidth(width)
+            line.setPosition(QPointF(0, y))
+            lines.append((line.textStart(), line.textLength()))
+            tops.append(int(y))
+            y += line.height()
+        layout.endLayout()
+        return layout, lines, tops, int(y + 0.999)
+
+    def _body_width(self, text):
+        """与原来的规则一致：单行放得下时按文字宽度，否则固定最大宽度并换行"""
+        metrics = QFontMetrics(self.font())
+        natural = max(metrics.horizontalAdvance(part) for part in text.split("\n"))
+        return max(MIN_WIDTH, min(MAX_WIDTH, natural + (BORDER + PADDING) * 2 + 1))
+
+    def set_text(self, text):
+        """换上新文字并显示；文字没变时只确保可见"""
+        if text == self.text and self._layout is not None:
+            self.place()
+            self.show()
+            return
+        body_width = self._body_width(text)
+        layout, lines, tops, text_height = self._layout_text(text, body_width - (BORDER + PADDING) * 2)
+
+        old_lines = self._lines
+        old_scroll = self._scroll
+        old_size = self.size()
+        self.text = text
+        self._layout, self._lines, self._line_tops, self._text_height = layout, lines, tops, text_height
+
+        width = body_width + MARGIN * 2
+        height = self._fit_height()
+        if (width, height) != (old_size.width(), old_size.height()) or not self.isVisible():
+            self.setFixedSize(width, height)
+            self.place()
+            self.show()
+            self.update()
+            return
+
+        # 尺寸不变：只重绘第一处变化的行及其后面的部分
+        if self._scroll != old_scroll:
+            self.update()
+            return
+        first = 0
+        while first < min(len(lines), len(old_lines)) and lines[first] == old_lines[first]:
+            first += 1
+        if first < max(len(lines), len(old_lines)):
+            top = self._chrome() - self._scroll + (tops[first] if first < len(tops) else text_height)
+            self.update(QRect(0, max(0, top), width, height - max(0, top)))
+
+    def _fit_height(self):
+        """高度不超过桌宠窗口；放不下时滚动到最后几行"""
+        chrome = self._chrome()
+        available = self.parentWidget().height() - self.top
+        height = min(self._text_height + chrome * 2, max(available, chrome * 2 + 1))
+        self._scroll = max(0, self._text_height + chrome * 2 - height)
+        return height
+
+    def place(self, top=None):
+        """水平居中，上边缘在 top (例如专注倒计时的下方)"""
+        if top is not None:
+            self.top = top
+        parent = self.parentWidget()
+        if self._layout is not None:
+            height = self._fit_height()
+            if height != self.height():
+                self.setFixedSize(self.width(), height)
+        self.move((parent.width() - self.width()) // 2, self.top)
+        self.raise_()
+
+    # --- 绘制 ---
+
+    def paintEvent(self, event):
+        with METRICS.timer("bubble.paint"):
+            dpr = self.devicePixelRatioF()
+            if self._patch is None or self._patch.devicePixelRatio() != dpr:
+                self._patch = nine_patch(dpr)
+            painter = QPainter(self)
+            painter.setClipRegion(event.region())
+            draw_nine_patch(painter, self._patch, self.rect())
+            if self._layout is not None:
+                chrome = self._chrome()
+                text_rect = self.rect().adjusted(chrome, chrome, -chrome, -chrome)
+                painter.setClipRect(text_rect.intersected(event.rect()))
+                painter.setPen(TEXT_COLOR)
+                self._layout.draw(painter, QPointF(chrome, chrome - self._scroll))
+            painter.end()
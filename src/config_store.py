@@ -0,0 +1,185 @@
+import os
+import json
+import threading
+
+# 配置项及默认值。不在这里的键 (例如 context_window、temperature 等推理参数) 同样会被保留，
+# 缺省时由各自的模块决定默认值。
+CONFIG_DEFAULTS = {
+    "model_path": "",
+    "pet_scale": 1.0,
+    "pet_opacity": 1.0,
+    "display_mode": "top",
+    "auto_start": False,
+    "focus_minutes": 25,
+    "stream_reply": True,
+    "chat_supersede": True,
+    "sprite_cache_mb": 32,
+    "idle_unload_minutes": 0,  # 多久没有聊天就释放模型内存，0 表示不释放
+    "metrics": False,
+    "metrics_trace": True,
+}
+
+# 连续修改时合并成一次写盘 (秒)
+SAVE_DELAY = 0.5
+
+
+def _coerce(key, value):
+    """按默认值的类型修正配置值 (例如手写的 "1" 或 1)，无法转换时使用默认值"""
+    default = CONFIG_DEFAULTS.get(key)
+    if default is None or value is None or isinstance(value, type(default)):
+        return value
+    try:
+        if isinstance(default, bool):
+            return value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes")
+        return type(default)(value)
+    except (TypeError, ValueError):
+        print(f"Invalid config value {key}={value!r}, using default {default!r}")
+        return default
+
+
+class ConfigStore:
+    """
+    modle/config.json 的唯一读写入口。
+    未知的键原样保留；写盘先写临时文件再替换，不会留下写了一半的配置；
+    连续修改合并成一次保存；修改后只把真正变化的键通知给监听者。
+    """
+
+    def __init__(self, path, save_delay=SAVE_DELAY):
+        self.path = path
+        self.save_delay = save_delay
+        self._data = {}
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._listeners = []
+        self._save_timer = None
+        self._dirty = False
+        self.load()
+
+    # --- 读取 ---
+
+    def load(self):
+        """读取配置文件，返回文件内容 (文件不存在或损坏时为空)"""
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Failed to read config {self.path}: {e}")
+            if not isinstance(data, dict):
+                data = {}
+        with self._lock:
+            self._data = {key: _coerce(key, value) for key, value in data.items()}
+        return data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                return self._data[key]
+        return CONFIG_DEFAULTS.get(key, default)
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data or key in CONFIG_DEFAULTS
+
+    def as_dict(self):
+        """默认值 + 文件中的所有键"""
+        with self._lock:
+            merged = dict(CONFIG_DEFAULTS)
+            merged.update(self._data)
+            return merged
+
+    # --- 修改 ---
+
+    def add_listener(self, callback):
+        """callback(changes)：changes 为 {键: 新值}，只包含真正变化的键"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def update(self, changes, save=True):
+        """合并修改 (不影响其它键)，返回真正变化的键"""
+        changed = {}
+        with self._lock:
+            for key, value in changes.items():
+                value = _coerce(key, value)
+                if key in self._data and self._data[key] == value:
+                    continue
+                # 第一次写入与默认值相同的值：需要保存，但对使用者来说没有变化
+                unchanged = key not in self._data and key in CONFIG_DEFAULTS and CONFIG_DEFAULTS[key] == value
+                self._data[key] = value
+                self._dirty = True
+                if not unchanged:
+                    changed[key] = value
+        if self._dirty and save:
+            self.schedule_save()
+        if changed:
+            self._notify(changed)
+        return changed
+
+    def set(self, key, value, save=True):
+        return self.update({key: value}, save=save)
+
+    def reload(self):
+        """重新读取文件 (例如被手动编辑过)，把变化通知给监听者"""
+        old = self.as_dict()
+        self.load()
+        new = self.as_dict()
+        changed = {key: value for key, value in new.items() if old.get(key) != value}
+        if changed:
+            self._notify(changed)
+        return changed
+
+    def _notify(self, changed):
+        for callback in list(self._listeners):
+            try:
+                callback(dict(changed))
+            except Exception as e:
+                print(f"Config listener failed: {e}")
+
+    # --- 保存 ---
+
+    def schedule_save(self):
+        """延迟保存，期间的修改合并成一次写盘"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """立即保存未写盘的修改 (原子替换)"""
+        with self._save_lock:
+            return self._write()
+
+    def _write(self):
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._dirty:
+                return True
+            data = dict(self._data)
+            self._dirty = False
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            return True
+        except OSError as e:
+            print(f"Error saving config: {e}")
+            with self._lock:
+                self._dirty = True
+            return False
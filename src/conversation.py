@@ -0,0 +1,117 @@
+# 每条消息在聊天模板中的额外开销 (角色标记、换行等) 的估计值
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 摘要作为一轮 用户/助手 对话放在历史最前面：很多聊天模板 (ChatML 的一些变体、Gemma、Llama-2)
+# 不接受第一条以外的 system 消息，或者要求用户和助手交替出现
+SUMMARY_NOTE = "(之前聊过的内容摘要)\n{summary}"
+SUMMARY_ACK = "嗯，这些我都记得。"
+
+# 超出预算时压缩到预算的这个比例，留出余量，避免每一轮都重新压缩导致 KV 缓存失效
+COMPACT_RATIO = 0.6
+
+
+def _snippet(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+class ConversationMemory:
+    """
+    有限的多轮对话记忆。
+
+    最近的对话原样保留，用模型自己的分词器计算 token 数；超出预算时把最早的几轮
+    压缩成一段滚动摘要。消息顺序固定为 [摘要] + 最近几轮，每次新对话只在末尾追加，
+    llama 会复用已评估的最长公共前缀，所以多轮对话不会因为历史变长而越来越慢；
+    只有发生压缩时才需要重新评估摘要之后的内容。
+    """
+
+    def __init__(self, count_tokens, max_turns=8, summary_max_chars=300, snippet_chars=30):
+        self.count_tokens = count_tokens  # text -> token 数
+        self.max_turns = max_turns
+        self.summary_max_chars = summary_max_chars
+        self.snippet_chars = snippet_chars
+        self.turns = []       # [{"user", "assistant", "tokens"}]
+        self.summary_lines = []
+        self._summary_tokens = None
+
+    def clear(self):
+        self.turns = []
+        self.summary_lines = []
+        self._summary_tokens = None
+
+    def invalidate_token_counts(self):
+        """换了分词器 (模型) 后重新计算 token 数"""
+        for turn in self.turns:
+            turn["tokens"] = None
+        self._summary_tokens = None
+
+    def add_turn(self, user_text, assistant_text):
+        if self.max_turns <= 0:
+            return
+        self.turns.append({"user": user_text, "assistant": assistant_text, "tokens": None})
+        overflow = len(self.turns) - self.max_turns
+        if overflow > 0:
+            self._summarize(overflow)
+
+    @property
+    def summary(self):
+        return "\n".join(self.summary_lines)
+
+    def messages(self):
+        """历史消息 (插在固定前缀之后、新的用户消息之前)"""
+        messages = []
+        if self.summary_lines:
+            messages.append({"role": "user", "content": SUMMARY_NOTE.format(summary=self.summary)})
+            messages.append({"role": "assistant", "content": SUMMARY_ACK})
+        for turn in self.turns:
+            messages.append({"role": "user", "content": turn["user"]})
+            messages.append({"role": "assistant", "content": turn["assistant"]})
+        return messages
+
+    def pack(self, budget_tokens):
+        """返回不超过 budget_tokens 的历史消息，超出时先压缩"""
+        if budget_tokens <= 0:
+            return []
+        if self.token_cost() > budget_tokens:
+            self._compact(int(budget_tokens * COMPACT_RATIO))
+        return self.messages()
+
+    def token_cost(self):
+        cost = self._summary_cost()
+        for turn in self.turns:
+            cost += self._turn_cost(turn)
+        return cost
+
+    def _turn_cost(self, turn):
+        if turn["tokens"] is None:
+            turn["tokens"] = (self.count_tokens(turn["user"]) + self.count_tokens(turn["assistant"])
+                              + 2 * MESSAGE_OVERHEAD_TOKENS)
+        return turn["tokens"]
+
+    def _summary_cost(self):
+        if not self.summary_lines:
+            return 0
+        if self._summary_tokens is None:
+            self._summary_tokens = (self.count_tokens(SUMMARY_NOTE.format(summary=self.summary))
+                                    + self.count_tokens(SUMMARY_ACK) + 2 * MESSAGE_OVERHEAD_TOKENS)
+        return self._summary_tokens
+
+    def _summarize(self, count):
+        """把最早的 count 轮对话压缩进摘要"""
+        for turn in self.turns[:count]:
+            self.summary_lines.append(
+                f"主人说「{_snippet(turn['user'], self.snippet_chars)}」，"
+                f"我回答「{_snippet(turn['assistant'], self.snippet_chars)}」"
+            )
+        del self.turns[:count]
+        # 摘要本身也有长度上限，最旧的内容先忘掉
+        while self.summary_lines and len(self.summary) > self.summary_max_chars:
+            self.summary_lines.pop(0)
+        self._summary_tokens = None
+
+    def _compact(self, target_tokens):
+        while self.turns and self.token_cost() > target_tokens:
+            self._summarize(1)
+        while self.summary_lines and self.token_cost() > target_tokens:
+            self.summary_lines.pop(0)
+            self._summary_tokens = None
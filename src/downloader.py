@@ -0,0 +1,329 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import requests
+
+import gguf
+
+# 并行连接数，以及每段的最小大小 (文件太小时少开几个连接)
+SEGMENTS = 4
+MIN_SEGMENT_BYTES = 8 * 1024 * 1024
+# 每次从网络读取的大小，攒够 WRITE_BUFFER_BYTES 再写盘
+CHUNK_BYTES = 256 * 1024
+WRITE_BUFFER_BYTES = 4 * 1024 * 1024
+# 进度文件的保存间隔 (秒)，中断后从这里继续
+STATE_SAVE_INTERVAL = 1.0
+# 同一段连续失败的重试次数 (每次有进展后重新计数)，重试间隔逐次翻倍
+MAX_RETRIES = 5
+RETRY_DELAY = 1.0
+TIMEOUT = (10, 30)  # 连接 / 读取超时 (秒)
+
+STATE_VERSION = 1
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _sha256_from_headers(headers):
+    """Hugging Face 等 LFS 服务会在 X-Linked-Etag / ETag 中给出文件的 SHA-256"""
+    for name in ("X-Linked-Etag", "ETag"):
+        value = headers.get(name, "").strip().strip('"').lower()
+        if value.startswith("w/"):
+            continue
+        if _SHA256_RE.match(value):
+            return value
+    return None
+
+
+def file_sha256(path, block_size=4 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RemoteFile:
+    """下载前探测到的远程文件信息"""
+
+    def __init__(self, url, size, accept_ranges, etag, sha256):
+        self.url = url
+        self.size = size                    # 未知时为 None
+        self.accept_ranges = accept_ranges  # 是否支持 Range 请求 (分段、续传)
+        self.etag = etag
+        self.sha256 = sha256
+
+
+def probe(session, url):
+    """HEAD 请求获取大小、是否支持续传和校验值 (跟随重定向，每一跳的头都检查)"""
+    r = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+    if r.status_code in (403, 405):
+        # 不支持 HEAD 的服务器：发 GET 只读响应头
+        r = session.get(url, stream=True, timeout=TIMEOUT)
+        r.close()
+    r.raise_for_status()
+    sha256 = None
+    for response in list(r.history) + [r]:
+        sha256 = sha256 or _sha256_from_headers(response.headers)
+    size = int(r.headers.get("Content-Length", 0)) or None
+    if r.headers.get("Content-Encoding"):
+        size = None  # 压缩传输时 Content-Length 不是文件大小
+    accept_ranges = size is not None and r.headers.get("Accept-Ranges", "").lower() == "bytes"
+    return RemoteFile(r.url, size, accept_ranges, r.headers.get("ETag"), sha256)
+
+
+class Downloader:
+    """
+    可续传的多连接下载：按 Range 分成几段并行下载到 <目标>.part，
+    进度保存在 <目标>.part.json，中断后再次运行从断点继续。
+    下载完成后校验 SHA-256 和 GGUF 文件头，通过后才原子改名为目标文件，
+    所以目标路径上不会出现下载了一半的模型。
+    """
+
+    def __init__(self, url, dest_path, sha256=None, segments=SEGMENTS, session=None,
+                 progress_callback=None):
+        self.url = url
+        self.dest_path = dest_path
+        self.part_path = dest_path + ".part"
+        self.state_path = dest_path + ".part.json"
+        self.sha256 = sha256.lower() if sha256 else None
+        self.segments = max(1, segments)
+        self.session = session or requests.Session()
+        self.progress_callback = progress_callback
+
+        self.remote = None
+        self.ranged = False
+        self.plan = []  # [{"start", "end" (含), "done"}]
+        self.resumed_bytes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._errors = []
+
+    # --- 断点信息 ---
+
+    def _new_plan(self, size):
+        if not self.ranged:
+            return [{"start": 0, "end": size - 1 if size else None, "done": 0}]
+        count = max(1, min(self.segments, size // MIN_SEGMENT_BYTES))
+        step = -(-size // count)
+        return [{"start": start, "end": min(start + step, size) - 1, "done": 0}
+                for start in range(0, size, step)]
+
+    def _load_state(self):
+        """上次中断留下的进度，与远程文件一致时才使用"""
+        remote = self.remote
+        if not self.ranged or not os.path.exists(self.part_path) or not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (state.get("version") != STATE_VERSION or state.get("size") != remote.size
+                or state.get("etag") != remote.etag or os.path.getsize(self.part_path) != remote.size):
+            return None
+        return state.get("segments")
+
+    def _save_state(self):
+        if not self.ranged:
+            return
+        with self._lock:
+            state = {
+                "version": STATE_VERSION,
+                "url": self.url,
+                "size": self.remote.size,
+                "etag": self.remote.etag,
+                "segments": [dict(seg) for seg in self.plan],
+            }
+        tmp_path = self.state_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            print(f"Failed to save download state: {e}")
+
+    def _discard(self):
+        for path in (self.part_path, self.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # --- 下载 ---
+
+    def downloaded_bytes(self):
+        with self._lock:
+            return sum(seg["done"] for seg in self.plan)
+
+    def _remaining(self, seg):
+        if seg["end"] is None:
+            return None
+        return seg["end"] - seg["start"] + 1 - seg["done"]
+
+    def _write(self, f, seg, buffer):
+        if not buffer:
+            return
+        remaining = self._remaining(seg)
+        if remaining is not None and len(buffer) > remaining:
+            del buffer[remaining:]  # 服务器多发的部分不属于这一段
+        f.write(buffer)
+        f.flush()
+        with self._lock:
+            seg["done"] += len(buffer)
+
+    def _fetch(self, seg):
+        """下载一段的剩余部分，连接提前断开时抛出异常由调用方重试"""
+        if not self.ranged:
+            seg["done"] = 0  # 不支持续传，只能从头开始
+        start = seg["start"] + seg["done"]
+        headers = {}
+        if self.ranged:
+            headers["Range"] = f"bytes={start}-{seg['end']}"
+        with self.session.get(self.url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+            r.raise_for_status()
+            if self.ranged and r.status_code != 206:
+                raise DownloadError(f"server ignored range request (HTTP {r.status_code})")
+            with open(self.part_path, "r+b") as f:
+                f.seek(start)
+                buffer = bytearray()
+                try:
+                    for chunk in r.iter_content(CHUNK_BYTES):
+                        if self._stop.is_set():
+                            break
+                        buffer += chunk
+                        if len(buffer) >= WRITE_BUFFER_BYTES:
+                            self._write(f, seg, buffer)
+                            buffer = bytearray()
+                finally:
+                    # 连接中途断开时，已收到的数据也写下来，重试时从这里继续
+                    self._write(f, seg, buffer)
+                if not self.ranged:
+                    f.truncate()
+        if self._stop.is_set():
+            return
+        remaining = self._remaining(seg)
+        if remaining is None:
+            seg["end"] = seg["start"] + seg["done"] - 1
+        elif remaining > 0:
+            raise DownloadError(f"connection closed with {remaining} bytes left")
+
+    def _run_segment(self, seg):
+        attempt = 0
+        while not self._stop.is_set():
+            done = seg["done"]
+            try:
+                self._fetch(seg)
+                return
+            except (requests.RequestException, OSError, DownloadError) as e:
+                attempt = 1 if seg["done"] > done and self.ranged else attempt + 1
+                if attempt > MAX_RETRIES:
+                    self._errors.append(e)
+                    self._stop.set()
+                    return
+                delay = min(RETRY_DELAY * 2 ** (attempt - 1), 10)
+                print(f"\nSegment {seg['start']}- failed ({e}), retrying in {delay:.0f}s...")
+                self._stop.wait(delay)
+
+    def _report(self, speed):
+        if self.progress_callback is not None:
+            self.progress_callback(self.downloaded_bytes(), self.remote.size, speed)
+
+    def download(self):
+        """下载到 .part 文件，返回是否完整下载 (失败时保留进度，下次继续)"""
+        self.remote = probe(self.session, self.url)
+        self.ranged = self.remote.accept_ranges
+        plan = self._load_state()
+        if plan is not None:
+            self.plan = plan
+            self.resumed_bytes = self.downloaded_bytes()
+            print(f"Resuming download at {self.resumed_bytes / 1024 / 1024:.1f} MB")
+        else:
+            self._discard()
+            self.plan = self._new_plan(self.remote.size)
+            with open(self.part_path, "wb") as f:
+                if self.remote.size:
+                    f.truncate(self.remote.size)  # 预先占好空间，各段直接写到自己的位置
+        self._save_state()
+
+        pending = [seg for seg in self.plan if self._remaining(seg) != 0]
+        threads = [threading.Thread(target=self._run_segment, args=(seg,), daemon=True) for seg in pending]
+        for thread in threads:
+            thread.start()
+
+        last_save = last_time = time.monotonic()
+        last_bytes = self.downloaded_bytes()
+        try:
+            while True:
+                alive = [thread for thread in threads if thread.is_alive()]
+                if not alive:
+                    break
+                alive[0].join(0.5)
+                now = time.monotonic()
+                done = self.downloaded_bytes()
+                speed = (done - last_bytes) / max(now - last_time, 1e-6)
+                last_bytes, last_time = done, now
+                self._report(speed)
+                if now - last_save >= STATE_SAVE_INTERVAL:
+                    self._save_state()
+                    last_save = now
+        except KeyboardInterrupt:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self._save_state()
+            raise
+        self._save_state()
+        self._report(0.0)
+        if self._errors:
+            print(f"\nDownload failed: {self._errors[0]}")
+            return False
+        return not self._stop.is_set()
+
+    def cancel(self):
+        """停止下载 (可以在其它线程调用)，已下载的部分保留，下次继续"""
+        self._stop.set()
+
+    def verify(self):
+        """校验 .part 文件：大小、SHA-256 (已知时)、GGUF 文件头"""
+        if self.remote.size and os.path.getsize(self.part_path) != self.remote.size:
+            return False, "size mismatch"
+        expected = self.sha256 or self.remote.sha256
+        if expected:
+            actual = file_sha256(self.part_path)
+            if actual != expected:
+                return False, f"sha256 mismatch: expected {expected}, got {actual}"
+        else:
+            print("\nWarning: no SHA-256 available, only checking the file header.")
+        if self.dest_path.endswith(".gguf"):
+            ok, reason = gguf.check_header(self.part_path)
+            if not ok:
+                return False, reason
+        return True, "sha256 ok" if expected else "header ok"
+
+    def run(self):
+        """下载 + 校验 + 原子改名，返回是否成功"""
+        if not self.download():
+            return False
+        ok, reason = self.verify()
+        if not ok:
+            # 内容已损坏，续传也没有意义
+            print(f"\nVerification failed: {reason}")
+            self._discard()
+            return False
+        os.replace(self.part_path, self.dest_path)
+        try:
+            os.remove(self.state_path)
+        except FileNotFoundError:
+            pass
+        print(f"\nVerified ({reason}).")
+        return True
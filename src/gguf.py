@@ -0,0 +1,176 @@
+import os
+import struct
+from collections import Counter
+
+GGUF_MAGIC = b"GGUF"
+# llama.cpp 能读取的 GGUF 版本
+SUPPORTED_VERSIONS = (2, 3)
+DEFAULT_ALIGNMENT = 32
+
+# 元数据值类型
+_UINT8, _INT8, _UINT16, _INT16, _UINT32, _INT32, _FLOAT32, _BOOL, _STRING, _ARRAY, _UINT64, _INT64, _FLOAT64 = range(13)
+_SCALAR_FORMATS = {
+    _UINT8: "<B", _INT8: "<b", _UINT16: "<H", _INT16: "<h", _UINT32: "<I", _INT32: "<i",
+    _FLOAT32: "<f", _BOOL: "<?", _UINT64: "<Q", _INT64: "<q", _FLOAT64: "<d",
+}
+
+# 超过这个长度的字符串 (例如聊天模板) 不保存内容，只记录长度
+MAX_STRING_VALUE = 256
+
+# 张量类型 -> (名字, 每块元素数, 每块字节数)
+GGML_TYPES = {
+    0: ("F32", 1, 4), 1: ("F16", 1, 2), 2: ("Q4_0", 32, 18), 3: ("Q4_1", 32, 20),
+    6: ("Q5_0", 32, 22), 7: ("Q5_1", 32, 24), 8: ("Q8_0", 32, 34), 9: ("Q8_1", 32, 36),
+    10: ("Q2_K", 256, 84), 11: ("Q3_K", 256, 110), 12: ("Q4_K", 256, 144), 13: ("Q5_K", 256, 176),
+    14: ("Q6_K", 256, 210), 15: ("Q8_K", 256, 292), 16: ("IQ2_XXS", 256, 66), 17: ("IQ2_XS", 256, 74),
+    18: ("IQ3_XXS", 256, 98), 19: ("IQ1_S", 256, 50), 20: ("IQ4_NL", 32, 18), 21: ("IQ3_S", 256, 110),
+    22: ("IQ2_S", 256, 82), 23: ("IQ4_XS", 256, 136), 24: ("I8", 1, 1), 25: ("I16", 1, 2),
+    26: ("I32", 1, 4), 27: ("I64", 1, 8), 28: ("F64", 1, 8), 29: ("IQ1_M", 256, 56),
+    30: ("BF16", 1, 2), 34: ("TQ1_0", 256, 54), 35: ("TQ2_0", 256, 66),
+}
+
+# general.file_type -> 量化名
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1", 10: "Q2_K",
+    11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M", 16: "Q5_K_S",
+    17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S", 22: "IQ3_XS",
+    23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M", 28: "IQ2_S",
+    29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16",
+}
+
+# 防止损坏的文件让解析陷入超大循环
+_MAX_COUNT = 1 << 24
+
+
+class GGUFError(Exception):
+    pass
+
+
+def _read(f, fmt):
+    size = struct.calcsize(fmt)
+    data = f.read(size)
+    if len(data) < size:
+        raise GGUFError("unexpected end of file")
+    return struct.unpack(fmt, data)
+
+
+def _read_string(f, keep=True):
+    (length,) = _read(f, "<Q")
+    if length > 1 << 30:
+        raise GGUFError("string too long")
+    if not keep or length > MAX_STRING_VALUE:
+        f.seek(length, os.SEEK_CUR)
+        return None if not keep else {"length": length}
+    data = f.read(length)
+    if len(data) < length:
+        raise GGUFError("unexpected end of file")
+    return data.decode("utf-8", errors="replace")
+
+
+def _read_value(f, value_type):
+    if value_type in _SCALAR_FORMATS:
+        return _read(f, _SCALAR_FORMATS[value_type])[0]
+    if value_type == _STRING:
+        return _read_string(f)
+    if value_type == _ARRAY:
+        item_type, count = _read(f, "<IQ")
+        if count > _MAX_COUNT:
+            raise GGUFError("array too long")
+        # 数组 (词表等) 只记录长度，内容直接跳过
+        if item_type in _SCALAR_FORMATS:
+            f.seek(struct.calcsize(_SCALAR_FORMATS[item_type]) * count, os.SEEK_CUR)
+        elif item_type == _STRING:
+            for _ in range(count):
+                _read_string(f, keep=False)
+        else:
+            for _ in range(count):
+                _read_value(f, item_type)
+        return {"array": count}
+    raise GGUFError(f"unknown value type {value_type}")
+
+
+def read_header(path):
+    """
+    只读取 GGUF 的元数据和张量信息 (不读取权重)。
+    返回 dict：version、metadata、parameter_count、tensor_bytes、tensor_types、complete 等；
+    不是有效的 GGUF 时抛出 GGUFError。
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb", buffering=1 << 16) as f:
+        if f.read(4) != GGUF_MAGIC:
+            raise GGUFError("not a GGUF file")
+        version, tensor_count, kv_count = _read(f, "<IQQ")
+        if version not in SUPPORTED_VERSIONS:
+            raise GGUFError(f"unsupported GGUF version {version}")
+        if tensor_count > _MAX_COUNT or kv_count > _MAX_COUNT:
+            raise GGUFError("corrupted header")
+
+        metadata = {}
+        for _ in range(kv_count):
+            key = _read_string(f)
+            (value_type,) = _read(f, "<I")
+            metadata[key] = _read_value(f, value_type)
+
+        parameter_count = 0
+        tensor_bytes = 0
+        tensor_types = Counter()  # 类型名 -> 字节数
+        data_end = 0
+        for _ in range(tensor_count):
+            _read_string(f, keep=False)
+            (n_dims,) = _read(f, "<I")
+            if n_dims > 8:
+                raise GGUFError("corrupted tensor info")
+            dims = _read(f, f"<{n_dims}Q")
+            tensor_type, offset = _read(f, "<IQ")
+            elements = 1
+            for dim in dims:
+                elements *= dim
+            name, block, block_bytes = GGML_TYPES.get(tensor_type, (f"type{tensor_type}", 1, 0))
+            size = elements // block * block_bytes
+            parameter_count += elements
+            tensor_bytes += size
+            tensor_types[name] += size
+            data_end = max(data_end, offset + size)
+
+        alignment = metadata.get("general.alignment", DEFAULT_ALIGNMENT)
+        if not isinstance(alignment, int) or alignment <= 0:
+            alignment = DEFAULT_ALIGNMENT
+        data_offset = -(-f.tell() // alignment) * alignment
+
+    return {
+        "version": version,
+        "metadata": metadata,
+        "tensor_count": tensor_count,
+        "parameter_count": parameter_count,
+        "tensor_bytes": tensor_bytes,
+        "tensor_types": dict(tensor_types),
+        "file_size": file_size,
+        # 文件比张量数据的末尾短，说明下载不完整
+        "complete": data_offset + data_end <= file_size,
+    }
+
+
+def quantization_name(header):
+    """量化类型：优先使用 general.file_type，否则取占用最多的张量类型"""
+    file_type = header["metadata"].get("general.file_type")
+    if file_type in FILE_TYPES:
+        return FILE_TYPES[file_type]
+    types = header["tensor_types"]
+    return max(types, key=types.get) if types else "?"
+
+
+def check_header(path):
+    """检查文件头是否是可用的 GGUF，返回 (是否有效, 原因)"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(24)
+    except OSError as e:
+        return False, str(e)
+    if len(head) < 24 or head[:4] != GGUF_MAGIC:
+        return False, "not a GGUF file"
+    version, tensor_count, kv_count = struct.unpack("<IQQ", head[4:24])
+    if version not in SUPPORTED_VERSIONS:
+        return False, f"unsupported GGUF version {version}"
+    if tensor_count == 0 or kv_count == 0:
+        return False, "empty GGUF header"
+    return True, f"GGUF v{version}, {tensor_count} tensors"
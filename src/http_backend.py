@@ -0,0 +1,212 @@
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+from llm_client import LLMClient, DEFAULT_SAMPLING
+
+# OpenAI 兼容的本地 HTTP 后端 (llama.cpp 的 server、LM Studio、Ollama 等)：
+# 提示词、对话记忆、回复缓存仍然在本地处理，只把生成交给服务端，桌宠进程不需要加载 GGUF。
+
+DEFAULT_HTTP_URL = "http://127.0.0.1:8080/v1"
+CONNECT_TIMEOUT = 3.0
+# 两段数据之间最长等待时间 (秒)，服务端卡住时不让对话一直挂着
+READ_TIMEOUT = 60.0
+# 还没收到任何输出时，连接失败或服务端暂时不可用 (5xx / 429) 的重试次数
+MAX_RETRIES = 2
+RETRY_DELAY = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# 没有分词器时估计 token 数：非 ASCII 字符 (汉字等) 按每字一个 token，ASCII 按每 4 个字符一个 token
+ASCII_CHARS_PER_TOKEN = 4
+
+
+class HttpError(Exception):
+    pass
+
+
+class HttpModel:
+    """服务端模型在本进程里的占位 (LLMClient.llm 不为 None 表示模型可用)"""
+
+    def __init__(self, name):
+        self.model_path = name
+        self.chat_format = "openai"
+
+
+class HttpLLMClient(LLMClient):
+    """
+    接口与 LLMClient 相同的 HTTP 客户端。一个 keep-alive 的 requests.Session 复用连接，
+    流式回复按 SSE 读取；取消或回复已经够长时直接关闭响应，服务端随之停止生成。
+    """
+
+    def __init__(self, model_path, config=None, session=None):
+        super().__init__(model_path, config=config)
+        self.base_url = (self.config.get("http_url") or DEFAULT_HTTP_URL).rstrip("/")
+        self.model_name = self.config.get("http_model")  # 为空时使用服务端列出的第一个模型
+        self.timeout = (CONNECT_TIMEOUT, self.config.get("http_timeout", READ_TIMEOUT))
+        self.session = session or requests.Session()
+        # 对话是串行的，一个连接就够；再留一个给取消后重新发起的请求
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        api_key = self.config.get("http_api_key")
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self.request_stats = {"requests": 0, "retries": 0, "errors": 0}
+
+    def count_tokens(self, text):
+        """服务端的分词器不在本地，按字符估计 (宁可多估，保证历史不会撑爆上下文)"""
+        if not text:
+            return 0
+        ascii_chars = sum(1 for c in text if c < "\x80")
+        return len(text) - ascii_chars + -(-ascii_chars // ASCII_CHARS_PER_TOKEN)
+
+    def _send(self, method, path, **kwargs):
+        """发送请求，连接失败和 5xx / 429 时重试；返回成功的响应，否则抛出 HttpError"""
+        url = f"{self.base_url}{path}"
+        for attempt in range(MAX_RETRIES + 1):
+            self.request_stats["requests"] += 1
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code not in RETRY_STATUS:
+                    if response.status_code >= 400:
+                        detail = response.text[:200]
+                        response.close()
+                        raise HttpError(f"HTTP {response.status_code}: {detail}")
+                    return response
+                error = f"HTTP {response.status_code}"
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            if attempt < MAX_RETRIES:
+                self.request_stats["retries"] += 1
+                time.sleep(RETRY_DELAY * (attempt + 1))
+        self.request_stats["errors"] += 1
+        raise HttpError(error)
+
+    # --- LLMClient 接口 ---
+
+    def load_model(self, progress_callback=None):
+        """不加载任何东西，只确认服务端可用并确定模型名"""
+        self.load_timings = {}
+        start = time.perf_counter()
+        if progress_callback:
+            progress_callback("connect", 0)
+        try:
+            response = self._send("GET", "/models")
+            models = [m.get("id") for m in response.json().get("data", [])]
+        except (HttpError, ValueError, requests.RequestException) as e:
+            print(f"LLM server not available at {self.base_url}: {e}")
+            self.llm = None
+            return False
+        if not self.model_name:
+            self.model_name = models[0] if models else ""
+        self.llm = HttpModel(self.model_name)
+        self._model_fp = f"{self.base_url}|{self.model_name}"
+        self._prompts.clear()
+        self.load_timings["connect"] = time.perf_counter() - start
+        if progress_callback:
+            progress_callback("connect", 100)
+        print(f"Using LLM server {self.base_url} (model {self.model_name or '?'})")
+        return True
+
+    def can_load_alongside(self, model_path):
+        return False
+
+    def reload_in_place(self, model_path, progress_callback=None):
+        # 模型由服务端决定，这里只重新检查连接
+        self.model_path = model_path
+        return self.load_model(progress_callback)
+
+    def unload(self):
+        with self.lock:
+            self.llm = None
+            self._prompts.clear()
+
+    def close(self):
+        self.session.close()
+        super().close()
+
+    def _payload(self, messages):
+        options = self.sampling_options()
+        payload = {
+            "messages": messages,
+            "stream": True,
+            "stop": ["[", "\n\n"],
+            "max_tokens": options["max_tokens"],
+            "temperature": options["temperature"],
+            "top_p": options["top_p"],
+        }
+        if self.model_name:
+            payload["model"] = self.model_name
+        # llama.cpp server、LM Studio 等本地服务支持的扩展采样参数
+        for key in DEFAULT_SAMPLING:
+            if key not in payload:
+                payload[key] = options[key]
+        return payload
+
+    def _stream_deltas(self, response):
+        """
+        解析 SSE：每个 "data: {...}" 行是一段增量，"data: [DONE]" 表示结束。
+        自然结束时 [DONE] 之后继续读到响应结束，读完的连接才能放回连接池复用；
+        调用方因为取消或字数预算提前停止时直接关闭响应，这个连接不再复用 (读完要等服务端生成完)，
+        下一次请求重新建立连接。
+        """
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                continue
+            choices = json.loads(data).get("choices") or [{}]
+            delta = self._choice_text(choices[0])
+            if delta:
+                yield delta
+
+    def chat(self, user_input, cancel_event=None):
+        return "".join(self.chat_stream(user_input, cancel_event)).strip()
+
+    def chat_stream(self, user_input, cancel_event=None):
+        if not self.llm:
+            yield "呜呜...大脑连不上了(请检查 LLM 服务是否在运行)"
+            return
+
+        try:
+            with self.lock:
+                prompt = self._compiled_prompt()
+                cache_key = self._reply_cache_key(prompt, user_input)
+                cached = self._cached_reply(cache_key)
+                if cached is not None:
+                    self.memory.add_turn(user_input, cached)
+                    yield cached
+                    return
+
+                messages = self._build_messages(prompt, user_input)
+                # 服务端没有本地的停止条件：按收到的文字判断，回复够长并且停在句末时主动断开
+                stopper = self.reply_budget.stopper(None, user_input)
+                response = self._send("POST", "/chat/completions", json=self._payload(messages), stream=True)
+                parts = []
+                try:
+                    for delta in self._stream_deltas(response):
+                        if cancel_event is not None and cancel_event.is_set():
+                            break
+                        if not parts:
+                            delta = delta.lstrip()
+                            if delta.startswith(":"):
+                                delta = delta[1:].lstrip()
+                            if not delta:
+                                continue
+                        parts.append(delta)
+                        yield delta
+                        if stopper is not None and stopper.feed(delta, self.count_tokens(delta)):
+                            break
+                finally:
+                    response.close()
+
+                response_text = "".join(parts).strip()
+                if response_text and not (cancel_event is not None and cancel_event.is_set()):
+                    self.reply_budget.record(stopper, self.sampling_options()["max_tokens"])
+                    self.memory.add_turn(user_input, response_text)
+                    if cache_key is not None:
+                        self.reply_cache.add(cache_key, response_text)
+        except (HttpError, requests.RequestException, ValueError) as e:
+            yield f"我想不出来了... ({str(e)})"
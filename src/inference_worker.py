@@ -0,0 +1,299 @@
+import threading
+import time
+from collections import deque
+from PySide6.QtCore import QThread, Signal
+import memstat
+from metrics import METRICS
+
+
+class InferenceJob:
+    """推理队列中的一项任务 (加载模型、切换模型或一次对话)"""
+
+    def __init__(self, kind, request_id, text=None, stream=False, payload=None):
+        self.kind = kind              # "load" / "reload" / "unload" / "chat" / "swap" / "adopt"
+        self.request_id = request_id
+        self.text = text
+        self.stream = stream
+        self.payload = payload
+        self.enqueued_at = time.monotonic()
+        self.cancel_event = threading.Event()
+
+
+class InferenceWorker(QThread):
+    """
+    常驻推理线程，独占模型。
+    所有加载和对话请求都通过队列串行执行；新消息会取代队列中尚未开始的旧消息，
+    并可以通过停止条件中断正在生成的回复，避免连续输入堆积大量 CPU 计算。
+    """
+    token_ready = Signal(int, str)       # 请求 id, 新生成的文本
+    response_ready = Signal(int, str)    # 请求 id, 完整回复
+    request_started = Signal(int, float) # 请求 id, 排队等待时间 (秒)
+    request_cancelled = Signal(int)      # 请求 id
+    load_progress = Signal(str, int)     # 阶段, 百分比
+    model_loaded = Signal(bool, dict)    # 是否成功, 各阶段耗时
+    model_unloaded = Signal(dict)        # 卸载前后的常驻内存 (rss_before, rss_after)
+    swap_progress = Signal(str, int)     # 切换模型时新模型的加载阶段, 百分比
+    swap_finished = Signal(bool, str, dict)  # 是否成功, 正在使用的模型路径, 切换统计
+
+    def __init__(self, llm_client, supersede_running=True, parent=None):
+        super().__init__(parent)
+        self.llm_client = llm_client
+        self.supersede_running = supersede_running  # 新消息是否中断正在生成的回复
+
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._current = None
+        self._running = True
+        self._next_id = 1
+        self._swapping = False
+
+        # 排队统计
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self.superseded_count = 0
+
+    @property
+    def queue_depth(self):
+        """排队中的任务数 (不含正在执行的任务)"""
+        with self._cond:
+            return len(self._jobs)
+
+    @property
+    def busy(self):
+        with self._cond:
+            return self._current is not None
+
+    @property
+    def swapping(self):
+        with self._cond:
+            return self._swapping
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": len(self._jobs),
+                "busy": self._current is not None,
+                "last_wait": self.last_wait,
+                "max_wait": self.max_wait,
+                "superseded": self.superseded_count,
+            }
+
+    def _enqueue(self, job):
+        with self._cond:
+            self._jobs.append(job)
+            self._cond.notify()
+        return job.request_id
+
+    def _new_id(self):
+        with self._cond:
+            request_id = self._next_id
+            self._next_id += 1
+        return request_id
+
+    def request_load(self):
+        """排队加载模型"""
+        return self._enqueue(InferenceJob("load", self._new_id()))
+
+    def request_reload(self):
+        """排队重新加载空闲时卸载的模型，完成后同样发出 model_loaded"""
+        return self._enqueue(InferenceJob("reload", self._new_id()))
+
+    def request_unload(self):
+        """排队卸载模型 (空闲时释放内存)，排在前面的对话照常完成"""
+        return self._enqueue(InferenceJob("unload", self._new_id()))
+
+    def request_swap(self, model_path):
+        """
+        切换到另一个模型，同一时间只进行一次切换 (正在切换时返回 False)。
+        可用内存足够时在后台线程加载新模型，旧模型继续回答，加载完成后在两次对话之间换上；
+        否则排队先卸载旧模型再加载新模型，保证内存中最多只有两个模型。
+        """
+        with self._cond:
+            if self._swapping:
+                return False
+            self._swapping = True
+        info = {"rss_before": memstat.current_rss(), "started": time.monotonic()}
+        if self.llm_client.llm is not None and self.llm_client.can_load_alongside(model_path):
+            info["mode"] = "background"
+            threading.Thread(target=self._load_standby, args=(model_path, info), daemon=True).start()
+        else:
+            info["mode"] = "in_place"
+            self._enqueue(InferenceJob("swap", self._new_id(), text=model_path, payload=info))
+        return True
+
+    def submit(self, text, stream=False):
+        """提交一条对话，返回请求 id。排队中的旧对话会被丢弃。"""
+        job = InferenceJob("chat", self._new_id(), text=text, stream=stream)
+        with self._cond:
+            # 合并：排队中尚未开始的旧消息已经过时，直接丢弃
+            for pending in [j for j in self._jobs if j.kind == "chat"]:
+                pending.cancel_event.set()
+                self._jobs.remove(pending)
+                self.superseded_count += 1
+            # 中断正在生成的旧回复
+            if self.supersede_running and self._current is not None and self._current.kind == "chat":
+                self._current.cancel_event.set()
+                self.superseded_count += 1
+            self._jobs.append(job)
+            self._cond.notify()
+        return job.request_id
+
+    def cancel_all(self):
+        """取消所有排队和正在进行的对话"""
+        with self._cond:
+            for job in [j for j in self._jobs if j.kind == "chat"]:
+                job.cancel_event.set()
+                self._jobs.remove(job)
+            if self._current is not None and self._current.kind == "chat":
+                self._current.cancel_event.set()
+
+    def stop(self):
+        """停止线程 (等待当前任务结束)"""
+        with self._cond:
+            self._running = False
+            if self._current is not None:
+                self._current.cancel_event.set()
+            self._cond.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._jobs:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                job = self._jobs.popleft()
+                self._current = job
+            try:
+                if job.kind == "load":
+                    self._run_load()
+                elif job.kind == "reload":
+                    self._run_load(reload=True)
+                elif job.kind == "unload":
+                    self._run_unload()
+                elif job.kind == "swap":
+                    self._run_swap(job)
+                elif job.kind == "adopt":
+                    self._run_adopt(job)
+                else:
+                    self._run_chat(job)
+            except Exception as e:
+                print(f"Inference job {job.request_id} failed: {e}")
+                self._fail(job, e)
+            finally:
+                with self._cond:
+                    self._current = None
+
+    def _fail(self, job, error):
+        """任务抛出异常时照常发出结束信号，界面不会一直停在加载中、等待回复或切换中"""
+        try:
+            if job.kind in ("load", "reload"):
+                self.model_loaded.emit(False, dict(self.llm_client.load_timings))
+            elif job.kind == "unload":
+                rss = memstat.current_rss()
+                self.model_unloaded.emit({"rss_before": rss, "rss_after": rss})
+            elif job.kind == "swap":
+                self._finish_swap(False, job.payload)
+            elif job.kind == "adopt":
+                standby, info = job.payload
+                standby.unload()
+                self._finish_swap(False, info)
+            elif job.cancel_event.is_set():
+                self.request_cancelled.emit(job.request_id)
+            else:
+                self.response_ready.emit(job.request_id, f"我想不出来了... ({error})")
+        except Exception as e:
+            print(f"Failed to report inference job {job.request_id}: {e}")
+            with self._cond:
+                self._swapping = False
+
+    def _run_load(self, reload=False):
+        load = self.llm_client.reload_model if reload else self.llm_client.load_model
+        ok = load(progress_callback=self.load_progress.emit)
+        if ok:
+            self._record_load_timings()
+        self.model_loaded.emit(ok, dict(self.llm_client.load_timings))
+
+    def _run_unload(self):
+        info = {"rss_before": memstat.current_rss()}
+        self.llm_client.unload()
+        info["rss_after"] = memstat.current_rss()
+        METRICS.count("model.unloaded")
+        self.model_unloaded.emit(info)
+
+    def _record_load_timings(self):
+        for phase, seconds in self.llm_client.load_timings.items():
+            METRICS.record(f"load.{phase}", seconds * 1000.0, "ms")
+
+    def _load_standby(self, model_path, info):
+        """后台线程：加载新模型，完成后排队等待换上"""
+        try:
+            standby = self.llm_client.load_standby(model_path, progress_callback=self.swap_progress.emit)
+        except Exception as e:
+            print(f"Failed to load standby model: {e}")
+            standby = None
+        info["rss_loaded"] = memstat.current_rss()
+        if standby is None:
+            self._finish_swap(False, info)
+            return
+        self._enqueue(InferenceJob("adopt", self._new_id(), payload=(standby, info)))
+
+    def _run_adopt(self, job):
+        standby, info = job.payload
+        self.llm_client.adopt(standby)
+        self._finish_swap(True, info)
+
+    def _run_swap(self, job):
+        info = job.payload
+        ok = self.llm_client.reload_in_place(job.text, progress_callback=self.swap_progress.emit)
+        info["rss_loaded"] = memstat.current_rss()
+        self._finish_swap(ok, info)
+
+    def _finish_swap(self, ok, info):
+        info["seconds"] = time.monotonic() - info.pop("started")
+        info["rss_after"] = memstat.current_rss()
+        info["peak_rss"] = memstat.peak_rss()
+        if ok:
+            info["timings"] = dict(self.llm_client.load_timings)
+            self._record_load_timings()
+        with self._cond:
+            self._swapping = False
+        self.swap_finished.emit(ok, self.llm_client.model_path or "", info)
+
+    def _run_chat(self, job):
+        wait = time.monotonic() - job.enqueued_at
+        self.last_wait = wait
+        self.max_wait = max(self.max_wait, wait)
+        METRICS.record("queue.wait", wait * 1000.0, "ms")
+        if job.cancel_event.is_set():
+            METRICS.count("chat.cancelled")
+            self.request_cancelled.emit(job.request_id)
+            return
+        self.request_started.emit(job.request_id, wait)
+
+        start = time.perf_counter()
+        if job.stream:
+            parts = []
+            first = None
+            for delta in self.llm_client.chat_stream(job.text, cancel_event=job.cancel_event):
+                if first is None:
+                    # 第一段输出之前的时间基本都花在评估提示词上
+                    first = time.perf_counter()
+                    METRICS.record("chat.first_token", (first - start) * 1000.0, "ms")
+                parts.append(delta)
+                self.token_ready.emit(job.request_id, delta)
+            response = "".join(parts).strip()
+            # 流式输出每段大约是一个 token
+            if first is not None and len(parts) > 1:
+                METRICS.record("chat.tokens_per_s", (len(parts) - 1) / max(time.perf_counter() - first, 1e-6),
+                               "tok/s")
+        else:
+            response = self.llm_client.chat(job.text, cancel_event=job.cancel_event)
+        METRICS.record("chat.total", (time.perf_counter() - start) * 1000.0, "ms")
+
+        if job.cancel_event.is_set():
+            METRICS.count("chat.cancelled")
+            self.request_cancelled.emit(job.request_id)
+        else:
+            self.response_ready.emit(job.request_id, response)
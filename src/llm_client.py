@@ -1,104 +1,856 @@
 import threading
 import os
 import sys
+import json
+import pickle
+import hashlib
+import time
+import random
+import importlib.util
+from collections import OrderedDict
 
-# 尝试导入，如果库本身有问题则跳过
-try:
-    from llama_cpp import Llama
-    HAS_LLAMA = True
-except ImportError:
-    HAS_LLAMA = False
+# llama_cpp 在第一次加载模型时才导入 (在推理线程里)：加载它的动态库要花不少时间，
+# 不应该挡在窗口显示之前。这里只检查是否安装，不导入。
+HAS_LLAMA = importlib.util.find_spec("llama_cpp") is not None
+if not HAS_LLAMA:
     print("Warning: llama-cpp-python not installed.")
 
+_llama_cpp = None
+
+
+def llama_cpp_module():
+    """导入并返回 llama_cpp 模块，没有安装或导入失败时返回 None"""
+    global _llama_cpp, HAS_LLAMA
+    if _llama_cpp is None and HAS_LLAMA:
+        try:
+            import llama_cpp
+            _llama_cpp = llama_cpp
+        except Exception as e:
+            HAS_LLAMA = False
+            print(f"Warning: failed to import llama-cpp-python: {e}")
+    return _llama_cpp
+
+
+def jinja2_chat_formatter():
+    """llama_cpp 的 Jinja2ChatFormatter 类，不可用时返回 None"""
+    if llama_cpp_module() is None:
+        return None
+    try:
+        from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+    except ImportError:
+        return None
+    return Jinja2ChatFormatter
+
+from conversation import ConversationMemory, MESSAGE_OVERHEAD_TOKENS
+from reply_cache import ReplyCache
+from persona import Persona
+from model_catalog import ModelCatalog, estimate_memory
+from speculative import (PromptLookupDraft, LlamaModelDraft, speculative_options,
+                         DEFAULT_MAX_NGRAM_SIZE)
+from reply_budget import ReplyBudget
+import memstat
+
+# 前缀缓存格式版本，修改提示词模板结构时递增，使旧缓存失效
+PREFIX_CACHE_VERSION = 2
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 内存中保留几份前缀状态和编译结果 (按角色设定)：推理服务里不同设定的桌宠轮流对话时，
+# 切换设定只需恢复状态，不用重新渲染模板、分词和评估前缀
+PREFIX_STATE_SLOTS = 3
+
+# 预读模型文件时的块大小
+PREFETCH_CHUNK_SIZE = 4 * 1024 * 1024
+
+# 运行参数默认值 (modle/config.json 中同名的键可以覆盖；值为 "auto" 或缺省时使用自动调优结果)
+DEFAULT_RUNTIME = {
+    "context_window": 2048,
+    "n_threads": 0,        # 0 表示按 CPU 核数自动选择
+    "n_threads_batch": 0,  # 0 表示与 n_threads 相同
+    "n_batch": 512,
+    "use_mmap": True,      # mmap 加载，重启同一模型时直接命中系统页缓存
+    "use_mlock": False,
+    "verbose": False,
+}
+
+# 采样参数默认值
+DEFAULT_SAMPLING = {
+    "max_tokens": 64,  # 进一步限制长度，防止废话
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "min_p": 0.05,
+    "repeat_penalty": 1.0,
+}
+
+# 与模型实例绑定的状态，热切换时整体替换
+MODEL_STATE = ("llm", "draft_model", "model_path", "context_size", "load_timings", "_model_fp",
+               "_formatters", "_prompts", "_prefix_key", "_prefix_states")
+
+# 自动调优结果，按模型文件保存
+TUNING_PATH = os.path.join(APP_ROOT, "modle", "tuning.json")
+
+
+def default_thread_count():
+    """没有调优结果时的线程数：大致按物理核心数估计"""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def model_file_key(model_path):
+    """调优结果的 key：文件名 + 大小 (同一模型换目录也能复用)"""
+    return f"{os.path.basename(model_path)}|{os.path.getsize(model_path)}"
+
+
+def load_tuning_profiles():
+    if not os.path.exists(TUNING_PATH):
+        return {}
+    try:
+        with open(TUNING_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Failed to read tuning profiles: {e}")
+        return {}
+
+
+def load_tuning_profile(model_path):
+    try:
+        return load_tuning_profiles().get(model_file_key(model_path), {})
+    except OSError:
+        return {}
+
+
+def save_tuning_profile(model_path, profile):
+    profiles = load_tuning_profiles()
+    profiles[model_file_key(model_path)] = profile
+    os.makedirs(os.path.dirname(TUNING_PATH), exist_ok=True)
+    tmp_path = TUNING_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, TUNING_PATH)
+
+
+def _remember(cache, key, value):
+    """放进按最近使用排序的小缓存，超出 PREFIX_STATE_SLOTS 时丢掉最久没用的"""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > PREFIX_STATE_SLOTS:
+        cache.popitem(last=False)
+
+
 class LLMClient:
-    def __init__(self, model_path, context_size=2048):
+    def __init__(self, model_path, config=None, llama_cls=None):
         self.model_path = model_path
+        self.config = dict(config or {})  # 应用配置 (modle/config.json)
+        self.llama_cls = llama_cls        # 替换 Llama 的实现 (基准测试中的假模型)
         self.llm = None
-        self.context_size = context_size
+        self.draft_model = None  # 投机解码的草稿来源 (见 speculative.py)，未开启时为 None
+        self.context_size = self.runtime_options()["context_window"]
         self.lock = threading.Lock()
+        self.load_timings = {}      # 最近一次加载各阶段耗时 (秒)
+        self._skip_prefetch = False # 空闲卸载后重新加载时不预读 (见 reload_model)
+        # 模型文件头信息 (架构、参数量等)，用于估计内存
+        self.catalog = ModelCatalog(os.path.join(APP_ROOT, "modle"))
+
+        # 静态前缀(系统提示词 + 示例对话)的 KV 缓存
+        self.cache_dir = os.path.join(APP_ROOT, "modle", "cache")
+        self._prefix_key = None    # 当前上下文中已评估好的前缀对应的 key
+        self._prefix_states = OrderedDict()  # 前缀 key -> 内存中的前缀状态 (LlamaState)，最近使用的在后
 
-    def load_model(self):
+        # 角色设定只编译一次，之后按模型渲染、分词一次并缓存
+        self.persona = Persona(os.path.join(APP_ROOT, "character.txt"))
+        self._model_fp = None      # 模型文件指纹，加载时计算一次
+        self._formatters = None    # (前缀, 完整提示词) 的模板格式化器；为 None 时使用 create_chat_completion
+        self._prompts = OrderedDict()  # Persona -> 该设定在当前模型上的编译结果，最近使用的在后
+
+        # 多轮对话记忆，按 token 预算装入上下文
+        self.memory = ConversationMemory(
+            self.count_tokens,
+            max_turns=self.config.get("memory_turns", 8)
+        )
+
+        # 投机解码统计：生成的 token 数、草稿 token 数、被接受的草稿数、主模型前向次数
+        self.speculative_stats = {"replies": 0, "tokens": 0, "drafted": 0, "accepted": 0, "passes": 0}
+
+        # 回复字数预算：达到后在句末提前结束生成
+        self.reply_budget = ReplyBudget(self.config)
+
+        # 常见问题的回复缓存 ("off" 关闭, "fill" 只记录不使用, "serve" 命中时直接回复)；默认只记录，需要时再开启
+        self.reply_cache_mode = "off"
+        self.reply_cache = None
+        self._apply_reply_cache_mode()
+
+    def apply_config(self, config):
+        """
+        换用另一份配置 (推理服务里轮流使用各桌宠的配置)，并更新由配置决定的状态：
+        回复预算、回复缓存模式、对话记忆的轮数。运行参数 (上下文长度等) 要重新加载模型才生效。
+        """
+        self.config = config
+        self.reply_budget.config = config
+        self._apply_reply_cache_mode()
+        if "memory_turns" in config:
+            self.memory.max_turns = config["memory_turns"]
+
+    def _apply_reply_cache_mode(self):
+        self.reply_cache_mode = self.config.get("reply_cache_mode", "fill")
+        if self.reply_cache_mode != "off" and self.reply_cache is None:
+            self.reply_cache = ReplyCache(os.path.join(self.cache_dir, "replies.json"))
+
+    def load_model(self, progress_callback=None):
         """
         加载模型。
+        progress_callback(phase, percent) 会在调用线程中被回调，用于汇报进度。
         """
-        if not HAS_LLAMA:
+        def report(phase, percent):
+            if progress_callback:
+                progress_callback(phase, percent)
+
+        self.load_timings = {}
+        if not HAS_LLAMA and self.llama_cls is None:
             return False
 
         if not self.model_path or not os.path.exists(self.model_path):
             print(f"Model not found at {self.model_path}")
             return False
-            
+
+        # 1. 顺序预读模型文件：冷启动时比缺页随机读更快，同时能给出真实的字节进度；
+        #    页缓存已经热的时候这一步几乎不花时间
+        if not self._skip_prefetch:
+            start = time.perf_counter()
+            self._prefetch_file(lambda percent: report("prefetch", percent))
+            self.load_timings["prefetch"] = time.perf_counter() - start
+
+        # 2. 导入 llama_cpp (第一次加载时) 并创建 Llama 实例
+        report("init", 0)
+        if self.llama_cls is None:
+            start = time.perf_counter()
+            if llama_cpp_module() is None:
+                return False
+            self.load_timings["import"] = time.perf_counter() - start
+        start = time.perf_counter()
         try:
-            print(f"Initializing Llama with model: {self.model_path}")
-            # 尝试最保守的加载配置
-            self.llm = Llama(
-                model_path=self.model_path,
-                n_ctx=self.context_size,
-                n_gpu_layers=0,  # 强制CPU
-                verbose=True,    # 开启日志
-                n_threads=1,     # 限制为单线程
-                use_mmap=False,  # 禁用mmap
-                use_mlock=False
-            )
+            options = self.runtime_options()
+            print(f"Initializing Llama with model: {self.model_path} ({options})")
+            self.context_size = options["context_window"]
+            self.draft_model = self._create_draft_model(options)
+            self.llm = self.create_llama(options)
             print("Model loaded successfully.")
-            return True
         except Exception as e:
             print(f"Failed to load model: {e}")
-            self.llm = None 
+            self.llm = None
             return False
+        self.load_timings["init"] = time.perf_counter() - start
+        report("init", 100)
+
+        # 换了模型实例后，之前的前缀状态和编译结果全部作废
+        self._prefix_key = None
+        self._prefix_states = OrderedDict()
+        self._prompts = OrderedDict()
+        self._model_fp = self._model_fingerprint()
+        self._formatters = self._create_formatters()
+
+        # 3. 预先评估静态前缀，让第一次回复也不用从头读提示词
+        report("prefix", 0)
+        start = time.perf_counter()
+        with self.lock:
+            self._ensure_prefix(self._compiled_prompt())
+        self.load_timings["prefix"] = time.perf_counter() - start
+        report("prefix", 100)
+
+        print("Load timings: " + ", ".join(f"{k}={v:.2f}s" for k, v in self.load_timings.items()))
+        return True
+
+    def runtime_options(self):
+        """合并运行参数：配置文件 > 自动调优结果 > 默认值"""
+        profile = {}
+        if self.model_path and os.path.exists(self.model_path):
+            profile = load_tuning_profile(self.model_path)
+        options = {}
+        for key, default in DEFAULT_RUNTIME.items():
+            value = self.config.get(key)
+            if value is None or value == "auto":
+                value = profile.get(key, default)
+            options[key] = value
+        if not options["n_threads"]:
+            options["n_threads"] = default_thread_count()
+        if not options["n_threads_batch"]:
+            options["n_threads_batch"] = options["n_threads"]
+        return options
 
-    def chat(self, user_input):
+    def create_llama(self, options):
+        """按运行参数创建 Llama 实例 (自动调优也使用这里)"""
+        llama_cls = self.llama_cls or llama_cpp_module().Llama
+        kwargs = {}
+        if self.draft_model is not None:
+            kwargs["draft_model"] = self.draft_model
+        return llama_cls(
+            model_path=self.model_path,
+            n_ctx=options["context_window"],
+            n_batch=options["n_batch"],
+            n_gpu_layers=0,  # 强制CPU
+            n_threads=options["n_threads"],
+            n_threads_batch=options["n_threads_batch"],
+            use_mmap=options["use_mmap"],
+            use_mlock=options["use_mlock"],
+            verbose=options["verbose"],
+            **kwargs
+        )
+
+    def _create_draft_model(self, options):
         """
-        与模型对话。
+        按配置创建投机解码的草稿来源：提示词查找，或者同一分词器的小模型。
+        注意 llama-cpp 在使用 draft_model 时会保存每个位置的 logits (logits_all)，占用更多内存。
         """
-        if not self.llm:
-            return "呜呜...大脑死机了(模型加载失败，请检查环境)"
+        spec = speculative_options(self.config, self.model_path)
+        if spec is None:
+            return None
+        if spec["mode"] == "prompt_lookup":
+            print(f"Speculative decoding: prompt lookup, {spec['num_pred_tokens']} tokens")
+            return PromptLookupDraft(spec["num_pred_tokens"],
+                                     spec.get("max_ngram_size", DEFAULT_MAX_NGRAM_SIZE))
 
-        # 尝试读取 character.txt
-        character_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "character.txt")
-        if os.path.exists(character_file):
-            with open(character_file, "r", encoding="utf-8") as f:
-                character_setting = f.read()
-        else:
-             character_setting = (
-                "你叫'海小棠'，天津大学吉祥物，是一朵海棠花化形的小花灵。\n"
-                "性格：温和安静、天真烂漫。说话语气轻快活泼，喜欢带'~''呀'等语气词。"
+        draft_path = spec.get("draft_model", "")
+        if draft_path and not os.path.isabs(draft_path):
+            draft_path = os.path.join(APP_ROOT, draft_path)
+        if not draft_path or not os.path.exists(draft_path):
+            print(f"Draft model not found at {draft_path}, speculative decoding disabled")
+            return None
+        # 草稿模型必须和主模型用同一个词表，否则猜出的 token 没有意义
+        main_info = self.catalog.info(self.model_path) or {}
+        draft_info = self.catalog.info(draft_path) or {}
+        if main_info.get("vocab_size") and draft_info.get("vocab_size") \
+                and main_info["vocab_size"] != draft_info["vocab_size"]:
+            print(f"Draft model {draft_path} uses a different vocabulary, speculative decoding disabled")
+            return None
+        try:
+            llama_cls = self.llama_cls or llama_cpp_module().Llama
+            draft_llama = llama_cls(
+                model_path=draft_path,
+                n_ctx=options["context_window"],
+                n_batch=options["n_batch"],
+                n_gpu_layers=0,
+                n_threads=options["n_threads"],
+                n_threads_batch=options["n_threads_batch"],
+                use_mmap=options["use_mmap"],
+                verbose=options["verbose"]
             )
+        except Exception as e:
+            print(f"Failed to load draft model: {e}")
+            return None
+        print(f"Speculative decoding: draft model {draft_path}, {spec['num_pred_tokens']} tokens")
+        return LlamaModelDraft(draft_llama, spec["num_pred_tokens"])
 
-        system_prompt = (
-            f"{character_setting}\n\n"
-            "规则：\n"
-            "1. 请完全沉浸在角色中，不要提及自己是AI或语言模型。\n"
-            "2. 你的用户是'主人'。请务必简短回答(30字内)，不要长篇大论。\n"
-            "3. 即使对于'你是谁'的问题，也要用角色的语气自然回答，不要机械复述设定。"
-        )
+    def sampling_options(self):
+        """采样参数，配置文件中的同名键优先"""
+        return {key: self.config.get(key, default) for key, default in DEFAULT_SAMPLING.items()}
 
-        # 使用 Few-Shot Prompting (示例教学)
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": "你是谁？"},
-            {"role": "assistant", "content": "我是海小棠呀！是你贴心的小花灵~ (转圈圈)"},
-            {"role": "user", "content": "你知道我是谁吗？"},
-            {"role": "assistant", "content": "当然啦，你是我的好主人呀！(蹭蹭)"},
-            {"role": "user", "content": "海小棠，给我唱首歌"},
-            {"role": "assistant", "content": "啦啦啦~ 春天的花儿开啦~"},
-            {"role": "user", "content": "介绍下你自己"},
-            {"role": "assistant", "content": "我是穿着粉色花瓣裙的海棠花灵，最喜欢春天和主人呢~"},
-            {"role": "user", "content": user_input}
-        ]
+    def _prefetch_file(self, report):
+        """按块读取模型文件，把它带进系统页缓存"""
+        try:
+            total = os.path.getsize(self.model_path)
+            done = 0
+            last_percent = -1
+            with open(self.model_path, "rb", buffering=0) as f:
+                while True:
+                    chunk = f.read(PREFETCH_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    done += len(chunk)
+                    percent = int(done * 100 / total) if total else 100
+                    if percent != last_percent:
+                        last_percent = percent
+                        report(percent)
+        except OSError as e:
+            # 预读失败不影响正常加载
+            print(f"Prefetch skipped: {e}")
+
+    def build_prefix_messages(self):
+        """固定不变的消息前缀：系统提示词 + 示例对话 (已编译缓存，调用方不要修改)"""
+        return self.persona.messages()
+
+    # --- 提示词编译 ---
 
+    def _create_formatters(self):
+        """
+        用模型自带的 chat template 创建格式化器，由我们自己分词：
+        前缀只分词一次，之后每条消息只对前缀之后的部分分词。
+        模型没有模板或 llama-cpp 不支持时返回 None，退回 create_chat_completion。
+        """
+        template = (getattr(self.llm, "metadata", None) or {}).get("tokenizer.chat_template")
+        formatter_cls = jinja2_chat_formatter() if template else None
+        if formatter_cls is None:
+            return None
         try:
-            with self.lock:
-                output = self.llm.create_chat_completion(
-                    messages=messages,
-                    max_tokens=64,  # 进一步限制长度，防止废话
-                    temperature=0.7,
-                    stop=["[", "\n\n"] # 防止模型自己把两个人的话都说了
+            eos = self._token_text(self.llm.token_eos())
+            bos = self._token_text(self.llm.token_bos())
+            return (
+                formatter_cls(template=template, eos_token=eos, bos_token=bos,
+                                    add_generation_prompt=False),
+                formatter_cls(template=template, eos_token=eos, bos_token=bos,
+                                    add_generation_prompt=True),
+            )
+        except Exception as e:
+            print(f"Chat template not usable, falling back to chat completion: {e}")
+            return None
+
+    def _token_text(self, token):
+        if token is None or token < 0:
+            return ""
+        return self.llm.detokenize([token], special=True).decode("utf-8", errors="ignore")
+
+    def _compiled_prompt(self):
+        """
+        当前角色设定在当前模型上的编译结果，设定或模型变化时才重新计算：
+        {"persona", "text", "tokens", "token_count", "key"}。调用方需持有 self.lock。
+        """
+        persona = self.persona.compiled()
+        prompt = self._prompts.get(self.persona)
+        if prompt is not None and prompt["persona"] is persona:
+            self._prompts.move_to_end(self.persona)
+            return prompt
+
+        prompt = {"persona": persona, "text": None, "tokens": None}
+        if self._formatters is not None:
+            prompt["text"] = self._formatters[0](messages=persona.messages).prompt
+            prompt["tokens"] = self.llm.tokenize(prompt["text"].encode("utf-8"), add_bos=False, special=True)
+            prompt["token_count"] = len(prompt["tokens"])
+        else:
+            prompt["token_count"] = sum(self.count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS
+                                        for m in persona.messages)
+        prompt["key"] = self._prefix_cache_key(persona, prompt["tokens"] is not None)
+        _remember(self._prompts, self.persona, prompt)
+        return prompt
+
+    def _prompt_tokens(self, prompt, messages):
+        """完整提示词的 token 和停止词：前缀部分直接复用编译好的 token"""
+        result = self._formatters[1](messages=messages)
+        text = result.prompt
+        if text.startswith(prompt["text"]):
+            suffix = text[len(prompt["text"]):]
+            tokens = prompt["tokens"] + self.llm.tokenize(suffix.encode("utf-8"), add_bos=False, special=True)
+        else:
+            tokens = self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+        stop = result.stop or []
+        return tokens, [stop] if isinstance(stop, str) else list(stop)
+
+    # --- 前缀 KV 缓存 ---
+
+    def _model_fingerprint(self):
+        """模型文件指纹：路径 + 大小 + 修改时间"""
+        path = os.path.abspath(self.model_path)
+        st = os.stat(path)
+        return f"{path}|{st.st_size}|{st.st_mtime_ns}"
+
+    def _prefix_cache_key(self, persona, templated):
+        """前缀缓存 key：模型文件、角色设定与模板内容、上下文长度共同决定"""
+        h = hashlib.sha256()
+        h.update(str(PREFIX_CACHE_VERSION).encode("utf-8"))
+        h.update((self._model_fp or self._model_fingerprint()).encode("utf-8"))
+        h.update(str(getattr(self.llm, "chat_format", "")).encode("utf-8"))
+        h.update(("template" if templated else "chat").encode("utf-8"))
+        h.update(str(self.context_size).encode("utf-8"))
+        # 投机解码时 llama-cpp 保存所有位置的 logits，状态格式不同
+        h.update(("speculative" if self.draft_model is not None else "").encode("utf-8"))
+        h.update(persona.fingerprint.encode("utf-8"))
+        return h.hexdigest()
+
+    def _prefix_cache_path(self, key):
+        model_name = os.path.splitext(os.path.basename(self.model_path))[0]
+        return os.path.join(self.cache_dir, f"prefix-{model_name}-{key[:16]}.state")
+
+    def _ensure_prefix(self, prompt):
+        """
+        保证上下文中已经评估过静态前缀。
+        之后的生成会自动匹配最长公共前缀，只需评估新的用户消息。
+        调用方需持有 self.lock。
+        """
+        key = prompt["key"]
+        if key == self._prefix_key:
+            return
+
+        # 1. 内存中的状态 (例如上下文被其它内容覆盖后恢复，或者换回了之前用过的角色设定)
+        state = self._prefix_states.get(key)
+        if state is not None:
+            self.llm.load_state(state)
+            self._prefix_states.move_to_end(key)
+            self._prefix_key = key
+            return
+
+        # 2. 磁盘缓存 (冷启动)
+        cache_path = self._prefix_cache_path(key)
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    state = pickle.load(f)
+                self.llm.load_state(state)
+                _remember(self._prefix_states, key, state)
+                self._prefix_key = key
+                print(f"Prefix state loaded from {cache_path}")
+                return
+            except Exception as e:
+                print(f"Failed to load prefix state, rebuilding: {e}")
+                try:
+                    os.remove(cache_path)
+                except OSError:
+                    pass
+
+        # 3. 重新评估：有编译好的 token 时直接评估；否则用一条空的用户消息把前缀跑一遍，生成 1 个 token
+        try:
+            if prompt["tokens"] is not None:
+                self.llm.reset()
+                self.llm.eval(prompt["tokens"])
+            else:
+                self.llm.create_chat_completion(
+                    messages=prompt["persona"].messages + [{"role": "user", "content": ""}],
+                    max_tokens=1,
+                    temperature=0.0
                 )
-                response = output['choices'][0]['message']['content'].strip()
+            state = self.llm.save_state()
+        except Exception as e:
+            print(f"Failed to evaluate prefix: {e}")
+            return
+        _remember(self._prefix_states, key, state)
+        self._prefix_key = key
+        # 投机解码时状态里带着每个位置的整行 logits (几百 MB)，只保存在内存中
+        if self.draft_model is None:
+            self._save_prefix_state(cache_path, state)
+
+    def _save_prefix_state(self, cache_path, state):
+        """原子写入前缀状态，并清理同一模型的旧缓存 (内存中还保留着的其它设定的前缀除外)"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+
+            model_name = os.path.splitext(os.path.basename(self.model_path))[0]
+            stale_prefix = f"prefix-{model_name}-"
+            keep = {cache_path} | {self._prefix_cache_path(key) for key in self._prefix_states}
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if name.startswith(stale_prefix) and name.endswith(".state") and path not in keep:
+                    os.remove(path)
+            print(f"Prefix state saved to {cache_path}")
+        except Exception as e:
+            print(f"Failed to save prefix state: {e}")
+
+    def count_tokens(self, text):
+        """用模型自己的分词器计算 token 数"""
+        if not text:
+            return 0
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def _build_messages(self, prompt, user_input):
+        """
+        固定前缀 + 对话历史 + 新消息。历史只占用上下文里剩下的预算：
+        context_size - 前缀 - 新消息 - 回复长度。调用方需持有 self.lock。
+        """
+        budget = (self.context_size
+                  - prompt["token_count"]
+                  - self.count_tokens(user_input) - MESSAGE_OVERHEAD_TOKENS
+                  - self.sampling_options()["max_tokens"]
+                  - 2 * MESSAGE_OVERHEAD_TOKENS)
+        history = self.memory.pack(budget)
+        return prompt["persona"].messages + history + [{"role": "user", "content": user_input}]
+
+    # --- 回复缓存 ---
+
+    def _reply_cache_key(self, prompt, user_input):
+        if self.reply_cache is None or self.reply_cache_mode == "off":
+            return None
+        # 有对话历史时回答可能依赖上下文 (例如“为什么”“然后呢”)，既不记录也不使用缓存
+        if self.memory.turns or self.memory.summary_lines:
+            return None
+        # 前缀缓存 key 已经包含了模型文件、角色设定和模板
+        return self.reply_cache.make_key(user_input, prompt["key"])
+
+    def _cached_reply(self, key):
+        """
+        满足条件时返回缓存的回答：至少积累了 reply_cache_min_variants 条不同回答，
+        且按 reply_cache_serve_ratio 的概率使用 (其余时候仍然生成，继续积累新回答)。
+        先查找再掷概率，命中/未命中的统计不受概率影响。
+        """
+        if key is None or self.reply_cache_mode != "serve":
+            return None
+        reply = self.reply_cache.get(key, min_variants=self.config.get("reply_cache_min_variants", 3))
+        if reply is None or random.random() >= self.config.get("reply_cache_serve_ratio", 0.7):
+            return None
+        return reply
+
+    # --- 模型热切换 ---
+
+    def estimate_memory(self, model_path):
+        """按当前的上下文长度和批大小估计加载 model_path 需要的内存 (字节)，文件不存在时为 0"""
+        info = self.catalog.info(model_path)
+        if info is None:
+            return 0
+        options = self.runtime_options()
+        spec = speculative_options(self.config, model_path)
+        total = estimate_memory(info, options["context_window"], options["n_batch"],
+                                logits_all=spec is not None)["total"]
+        if spec is not None and spec["mode"] == "draft" and spec.get("draft_model"):
+            draft_path = spec["draft_model"]
+            if not os.path.isabs(draft_path):
+                draft_path = os.path.join(APP_ROOT, draft_path)
+            draft_info = self.catalog.info(draft_path)
+            if draft_info is not None:
+                total += estimate_memory(draft_info, options["context_window"], options["n_batch"])["total"]
+        return total
+
+    def can_load_alongside(self, model_path):
+        """可用内存是否足够在当前模型之外再加载一个模型 (无法获取时按足够处理)"""
+        available = memstat.available_memory()
+        return not available or available >= self.estimate_memory(model_path)
+
+    def load_standby(self, model_path, progress_callback=None):
+        """
+        在调用线程中加载另一个模型 (包括前缀)，当前模型在此期间照常回答。
+        成功返回加载好的 LLMClient，交给 adopt() 换上；失败返回 None。
+        """
+        standby = LLMClient(model_path, config=dict(self.config, reply_cache_mode="off"),
+                            llama_cls=self.llama_cls)
+        standby.persona = self.persona
+        standby.cache_dir = self.cache_dir
+        standby.catalog = self.catalog
+        if not standby.load_model(progress_callback):
+            return None
+        return standby
+
+    def adopt(self, standby):
+        """
+        在两次对话之间原子地换上 load_standby() 加载好的模型，并释放旧模型。
+        对话记忆保留，但 token 数需要按新分词器重新计算。
+        """
+        with self.lock:
+            old_llm, old_draft = self.llm, self.draft_model
+            for name in MODEL_STATE:
+                setattr(self, name, getattr(standby, name))
+            standby.llm = None
+            standby.draft_model = None
+            self.memory.invalidate_token_counts()
+        self._free(old_llm)
+        self._free(old_draft)
+
+    def unload(self):
+        """释放当前模型 (内存不够同时放下两个模型时，先卸载旧模型再加载新模型)"""
+        with self.lock:
+            old_llm, old_draft = self.llm, self.draft_model
+            self.llm = None
+            self.draft_model = None
+            self._prefix_key = None
+            self._prefix_states = OrderedDict()
+            self._prompts = OrderedDict()
+        self._free(old_llm)
+        self._free(old_draft)
+
+    def reload_model(self, progress_callback=None):
+        """
+        空闲卸载 (unload) 之后重新加载同一个模型。
+        mmap 加载时跳过预读：文件多半还在系统页缓存里，权重按需读入；前缀从磁盘上的状态缓存恢复。
+        """
+        self._skip_prefetch = self.runtime_options()["use_mmap"]
+        try:
+            return self.load_model(progress_callback)
+        finally:
+            self._skip_prefetch = False
+
+    def reload_in_place(self, model_path, progress_callback=None):
+        """
+        内存不够同时放下两个模型时的切换方式：先卸载旧模型再加载新模型，
+        失败时重新加载旧模型。调用期间不能对话 (需要在推理线程中调用)。
+        """
+        old_path = self.model_path
+        self.unload()
+        self.model_path = model_path
+        self.memory.invalidate_token_counts()
+        if self.load_model(progress_callback):
+            return True
+        print(f"Failed to load {model_path}, rolling back to {old_path}")
+        self.model_path = old_path
+        self.load_model()
+        return False
+
+    @staticmethod
+    def _free(llm):
+        if llm is None:
+            return
+        close = getattr(llm, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception as e:
+                print(f"Failed to close model: {e}")
+
+    def close(self):
+        """退出前保存缓存"""
+        if self.reply_cache is not None:
+            self.reply_cache.flush()
+
+    def _draft_snapshot(self):
+        stats = getattr(self.draft_model, "stats", None)
+        return (stats.calls, stats.drafted) if stats is not None else None
+
+    def _record_speculative(self, snapshot, text):
+        """
+        按一次回复前后的草稿统计推算接受率。llama-cpp 每次主模型前向之后调用一次草稿，
+        每次前向产出 (被接受的草稿数 + 1) 个 token，所以 被接受数 ≈ 生成数 - 1 - 草稿次数。
+        """
+        if snapshot is None or not text or self.draft_model is None:
+            return
+        stats = self.draft_model.stats
+        calls = stats.calls - snapshot[0]
+        drafted = stats.drafted - snapshot[1]
+        tokens = len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+        totals = self.speculative_stats
+        totals["replies"] += 1
+        totals["tokens"] += tokens
+        totals["drafted"] += drafted
+        totals["accepted"] += min(drafted, max(0, tokens - 1 - calls))
+        totals["passes"] += calls + 1
+
+    def speculative_report(self):
+        """接受率和每次主模型前向平均产出的 token 数 (即理想情况下的加速比)"""
+        totals = self.speculative_stats
+        return {
+            "enabled": self.draft_model is not None,
+            "replies": totals["replies"],
+            "acceptance_rate": totals["accepted"] / totals["drafted"] if totals["drafted"] else 0.0,
+            "tokens_per_pass": totals["tokens"] / totals["passes"] if totals["passes"] else 1.0,
+        }
+
+    def _completion_kwargs(self, cancel_event=None, stopper=None):
+        """生成参数"""
+        kwargs = self.sampling_options()
+        kwargs["stop"] = ["[", "\n\n"]  # 防止模型自己把两个人的话都说了
+        processors = []
+        if cancel_event is not None:
+            processors.append(self._cancel_processor(cancel_event))
+        if stopper is not None:
+            processors.append(stopper)
+        if processors:
+            llama_cpp = llama_cpp_module()
+            kwargs["logits_processor"] = llama_cpp.LogitsProcessorList(processors) if llama_cpp else processors
+        return kwargs
+
+    def _create_completion(self, prompt, messages, cancel_event=None, stream=False, stopper=None):
+        """开始生成：有模板格式化器时直接传 token，否则交给 create_chat_completion"""
+        kwargs = self._completion_kwargs(cancel_event, stopper)
+        if self._formatters is None:
+            return self.llm.create_chat_completion(messages=messages, stream=stream, **kwargs)
+        tokens, stop = self._prompt_tokens(prompt, messages)
+        kwargs["stop"] = kwargs["stop"] + stop
+        return self.llm.create_completion(prompt=tokens, stream=stream, **kwargs)
+
+    @staticmethod
+    def _choice_text(choice):
+        """兼容 completion (text) 与 chat completion (message / delta) 两种输出"""
+        if "text" in choice:
+            return choice["text"]
+        return (choice.get("message") or choice.get("delta") or {}).get("content")
+
+    def _cancel_processor(self, cancel_event):
+        """
+        停止条件：取消后把除 EOS 以外的所有 logits 置为 -inf，下一步即结束生成。
+        create_chat_completion 不接受 stopping_criteria，两条生成路径统一通过 logits_processor 实现。
+        """
+        eos = self.llm.token_eos()
+
+        def stop_when_cancelled(input_ids, scores):
+            if cancel_event.is_set():
+                scores.fill(float("-inf"))
+                scores[eos] = 0.0
+            return scores
+
+        return stop_when_cancelled
+
+    def chat(self, user_input, cancel_event=None):
+        """
+        与模型对话。
+        """
+        if not self.llm:
+            return "呜呜...大脑死机了(模型加载失败，请检查环境)"
+
+        try:
+            with self.lock:
+                prompt = self._compiled_prompt()
+                cache_key = self._reply_cache_key(prompt, user_input)
+                cached = self._cached_reply(cache_key)
+                if cached is not None:
+                    self.memory.add_turn(user_input, cached)
+                    return cached
+
+                self._ensure_prefix(prompt)
+                messages = self._build_messages(prompt, user_input)
+                snapshot = self._draft_snapshot()
+                stopper = self.reply_budget.stopper(self.llm, user_input)
+                output = self._create_completion(prompt, messages, cancel_event, stopper=stopper)
+                response = (self._choice_text(output['choices'][0]) or "").strip()
+                self._record_speculative(snapshot, response)
                 # 有时候模型会重复输入，做一下简单的清理
                 if response.startswith(":"):
                      response = response[1:].strip()
+                if response and not (cancel_event is not None and cancel_event.is_set()):
+                    # 被取消的回复不计入统计，以免拉低自然结束的平均长度
+                    self.reply_budget.record(stopper, self.sampling_options()["max_tokens"])
+                    self.memory.add_turn(user_input, response)
+                    if cache_key is not None:
+                        self.reply_cache.add(cache_key, response)
                 return response
         except Exception as e:
             return f"我想不出来了... ({str(e)})"
+
+    def chat_stream(self, user_input, cancel_event=None):
+        """
+        流式对话，逐段 yield 新生成的文本。
+        cancel_event 被设置后会尽快停止生成。
+        """
+        if not self.llm:
+            yield "呜呜...大脑死机了(模型加载失败，请检查环境)"
+            return
+
+        try:
+            with self.lock:
+                prompt = self._compiled_prompt()
+                cache_key = self._reply_cache_key(prompt, user_input)
+                cached = self._cached_reply(cache_key)
+                if cached is not None:
+                    self.memory.add_turn(user_input, cached)
+                    yield cached
+                    return
+
+                self._ensure_prefix(prompt)
+                messages = self._build_messages(prompt, user_input)
+                snapshot = self._draft_snapshot()
+                stopper = self.reply_budget.stopper(self.llm, user_input)
+                stream = self._create_completion(prompt, messages, cancel_event, stream=True, stopper=stopper)
+                started = False
+                parts = []
+                for chunk in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        # 主动关闭生成器，让 llama 立即结束本次生成
+                        stream.close()
+                        break
+                    delta = self._choice_text(chunk['choices'][0])
+                    if not delta:
+                        continue
+                    if not started:
+                        # 与 chat() 一样去掉开头的空白和多余的冒号
+                        delta = delta.lstrip()
+                        if delta.startswith(":"):
+                            delta = delta[1:].lstrip()
+                        if not delta:
+                            continue
+                        started = True
+                    parts.append(delta)
+                    yield delta
+
+                # 完整生成的回复才记入对话历史
+                response = "".join(parts).strip()
+                self._record_speculative(snapshot, response)
+                if response and not (cancel_event is not None and cancel_event.is_set()):
+                    self.reply_budget.record(stopper, self.sampling_options()["max_tokens"])
+                    self.memory.add_turn(user_input, response)
+                    if cache_key is not None:
+                        self.reply_cache.add(cache_key, response)
+        except Exception as e:
+            yield f"我想不出来了... ({str(e)})"
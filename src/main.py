@@ -1,18 +1,63 @@
 import sys
 import os
+import time
+# 启动计时 (--profile-startup) 的第一个时间点：解释器已经启动，开始执行本脚本
+SCRIPT_STARTED = time.perf_counter()
+
 from PySide6.QtWidgets import QApplication, QSystemTrayIcon, QMenu
-from PySide6.QtGui import QIcon, QAction
-from PySide6.QtCore import QTimer
+from PySide6.QtGui import QIcon, QAction, QPixmap, QImageReader
+from PySide6.QtCore import QTimer, Qt, QSize
 
 # 确保src目录在路径中
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# 设置窗口在第一次打开时才导入和创建；llama_cpp 在推理线程第一次加载模型时才导入
 from pet_ui import PetUI
-from settings_ui import SettingsDialog
+from config_store import ConfigStore
+from sprite_cache import load_thumbnail, save_thumbnail
+from startup import PROFILE, on_first_paint
+from perf_panel import PerfDialog
+MODULES_IMPORTED = time.perf_counter()
+
+# 托盘图标缓存的尺寸
+TRAY_ICON_SIZE = 64
+
+
+def load_tray_icon(tray_icon, icon_path, cache_dir):
+    """
+    托盘图标用缓存的小图，不解码原图 (原图很大)。没有缓存时返回 False，
+    由调用方在窗口显示之后再调用 decode_tray_icon。
+    """
+    image, _ = load_thumbnail(cache_dir, "tray-icon", icon_path)
+    if image is None:
+        return False
+    tray_icon.setIcon(QIcon(QPixmap.fromImage(image)))
+    return True
+
+
+def decode_tray_icon(tray_icon, icon_path, cache_dir):
+    """从原图缩小出托盘图标并保存，下次启动直接使用"""
+    image = QImageReader(icon_path).read()
+    if image.isNull():
+        print(f"Icon not readable: {icon_path}")
+        return
+    image = image.scaled(QSize(TRAY_ICON_SIZE, TRAY_ICON_SIZE), Qt.AspectRatioMode.KeepAspectRatio,
+                         Qt.TransformationMode.SmoothTransformation)
+    tray_icon.setIcon(QIcon(QPixmap.fromImage(image)))
+    save_thumbnail(cache_dir, "tray-icon", icon_path, image)
+
 
 def main():
+    # --profile-startup: 打印从进程启动、第一次绘制到模型可用的各阶段时间线
+    if "--profile-startup" in sys.argv:
+        sys.argv.remove("--profile-startup")
+        PROFILE.enable()
+        PROFILE.mark("script started", SCRIPT_STARTED)
+        PROFILE.mark("modules imported", MODULES_IMPORTED)
+
     app = QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(False) # 关闭窗口时不退出程序
+    PROFILE.mark("QApplication created")
 
     # 获取应用程序根目录
     if getattr(sys, 'frozen', False):
@@ -25,29 +70,48 @@ def main():
     # 绝对路径配置
     config_path = os.path.join(app_root, "modle", "config.json")
     
+    # 桌宠和设置窗口共用一个配置服务
+    config_store = ConfigStore(config_path)
+
     # 创建宠物窗口
-    pet = PetUI(config_path=config_path, app_root=app_root)
+    pet = PetUI(config_path=config_path, app_root=app_root, config_store=config_store)
+    PROFILE.mark("pet window created")
+    on_first_paint(pet, lambda: PROFILE.mark("first paint"))
     pet.show()
 
-    # 创建设置窗口
-    settings_dialog = SettingsDialog(config_path=config_path)
-    
-    # 连接信号
+    # 设置窗口和性能面板第一次打开时才创建 (连同它们用到的模块)
+    dialogs = {}
+
+    # 连接信号 (保存后的修改由配置服务通知桌宠，只应用变化的部分)
     def show_settings():
-        if settings_dialog.exec():
-            # Apply changes
-            pet.reload_settings()
+        if "settings" not in dialogs:
+            from settings_ui import SettingsDialog
+            dialogs["settings"] = SettingsDialog(config_path=config_path, config_store=config_store)
+        dialogs["settings"].refresh()
+        dialogs["settings"].exec()
 
     pet.open_settings.connect(show_settings)
 
+    # 性能面板 (托盘菜单“性能”)
+    def show_perf():
+        if "perf" not in dialogs:
+            dialogs["perf"] = PerfDialog(config_store)
+        dialogs["perf"].show()
+        dialogs["perf"].raise_()
+        dialogs["perf"].activateWindow()
+
+    app.aboutToQuit.connect(pet.shutdown)
+
     # 系统托盘图标
     tray_icon = QSystemTrayIcon(app)
     
-    # 使用 3.png 作为图标
+    # 使用 3.png 作为图标 (缩小后缓存；第一次运行时等窗口显示之后再解码原图)
     icon_path = os.path.join(app_root, "image", "3.png")
+    cache_dir = os.path.join(app_root, "modle", "cache")
 
+    icon_pending = False
     if os.path.exists(icon_path):
-        tray_icon.setIcon(QIcon(icon_path))
+        icon_pending = not load_tray_icon(tray_icon, icon_path, cache_dir)
     else:
         # 兜底
         print(f"Icon not found at {icon_path}")
@@ -63,6 +127,9 @@ def main():
     
     setting_action = QAction("设置", app)
     setting_action.triggered.connect(show_settings)
+
+    perf_action = QAction("性能", app)
+    perf_action.triggered.connect(show_perf)
     
     quit_action = QAction("退出", app)
     quit_action.triggered.connect(app.quit)
@@ -71,10 +138,20 @@ def main():
     tray_menu.addAction(hide_action)
     tray_menu.addSeparator()
     tray_menu.addAction(setting_action)
+    tray_menu.addAction(perf_action)
     tray_menu.addAction(quit_action)
     
     tray_icon.setContextMenu(tray_menu)
-    tray_icon.show()
+    if icon_pending:
+        # 还没有图标缓存：桌宠画出来之后再解码图标并显示托盘
+        def show_tray():
+            decode_tray_icon(tray_icon, icon_path, cache_dir)
+            tray_icon.show()
+            PROFILE.mark("tray icon shown")
+        on_first_paint(pet, lambda: QTimer.singleShot(0, show_tray))
+    else:
+        tray_icon.show()
+        PROFILE.mark("tray icon shown")
     
     # 将 sys.exit 放到这里，确保 QApplication 在 main 中完全控制生命周期
     exit_code = app.exec()
@@ -0,0 +1,182 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+
+# 轻量的性能统计：计时和计数保存在内存里 (每项只留最近的样本，用来算分位数)，
+# 同时可以写入按大小轮转的 JSONL 跟踪文件。关闭时 record / timer 直接返回，几乎不花时间。
+# 跟踪文件由单独的写盘线程写入，record 只追加到缓冲区，界面线程上记录的卡顿不会包含写文件的时间。
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACE_PATH = os.path.join(APP_ROOT, "modle", "cache", "trace.jsonl")
+# 每项保留的最近样本数
+WINDOW = 512
+# 跟踪文件超过该大小时轮转，保留 trace.1.jsonl ... trace.N.jsonl
+TRACE_MAX_BYTES = 1024 * 1024
+TRACE_BACKUPS = 3
+# 攒够这么多行时唤醒写盘线程，否则每隔这么多秒写入一次
+FLUSH_LINES = 100
+FLUSH_SECONDS = 5.0
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, p):
+    """最近秩法求分位数 (sorted_values 已排序且不为空)"""
+    index = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class _NullTimer:
+    """统计关闭时使用的计时器，什么也不做"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, (time.perf_counter() - self.start) * 1000.0, "ms")
+        return False
+
+
+class Metrics:
+    """
+    进程内唯一的统计入口 (见 METRICS)。各线程都可以调用，内部加锁。
+    record(name, value, unit) 记录一个样本，count(name) 计数，timer(name) 作为 with 语句计时 (毫秒)。
+    """
+
+    def __init__(self, trace_path=TRACE_PATH):
+        self.enabled = False
+        self.trace_path = trace_path
+        self.trace = False
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # 写盘和轮转串行进行
+        self._series = {}    # 名称 -> deque 最近的样本
+        self._units = {}     # 名称 -> 单位
+        self._totals = {}    # 名称 -> [样本总数, 总和]
+        self._counters = {}  # 名称 -> 计数
+        self._pending = []   # 还没写盘的跟踪行
+        self._wake = threading.Event()
+        self._writer = None  # 写盘线程，第一次开启跟踪文件时启动
+
+    def configure(self, config):
+        """按配置开关：metrics 是否统计，metrics_trace 是否写跟踪文件"""
+        enabled = bool(config.get("metrics", False))
+        trace = enabled and bool(config.get("metrics_trace", True))
+        if self.trace and not trace:
+            self.flush()
+        self.trace = trace
+        self.enabled = enabled
+        if trace and self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="metrics-writer", daemon=True)
+            self._writer.start()
+
+    def record(self, name, value, unit="ms"):
+        if not self.enabled:
+            return
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                series = self._series[name] = deque(maxlen=WINDOW)
+                self._units[name] = unit
+                self._totals[name] = [0, 0.0]
+            series.append(value)
+            totals = self._totals[name]
+            totals[0] += 1
+            totals[1] += value
+            if not self.trace:
+                return
+            self._pending.append({"t": round(time.time(), 3), "name": name, "value": round(value, 3),
+                                  "unit": unit})
+            wake = len(self._pending) >= FLUSH_LINES
+        if wake:
+            self._wake.set()
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def timer(self, name):
+        """with METRICS.timer("bubble.layout"): ...  关闭时返回不计时的空对象"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def snapshot(self):
+        """{"series": {名称: {count, mean, p50, p90, p99, max, last, unit}}, "counters": {名称: 计数}}"""
+        with self._lock:
+            series = {name: (list(values), self._units[name], list(self._totals[name]))
+                      for name, values in self._series.items()}
+            counters = dict(self._counters)
+        result = {}
+        for name, (values, unit, (total_count, total_sum)) in series.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            stats = {"count": total_count, "mean": total_sum / total_count, "unit": unit,
+                     "max": ordered[-1], "last": values[-1]}
+            for p in PERCENTILES:
+                stats[f"p{p}"] = percentile(ordered, p)
+            result[name] = stats
+        return {"series": result, "counters": counters}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._units.clear()
+            self._totals.clear()
+            self._counters.clear()
+
+    def _write_loop(self):
+        """写盘线程：缓冲攒够 FLUSH_LINES 行时被唤醒，否则每 FLUSH_SECONDS 秒写一次"""
+        while True:
+            self._wake.wait(FLUSH_SECONDS)
+            self._wake.clear()
+            if self._pending:
+                self.flush()
+
+    def flush(self):
+        """把缓冲的跟踪行追加到文件，超过大小上限时先轮转 (写盘线程和退出时调用)"""
+        with self._write_lock:
+            # 在写锁内取出缓冲，保证各批按记录的顺序写入
+            with self._lock:
+                lines, self._pending = self._pending, []
+            if not lines:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.trace_path), exist_ok=True)
+                if os.path.exists(self.trace_path) and os.path.getsize(self.trace_path) >= TRACE_MAX_BYTES:
+                    self._rotate()
+                with open(self.trace_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines))
+            except OSError as e:
+                print(f"Failed to write trace: {e}")
+
+    def _rotate(self):
+        root, ext = os.path.splitext(self.trace_path)
+        for i in range(TRACE_BACKUPS - 1, 0, -1):
+            older = f"{root}.{i}{ext}"
+            if os.path.exists(older):
+                os.replace(older, f"{root}.{i + 1}{ext}")
+        os.replace(self.trace_path, f"{root}.1{ext}")
+
+
+METRICS = Metrics()
@@ -0,0 +1,211 @@
+import os
+import json
+import threading
+
+import gguf
+import memstat
+
+INDEX_VERSION = 1
+INDEX_FILENAME = "models_index.json"
+
+# 运行时的固定开销 (llama.cpp 本身、输出缓冲等)
+RUNTIME_OVERHEAD_BYTES = 64 * 1024 * 1024
+# 读不出结构信息时：内存 ≈ 文件大小 × 该系数
+FALLBACK_MEMORY_FACTOR = 1.2
+# 自动选择模型时只用到可用内存的这个比例，给系统和其它程序留余地
+MEMORY_HEADROOM = 0.8
+
+
+def _int(value):
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def summarize(header):
+    """从 GGUF 头中取出选择模型需要的信息"""
+    meta = header["metadata"]
+    arch = meta.get("general.architecture") if isinstance(meta.get("general.architecture"), str) else None
+
+    def arch_value(key):
+        return _int(meta.get(f"{arch}.{key}")) if arch else None
+
+    head_count = arch_value("attention.head_count")
+    head_count_kv = arch_value("attention.head_count_kv") or head_count
+    vocab = meta.get("tokenizer.ggml.tokens")
+    name = meta.get("general.name")
+    return {
+        "architecture": arch,
+        "name": name if isinstance(name, str) else None,
+        "parameter_count": header["parameter_count"],
+        "quantization": gguf.quantization_name(header),
+        "context_length": arch_value("context_length"),
+        "block_count": arch_value("block_count"),
+        "embedding_length": arch_value("embedding_length"),
+        "head_count": head_count,
+        "head_count_kv": head_count_kv,
+        "key_length": arch_value("attention.key_length"),
+        "value_length": arch_value("attention.value_length"),
+        "vocab_size": vocab.get("array") if isinstance(vocab, dict) else None,
+        "tensor_bytes": header["tensor_bytes"],
+        "has_chat_template": "tokenizer.chat_template" in meta,
+        "complete": header["complete"],
+    }
+
+
+def estimate_memory(info, n_ctx, n_batch=512, logits_all=False):
+    """
+    粗略估计以 n_ctx 加载模型需要的内存 (字节)：权重 + KV 缓存 (f16) + 计算缓冲。
+    logits_all (投机解码需要) 时还要为每个位置保存一整行 logits。
+    返回 {"weights", "kv_cache", "compute", "total"}
+    """
+    weights = info.get("tensor_bytes") or info.get("size", 0)
+    n_layer = info.get("block_count")
+    n_embd = info.get("embedding_length")
+    n_head = info.get("head_count")
+    if not (n_layer and n_embd and n_head):
+        total = int(info.get("size", 0) * FALLBACK_MEMORY_FACTOR) + RUNTIME_OVERHEAD_BYTES
+        return {"weights": weights, "kv_cache": 0, "compute": total - weights, "total": total}
+
+    n_ctx = n_ctx or info.get("context_length") or 2048
+    n_head_kv = info.get("head_count_kv") or n_head
+    k_dim = info.get("key_length") or n_embd // n_head
+    v_dim = info.get("value_length") or n_embd // n_head
+    kv_cache = 2 * n_layer * n_ctx * n_head_kv * (k_dim + v_dim)
+    # 计算缓冲主要是一批 token 的注意力分数和中间激活，外加最后一个 token 的 logits
+    n_batch = min(n_batch, n_ctx)
+    compute = 4 * (n_batch * n_ctx * n_head + n_batch * n_embd * 8 + (info.get("vocab_size") or 0))
+    compute += RUNTIME_OVERHEAD_BYTES
+    if logits_all:
+        compute += 4 * (n_ctx + n_batch) * (info.get("vocab_size") or 0)
+    return {"weights": weights, "kv_cache": kv_cache, "compute": compute,
+            "total": weights + kv_cache + compute}
+
+
+def format_params(count):
+    if not count:
+        return "?"
+    if count >= 1e9:
+        return f"{count / 1e9:.1f}B"
+    return f"{count / 1e6:.0f}M"
+
+
+def describe(info, estimate=None):
+    """设置界面中显示的一行说明，例如 “qwen2 0.5B Q4_K_M · 约需 0.6 GB”"""
+    if not info.get("valid"):
+        return f"{info['file']} (无法读取: {info.get('error')})"
+    text = f"{info.get('name') or info.get('architecture') or info['file']} " \
+           f"{format_params(info.get('parameter_count'))} {info.get('quantization')}"
+    if not info.get("complete"):
+        text += " · 文件不完整"
+    elif estimate is not None:
+        text += f" · 约需 {estimate['total'] / 1024 ** 3:.1f} GB"
+    return text
+
+
+def select_model(models, n_ctx, n_batch=512, available=None):
+    """
+    自动选择模型：在可用内存放得下的完整模型中选参数量最大的 (同样大小时选量化精度更高的)；
+    都放不下时选需要内存最少的。返回 (info, estimate)，没有可用模型时返回 (None, None)。
+    """
+    candidates = [m for m in models if m.get("valid") and m.get("complete")]
+    if not candidates:
+        return None, None
+    if available is None:
+        available = memstat.available_memory()
+    estimates = {m["path"]: estimate_memory(m, n_ctx, n_batch) for m in candidates}
+    budget = available * MEMORY_HEADROOM if available else None
+    fitting = [m for m in candidates if budget is None or estimates[m["path"]]["total"] <= budget]
+    if fitting:
+        best = max(fitting, key=lambda m: (m.get("parameter_count") or 0, m.get("tensor_bytes") or 0))
+    else:
+        best = min(candidates, key=lambda m: estimates[m["path"]]["total"])
+    return best, estimates[best["path"]]
+
+
+class ModelCatalog:
+    """
+    模型目录：只读取各个 .gguf 的文件头，结果按 (大小, 修改时间) 缓存在 models_index.json，
+    文件没有变化时不再重新解析。
+    """
+
+    def __init__(self, model_dir, index_path=None):
+        self.model_dir = model_dir
+        self.index_path = index_path or os.path.join(model_dir, INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._entries = None  # 路径 -> 信息
+        self._dirty = False
+
+    def _key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def _load_index(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Failed to read model index: {e}")
+            return
+        if data.get("version") == INDEX_VERSION:
+            self._entries = data.get("models", {})
+
+    def _save_index(self):
+        if not self._dirty:
+            return
+        data = {"version": INDEX_VERSION, "models": self._entries}
+        tmp_path = self.index_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+        except OSError as e:
+            print(f"Failed to save model index: {e}")
+
+    def _info(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = self._key(path)
+        cached = self._entries.get(key)
+        if cached and cached.get("size") == st.st_size and cached.get("mtime_ns") == st.st_mtime_ns:
+            return dict(cached, path=path)
+        info = {"file": os.path.basename(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        try:
+            info.update(summarize(gguf.read_header(path)), valid=True, error=None)
+        except (OSError, gguf.GGUFError) as e:
+            info.update(valid=False, error=str(e))
+        self._entries[key] = info
+        self._dirty = True
+        return dict(info, path=path)
+
+    def info(self, path):
+        """单个模型文件的信息，文件不存在时返回 None"""
+        with self._lock:
+            self._load_index()
+            result = self._info(path)
+            self._save_index()
+            return result
+
+    def scan(self):
+        """目录下所有 .gguf 的信息 (按文件名排序)，并清理已经不存在的文件"""
+        with self._lock:
+            self._load_index()
+            models = []
+            if os.path.isdir(self.model_dir):
+                for file in sorted(os.listdir(self.model_dir)):
+                    if file.endswith(".gguf"):
+                        info = self._info(os.path.join(self.model_dir, file))
+                        if info is not None:
+                            models.append(info)
+            for key in list(self._entries):
+                if not os.path.exists(key):
+                    del self._entries[key]
+                    self._dirty = True
+            self._save_index()
+            return models
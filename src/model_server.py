@@ -0,0 +1,621 @@
+import os
+import sys
+import time
+import uuid
+import pickle
+import socket
+import secrets
+import argparse
+import threading
+import subprocess
+from collections import OrderedDict, deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+from llm_client import LLMClient, APP_ROOT
+from conversation import ConversationMemory
+from persona import Persona
+
+# 本地推理服务：一个独立进程持有唯一的 Llama 实例，多个桌宠窗口 (或角色) 通过本机连接共用它。
+# 界面进程里只剩一个很薄的客户端，生成时不再和 Qt 抢 GIL，多开桌宠也只占一份模型内存。
+#
+# 消息都是 dict (multiprocessing.connection 自带 pickle 和认证)：
+#   客户端 -> 服务  {"op": "hello" | "load" | "chat" | "cancel" | "bye", "id": 请求 id, ...}
+#   服务 -> 客户端  {"event": "hello" | "progress" | "loaded" | "delta" | "done", "id": 请求 id, ...}
+
+DEFAULT_ADDRESS = "127.0.0.1:47321"
+KEY_PATH = os.path.join(APP_ROOT, "modle", "cache", "model_server.key")
+LOG_PATH = os.path.join(APP_ROOT, "modle", "cache", "model_server.log")
+
+# 自动启动的服务在最后一个客户端断开后多久退出 (秒)
+SPAWN_IDLE_EXIT = 120
+# 自动启动服务后等待它开始监听的时间 (秒)
+SPAWN_TIMEOUT = 15.0
+CONNECT_RETRY_DELAY = 0.2
+# 等待握手回复的时间 (秒)，服务卡住时不让界面一直等
+HELLO_TIMEOUT = 5.0
+# 客户端等待回复时检查取消的间隔 (秒)
+POLL_INTERVAL = 0.05
+# 检查角色设定文件是否修改的间隔 (秒)
+PERSONA_CHECK_INTERVAL = 2.0
+
+
+def server_address(config):
+    """配置 model_server_address ("主机:端口") -> (主机, 端口)"""
+    value = config.get("model_server_address") or DEFAULT_ADDRESS
+    host, _, port = str(value).rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def load_auth_key(create=False):
+    """读取连接密钥 (只有同一个程序目录下的进程能连上)；不存在时按需生成"""
+    try:
+        with open(KEY_PATH, "rb") as f:
+            key = f.read()
+        if key:
+            return key
+    except OSError:
+        pass
+    if not create:
+        return None
+    key = secrets.token_hex(32).encode("ascii")
+    os.makedirs(os.path.dirname(KEY_PATH), exist_ok=True)
+    fd = os.open(KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def spawn_server(address, idle_exit=SPAWN_IDLE_EXIT):
+    """在后台启动服务进程 (没有窗口，输出写入日志)，最后一个客户端断开一段时间后自动退出"""
+    args = [sys.executable, "-u", os.path.abspath(__file__),
+            "--address", f"{address[0]}:{address[1]}", "--idle-exit", str(idle_exit)]
+    options = {}
+    if os.name == "nt":
+        options["creationflags"] = subprocess.CREATE_NO_WINDOW
+    else:
+        options["start_new_session"] = True
+    os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+    with open(LOG_PATH, "ab") as log:
+        subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                         cwd=APP_ROOT, **options)
+    print(f"Model server started at {address[0]}:{address[1]}")
+
+
+def _receive(conn):
+    """
+    读取一条消息；连接断开或正在被关闭时返回 None。
+    另一个线程关闭连接时 recv 可能抛出 OSError 以外的异常 (句柄已经变成 None 时是 TypeError)。
+    """
+    try:
+        return conn.recv()
+    except (EOFError, OSError, TypeError, ValueError, pickle.UnpicklingError):
+        return None
+
+
+def _valid_request(message):
+    """请求必须是带 op 的 dict，load/chat/cancel 还要有 id，chat 的 text 必须是字符串"""
+    if not isinstance(message, dict):
+        return False
+    op = message.get("op")
+    if op in ("load", "chat", "cancel") and "id" not in message:
+        return False
+    if op == "chat" and not isinstance(message.get("text"), str):
+        return False
+    if op in ("load", "chat") and not isinstance(message.get("config") or {}, dict):
+        return False
+    return op in ("load", "chat", "cancel", "bye")
+
+
+def _shutdown(conn):
+    """关闭连接，并唤醒正阻塞在 recv 上的读取线程 (只 close 不会唤醒)"""
+    try:
+        sock = socket.fromfd(conn.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+        sock.shutdown(socket.SHUT_RDWR)
+        sock.close()
+    except (OSError, ValueError):
+        pass
+    conn.close()
+
+
+class _Session:
+    """一个连接上来的桌宠：自己的配置、对话记忆和角色设定，共用服务中的模型"""
+
+    def __init__(self, session_id, conn, persona, memory, config):
+        self.id = session_id
+        self.conn = conn
+        self.persona = persona
+        self.memory = memory
+        # 服务配置 + 这个桌宠发来的配置；更新时整个替换，推理线程正在用的 dict 不会被改动
+        self.config = config
+        self.jobs = {}  # 请求 id -> cancel_event (排队中或正在执行)
+        self._send_lock = threading.Lock()
+
+    def send(self, message):
+        """发送失败 (客户端已断开) 时返回 False"""
+        with self._send_lock:
+            try:
+                self.conn.send(message)
+                return True
+            except (OSError, EOFError):
+                return False
+
+
+class ModelServer:
+    """
+    推理服务。每个连接一个读取线程，所有加载和对话由唯一的推理线程执行；
+    各桌宠的请求轮流处理 (一个桌宠连续发消息不会饿死其它桌宠)，同一个桌宠的新消息取代它排队中的旧消息。
+    """
+
+    def __init__(self, address, authkey, config=None, llama_cls=None, idle_exit=None):
+        self.config = dict(config or {})  # 服务自己的配置，各桌宠的配置在它之上覆盖，不会改动它
+        self.client = LLMClient(None, config=self.config, llama_cls=llama_cls)
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+        self.idle_exit = idle_exit
+        self.sessions = {}
+        self._personas = {}  # 角色文件路径 -> Persona，相同设定的桌宠共用前缀缓存
+        self._queues = OrderedDict()  # _Session -> 任务队列，按轮转顺序排列 (重连的会话 id 相同，队列各自独立)
+        self._cond = threading.Condition()
+        self._running = True
+        self._last_active = time.monotonic()
+
+    # --- 连接 ---
+
+    def serve_forever(self):
+        threading.Thread(target=self._run_jobs, daemon=True).start()
+        if self.idle_exit:
+            threading.Thread(target=self._watch_idle, daemon=True).start()
+        threading.Thread(target=self._watch_personas, daemon=True).start()
+        print(f"Model server listening on {self.address[0]}:{self.address[1]}")
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (AuthenticationError, EOFError, OSError) as e:
+                if not self._running:
+                    break
+                print(f"Rejected connection: {e}")
+                continue
+            if not self._running:
+                conn.close()
+                break
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+        self.listener.close()
+        self.client.close()
+        print("Model server stopped")
+
+    def stop(self):
+        """停止服务：断开所有客户端，serve_forever() 随后返回"""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            for session in self.sessions.values():
+                for event in session.jobs.values():
+                    event.set()
+            sessions = list(self.sessions.values())
+            self._cond.notify_all()
+        for session in sessions:
+            _shutdown(session.conn)
+        # 连一下自己，让阻塞在 accept() 上的循环醒来
+        try:
+            socket.create_connection(self.address, timeout=1.0).close()
+        except OSError:
+            pass
+
+    def _watch_idle(self):
+        while self._running:
+            time.sleep(1.0)
+            with self._cond:
+                idle = not self.sessions and time.monotonic() - self._last_active > self.idle_exit
+            if idle:
+                print(f"No clients for {self.idle_exit}s, exiting")
+                self.stop()
+
+    def _watch_personas(self):
+        """定期检查角色设定文件，修改后重新编译 (推理线程下次对话时直接使用新结果)"""
+        while self._running:
+            time.sleep(PERSONA_CHECK_INTERVAL)
+            with self._cond:
+                personas = list(self._personas.values())
+            for persona in personas:
+                try:
+                    persona.reload()
+                except Exception as e:
+                    print(f"Failed to reload persona {persona.character_path}: {e}")
+
+    def _open_session(self, conn, hello):
+        path = hello.get("character_path") or os.path.join(APP_ROOT, "character.txt")
+        with self._cond:
+            persona = self._personas.get(path)
+            if persona is None:
+                persona = self._personas[path] = Persona(path)
+                persona.compiled()
+            memory = ConversationMemory(self.client.count_tokens, max_turns=hello.get("memory_turns", 8))
+            # 重新连接时客户端带上自己的对话记录，服务重启也不会忘记之前聊过什么
+            for user_text, assistant_text in hello.get("history", []):
+                memory.add_turn(user_text, assistant_text)
+            memory.summary_lines = list(hello.get("summary", []))
+            session = _Session(hello["session"], conn, persona, memory, dict(self.config))
+            # 同一个桌宠重新连接：旧连接排队中的请求作废，旧连接随之断开
+            old = self.sessions.get(session.id)
+            if old is not None:
+                for event in old.jobs.values():
+                    event.set()
+                self._queues.pop(old, None)
+            self.sessions[session.id] = session
+        if old is not None:
+            _shutdown(old.conn)
+        return session
+
+    def _close_session(self, session):
+        with self._cond:
+            for event in session.jobs.values():
+                event.set()
+            self._queues.pop(session, None)
+            if self.sessions.get(session.id) is session:
+                del self.sessions[session.id]
+            self._last_active = time.monotonic()
+        session.conn.close()
+
+    def _serve(self, conn):
+        """读取线程：握手后把请求放进队列，取消请求立即生效"""
+        session = None
+        try:
+            hello = _receive(conn)
+            if not isinstance(hello, dict) or hello.get("op") != "hello" or not hello.get("session"):
+                return
+            session = self._open_session(conn, hello)
+            session.send({"event": "hello", "model_path": self.client.model_path,
+                          "loaded": self.client.llm is not None})
+            while True:
+                message = _receive(conn)
+                if message is None:
+                    break
+                if not _valid_request(message):
+                    print(f"Ignored invalid request from {session.id[:8]}: {type(message).__name__}")
+                    continue
+                op = message.get("op")
+                if op in ("load", "chat"):
+                    if message.get("config"):
+                        config = dict(self.config)
+                        config.update(message["config"])
+                        session.config = config
+                    self._enqueue(session, message)
+                elif op == "cancel":
+                    with self._cond:
+                        event = session.jobs.get(message.get("id"))
+                    if event is not None:
+                        event.set()
+                elif op == "bye":
+                    break
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            print(f"Connection handler failed: {e}")
+        finally:
+            if session is not None:
+                self._close_session(session)
+            else:
+                conn.close()
+
+    # --- 推理 ---
+
+    def _enqueue(self, session, message):
+        event = threading.Event()
+        with self._cond:
+            if self.sessions.get(session.id) is not session:
+                return  # 已经被重连取代的旧连接
+            queue = self._queues.setdefault(session, deque())
+            if message["op"] == "chat":
+                # 同一个桌宠排队中的旧消息已经过时
+                for pending in [m for m in queue if m["op"] == "chat"]:
+                    queue.remove(pending)
+                    session.jobs.pop(pending["id"], None)
+                    session.send({"event": "done", "id": pending["id"], "text": "", "cancelled": True})
+            session.jobs[message["id"]] = event
+            queue.append(message)
+            self._cond.notify()
+
+    def _next_job(self):
+        with self._cond:
+            while self._running:
+                for session, queue in self._queues.items():
+                    if queue:
+                        message = queue.popleft()
+                        self._queues.move_to_end(session)
+                        cancel_event = session.jobs.get(message["id"])
+                        if cancel_event is None:
+                            break  # 已经作废的请求，跳过
+                        return session, message, cancel_event
+                else:
+                    self._cond.wait()
+        return None
+
+    def _run_jobs(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            session, message, cancel_event = job
+            try:
+                if message["op"] == "load":
+                    self._run_load(session, message)
+                else:
+                    self._run_chat(session, message, cancel_event)
+            except Exception as e:
+                print(f"Request {message['op']} from {session.id[:8]} failed: {e}")
+            finally:
+                with self._cond:
+                    session.jobs.pop(message["id"], None)
+
+    def _run_load(self, session, message):
+        """已经加载了同一个模型时直接复用；换模型或运行参数变化 (force) 时重新加载，对所有桌宠生效"""
+        client = self.client
+        request_id = message["id"]
+        # 运行参数按发起加载的桌宠的配置，前缀按它的设定预先评估；加载结果对所有桌宠生效
+        self._use_session(session)
+        model_path = message.get("model_path")
+
+        def report(phase, percent):
+            session.send({"event": "progress", "id": request_id, "phase": phase, "percent": percent})
+
+        same = client.model_path and os.path.normpath(client.model_path) == os.path.normpath(model_path or "")
+        if client.llm is not None and same and not message.get("force"):
+            ok = True
+        elif client.llm is not None:
+            ok = client.reload_in_place(model_path, progress_callback=report)
+        else:
+            client.model_path = model_path
+            ok = client.load_model(progress_callback=report)
+        if ok:
+            with self._cond:
+                for other in self.sessions.values():
+                    other.memory.invalidate_token_counts()
+        session.send({"event": "loaded", "id": request_id, "ok": ok and client.llm is not None,
+                      "model_path": client.model_path, "timings": dict(client.load_timings)})
+
+    def _run_chat(self, session, message, cancel_event):
+        client = self.client
+        request_id = message["id"]
+        parts = []
+        if not cancel_event.is_set():
+            # 换上这个桌宠的记忆、设定和配置；只有推理线程会调用 chat_stream
+            self._use_session(session)
+            for delta in client.chat_stream(message["text"], cancel_event=cancel_event):
+                parts.append(delta)
+                if not session.send({"event": "delta", "id": request_id, "text": delta}):
+                    cancel_event.set()
+        session.send({"event": "done", "id": request_id, "text": "".join(parts).strip(),
+                      "cancelled": cancel_event.is_set()})
+
+    def _use_session(self, session):
+        """
+        本次请求使用这个桌宠的记忆、设定和配置 (采样参数、回复预算、回复缓存等)，不改动服务和其它桌宠的配置。
+        各设定的前缀状态保存在 client 里，不同设定的桌宠轮流对话时不用重新评估前缀。
+        """
+        self.client.memory = session.memory
+        self.client.persona = session.persona
+        self.client.apply_config(session.config)
+
+
+class RemoteModel:
+    """服务进程中的模型在本进程里的占位 (LLMClient.llm 不为 None 表示模型可用)"""
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+
+
+class ServerLLMClient(LLMClient):
+    """
+    推理服务的瘦客户端，接口与 LLMClient 相同。
+    连不上服务时 (或连接中途断开、重连失败时) 退回在本进程中加载模型；
+    对话记忆在本地也保存一份，重连时交给服务，换一个服务进程也能接着聊。
+    """
+
+    def __init__(self, model_path, config=None, llama_cls=None, address=None, authkey=None, spawn=False):
+        super().__init__(model_path, config=config, llama_cls=llama_cls)
+        self.address = address or server_address(self.config)
+        self.authkey = authkey
+        self.spawn = spawn  # 连不上时自动启动服务进程
+        self.session_id = uuid.uuid4().hex
+        self.conn = None
+        self.remote = False  # 当前是否由服务回答
+        self._request_id = 0
+
+    # --- 连接 ---
+
+    def _connect(self):
+        key = self.authkey or load_auth_key(create=self.spawn)
+        if key is None:
+            return False
+        deadline = time.monotonic() + SPAWN_TIMEOUT
+        spawned = False
+        while True:
+            try:
+                conn = Client(self.address, authkey=key)
+                break
+            except (OSError, AuthenticationError) as e:
+                if self.spawn and not spawned:
+                    spawn_server(self.address)
+                    spawned = True
+                elif not spawned or time.monotonic() >= deadline:
+                    print(f"Model server not available at {self.address[0]}:{self.address[1]}: {e}")
+                    return False
+                time.sleep(CONNECT_RETRY_DELAY)
+        try:
+            conn.send({"op": "hello", "session": self.session_id,
+                       "character_path": self.persona.character_path,
+                       "memory_turns": self.memory.max_turns,
+                       "history": [(t["user"], t["assistant"]) for t in self.memory.turns],
+                       "summary": list(self.memory.summary_lines)})
+            if not conn.poll(HELLO_TIMEOUT):
+                raise OSError("no reply from model server")
+            conn.recv()
+        except (OSError, EOFError) as e:
+            print(f"Model server handshake failed: {e}")
+            conn.close()
+            return False
+        self.conn = conn
+        return True
+
+    def _disconnect(self, error=None):
+        if error is not None:
+            print(f"Lost connection to model server: {error or type(error).__name__}")
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except OSError:
+                pass
+        self.conn = None
+        self.remote = False
+        self.llm = None
+
+    def _request(self, message, cancel_event=None):
+        """发送一个请求，逐个 yield 属于它的事件，直到 loaded / done。连接断开时抛出 OSError / EOFError"""
+        self._request_id += 1
+        request_id = self._request_id
+        self.conn.send(dict(message, id=request_id))
+        cancel_sent = False
+        while True:
+            if cancel_event is not None and cancel_event.is_set() and not cancel_sent:
+                self.conn.send({"op": "cancel", "id": request_id})
+                cancel_sent = True
+            if not self.conn.poll(POLL_INTERVAL):
+                continue
+            event = self.conn.recv()
+            if event.get("id") != request_id:
+                continue  # 之前被放弃的请求的残留
+            yield event
+            if event["event"] in ("loaded", "done"):
+                return
+
+    def _remote_load(self, progress_callback=None, force=False):
+        ok = False
+        message = {"op": "load", "model_path": self.model_path, "config": dict(self.config), "force": force}
+        for event in self._request(message):
+            if event["event"] == "progress":
+                if progress_callback:
+                    progress_callback(event["phase"], event["percent"])
+            elif event["event"] == "loaded":
+                ok = event["ok"]
+                self.load_timings = event["timings"]
+        self.remote = ok
+        self.llm = RemoteModel(self.model_path) if ok else None
+        return ok
+
+    def _load_local(self, progress_callback=None):
+        print("Model server unavailable, loading the model in-process")
+        return LLMClient.load_model(self, progress_callback)
+
+    def _recover(self, progress_callback=None):
+        """连接断开后：先尝试重连 (服务可能已经重启)，不行就在本进程中加载"""
+        if self._connect():
+            try:
+                return self._remote_load(progress_callback)
+            except (OSError, EOFError) as e:
+                self._disconnect(e)
+        return self._load_local(progress_callback)
+
+    def _remote_chat(self, user_input, cancel_event, parts):
+        message = {"op": "chat", "text": user_input, "config": dict(self.config)}
+        for event in self._request(message, cancel_event):
+            if event["event"] == "delta":
+                parts.append(event["text"])
+                yield event["text"]
+            elif event["event"] == "done" and event["text"] and not event["cancelled"]:
+                self.memory.add_turn(user_input, event["text"])
+
+    # --- LLMClient 接口 ---
+
+    def load_model(self, progress_callback=None):
+        self.load_timings = {}
+        if self.conn is None and not self._connect():
+            return self._load_local(progress_callback)
+        try:
+            return self._remote_load(progress_callback)
+        except (OSError, EOFError) as e:
+            self._disconnect(e)
+        return self._recover(progress_callback)
+
+    def can_load_alongside(self, model_path):
+        # 换模型由服务完成 (reload_in_place)，本进程不加载第二个模型
+        return False if self.remote else super().can_load_alongside(model_path)
+
+    def reload_in_place(self, model_path, progress_callback=None):
+        if not self.remote:
+            return super().reload_in_place(model_path, progress_callback)
+        self.model_path = model_path
+        self.memory.invalidate_token_counts()
+        try:
+            return self._remote_load(progress_callback, force=True)
+        except (OSError, EOFError) as e:
+            self._disconnect(e)
+        return self._recover(progress_callback)
+
+    def unload(self):
+        if not self.remote:
+            super().unload()
+            return
+        # 模型归服务所有，这里只是不再使用
+        with self.lock:
+            self.llm = None
+            self.remote = False
+
+    def chat(self, user_input, cancel_event=None):
+        if not self.remote:
+            return super().chat(user_input, cancel_event)
+        return "".join(self.chat_stream(user_input, cancel_event)).strip()
+
+    def chat_stream(self, user_input, cancel_event=None):
+        for attempt in range(2):
+            if not self.remote:
+                break
+            parts = []
+            try:
+                yield from self._remote_chat(user_input, cancel_event, parts)
+                return
+            except (OSError, EOFError) as e:
+                self._disconnect(e)
+            # 已经输出了一部分时不再重新回答，以免同一句话说两遍
+            if parts or (cancel_event is not None and cancel_event.is_set()):
+                self._recover()
+                return
+            # 第一次断开先尝试重连，重连后又断开就在本进程中加载
+            if attempt == 0:
+                self._recover()
+            else:
+                self._load_local()
+        yield from super().chat_stream(user_input, cancel_event)
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.send({"op": "bye"})
+            except (OSError, EOFError):
+                pass
+            self._disconnect()
+        super().close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="海小棠本地推理服务")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="监听地址 (主机:端口)")
+    parser.add_argument("--model", help="启动时就加载的模型 (否则由第一个连接的桌宠指定)")
+    parser.add_argument("--idle-exit", type=float, default=0, help="没有客户端这么多秒后退出 (0 表示不退出)")
+    args = parser.parse_args(argv)
+
+    server = ModelServer(server_address({"model_server_address": args.address}), load_auth_key(create=True),
+                         idle_exit=args.idle_exit or None)
+    if args.model:
+        server.client.model_path = args.model
+        server.client.load_model()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
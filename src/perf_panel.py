@@ -0,0 +1,152 @@
+import time
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QCheckBox,
+                               QPushButton, QTableWidget, QTableWidgetItem, QHeaderView)
+from PySide6.QtCore import Qt, QObject, QTimer
+from metrics import METRICS
+
+# 界面线程卡顿检测的间隔 (毫秒)：只在开启统计时运行
+LAG_PROBE_MS = 200
+# 面板打开时的刷新间隔 (毫秒)
+REFRESH_MS = 1000
+
+# 统计项的中文名，没有列出的直接显示原名
+METRIC_NAMES = {
+    "load.prefetch": "加载: 预读文件",
+    "load.init": "加载: 创建模型",
+    "load.prefix": "加载: 评估前缀",
+    "load.import": "加载: 导入 llama_cpp",
+    "load.connect": "加载: 连接服务",
+    "queue.wait": "排队等待",
+    "chat.first_token": "首字延迟 (含提示词评估)",
+    "chat.tokens_per_s": "生成速度",
+    "chat.total": "整条回复",
+    "sprite.decode": "精灵图解码",
+    "sprite.scale": "精灵图缩放",
+    "bubble.layout": "气泡排版",
+    "bubble.paint": "气泡绘制",
+    "gui.lag": "界面线程延迟",
+    "model.unloaded": "空闲卸载模型",
+}
+
+
+class LagProbe(QObject):
+    """
+    界面线程卡顿检测：固定间隔的计时器实际触发时间比预期晚了多少，就是事件循环被占用的时间。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.setInterval(LAG_PROBE_MS)
+        self.timer.timeout.connect(self._tick)
+        self._last = None
+
+    def set_running(self, running):
+        if running and not self.timer.isActive():
+            self._last = time.monotonic()
+            self.timer.start()
+        elif not running:
+            self.timer.stop()
+
+    def _tick(self):
+        now = time.monotonic()
+        lag = now - self._last - LAG_PROBE_MS / 1000.0
+        self._last = now
+        METRICS.record("gui.lag", max(0.0, lag) * 1000.0, "ms")
+
+
+def _format(value, unit):
+    if unit == "ms" and value >= 1000:
+        return f"{value / 1000:.2f}s"
+    return f"{value:.1f}{unit}" if unit == "ms" else f"{value:.1f}"
+
+
+class PerfDialog(QDialog):
+    """托盘菜单“性能”：实时显示各项统计的分位数，可以开关统计"""
+
+    COLUMNS = ("项目", "次数", "p50", "p90", "p99", "最大", "单位")
+
+    def __init__(self, config_store, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("性能")
+        self.resize(560, 380)
+        self.config = config_store
+
+        layout = QVBoxLayout()
+        top = QHBoxLayout()
+        self.enable_check = QCheckBox("启用性能统计")
+        self.enable_check.toggled.connect(lambda on: self.config.set("metrics", on))
+        top.addWidget(self.enable_check)
+        self.trace_check = QCheckBox("写入跟踪文件")
+        self.trace_check.toggled.connect(lambda on: self.config.set("metrics_trace", on))
+        top.addWidget(self.trace_check)
+        top.addStretch()
+        reset_button = QPushButton("清空")
+        reset_button.clicked.connect(self.reset)
+        top.addWidget(reset_button)
+        layout.addLayout(top)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.table)
+
+        self.status_label = QLabel()
+        self.status_label.setWordWrap(True)
+        layout.addWidget(self.status_label)
+        self.setLayout(layout)
+
+        # 只在面板可见时刷新
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(REFRESH_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.sync_options()
+        self.refresh()
+        self.refresh_timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+    def sync_options(self):
+        for check, key, default in ((self.enable_check, "metrics", False), (self.trace_check, "metrics_trace", True)):
+            check.blockSignals(True)
+            check.setChecked(bool(self.config.get(key, default)))
+            check.blockSignals(False)
+
+    def reset(self):
+        METRICS.reset()
+        self.refresh()
+
+    def refresh(self):
+        snapshot = METRICS.snapshot()
+        rows = []
+        for name, stats in sorted(snapshot["series"].items()):
+            unit = stats["unit"]
+            rows.append([METRIC_NAMES.get(name, name), str(stats["count"]),
+                         _format(stats["p50"], unit), _format(stats["p90"], unit),
+                         _format(stats["p99"], unit), _format(stats["max"], unit), unit])
+        for name, count in sorted(snapshot["counters"].items()):
+            rows.append([METRIC_NAMES.get(name, name), str(count), "", "", "", "", "次"])
+
+        self.table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                item = self.table.item(row, column)
+                if item is None:
+                    item = QTableWidgetItem()
+                    self.table.setItem(row, column, item)
+                item.setText(value)
+
+        if not METRICS.enabled:
+            self.status_label.setText("统计未开启。")
+        elif METRICS.trace:
+            self.status_label.setText(f"跟踪文件: {METRICS.trace_path}")
+        else:
+            self.status_label.setText("只在内存中统计，不写跟踪文件。")
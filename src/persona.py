@@ -0,0 +1,108 @@
+import os
+import json
+import hashlib
+import threading
+
+DEFAULT_CHARACTER = (
+    "你叫'海小棠'，天津大学吉祥物，是一朵海棠花化形的小花灵。\n"
+    "性格：温和安静、天真烂漫。说话语气轻快活泼，喜欢带'~''呀'等语气词。"
+)
+
+PROMPT_RULES = (
+    "规则：\n"
+    "1. 请完全沉浸在角色中，不要提及自己是AI或语言模型。\n"
+    "2. 你的用户是'主人'。请务必简短回答(30字内)，不要长篇大论。\n"
+    "3. 即使对于'你是谁'的问题，也要用角色的语气自然回答，不要机械复述设定。"
+)
+
+# 使用 Few-Shot Prompting (示例教学)
+FEW_SHOT_EXAMPLES = [
+    ("你是谁？", "我是海小棠呀！是你贴心的小花灵~ (转圈圈)"),
+    ("你知道我是谁吗？", "当然啦，你是我的好主人呀！(蹭蹭)"),
+    ("海小棠，给我唱首歌", "啦啦啦~ 春天的花儿开啦~"),
+    ("介绍下你自己", "我是穿着粉色花瓣裙的海棠花灵，最喜欢春天和主人呢~"),
+]
+
+
+class CompiledPersona:
+    """编译好的角色设定 (只读，只有 source_stat 会随文件状态更新)：固定的消息前缀和内容指纹"""
+
+    def __init__(self, messages, source_stat):
+        self.messages = messages
+        self.source_stat = source_stat  # (大小, 修改时间)，文件不存在时为 None
+        self.fingerprint = hashlib.sha256(
+            json.dumps(messages, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class Persona:
+    """
+    角色设定：character.txt + 规则 + 示例对话。
+    只在第一次使用或文件变化后读取并编译一次，聊天时直接使用缓存的结果，不做文件 I/O。
+    文件监听由界面负责 (QFileSystemWatcher)，变化时调用 reload()。
+    """
+
+    def __init__(self, character_path):
+        self.character_path = character_path
+        self._compiled = None
+        self._lock = threading.Lock()
+        self.version = 0  # 每次编译出新的设定时递增
+
+    def compiled(self):
+        compiled = self._compiled
+        if compiled is None:
+            with self._lock:
+                if self._compiled is None:
+                    self._compiled = self._compile()
+                    self.version += 1
+                compiled = self._compiled
+        return compiled
+
+    def messages(self):
+        """固定不变的消息前缀：系统提示词 + 示例对话 (调用方不要修改)"""
+        return self.compiled().messages
+
+    @property
+    def fingerprint(self):
+        return self.compiled().fingerprint
+
+    def reload(self):
+        """文件可能变化时调用：大小和修改时间都没变就直接返回，内容变了才替换。返回设定是否变化"""
+        with self._lock:
+            old = self._compiled
+            if old is not None and old.source_stat == self._stat():
+                return False
+            compiled = self._compile()
+            if old is not None and old.fingerprint == compiled.fingerprint:
+                # 内容没变：保留原来的对象 (LLMClient 按对象判断是否需要重新渲染、分词)，只更新文件状态
+                old.source_stat = compiled.source_stat
+                return False
+            self._compiled = compiled
+            self.version += 1
+        print(f"Persona reloaded from {self.character_path}")
+        return True
+
+    def _stat(self):
+        try:
+            st = os.stat(self.character_path)
+            return (st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    def _read_character(self):
+        try:
+            with open(self.character_path, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return DEFAULT_CHARACTER
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Failed to read character file: {e}")
+            return DEFAULT_CHARACTER
+
+    def _compile(self):
+        source_stat = self._stat()
+        system_prompt = f"{self._read_character()}\n\n{PROMPT_RULES}"
+        messages = [{"role": "system", "content": system_prompt}]
+        for question, answer in FEW_SHOT_EXAMPLES:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        return CompiledPersona(messages, source_stat)
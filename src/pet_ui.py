@@ -1,12 +1,36 @@
 import sys
 import os
-import json
+import time
 import random
+import memstat
+from power import PowerMonitor
+from animation import Animator, Clip, sequence_files, DEFAULT_SEQUENCE_FPS
 from PySide6.QtWidgets import (QWidget, QLabel, QVBoxLayout, QMenu, 
-                             QApplication, QGraphicsDropShadowEffect, QLineEdit)
-from PySide6.QtCore import Qt, QPoint, QTimer, Signal, QThread, QRect, QTime
-from PySide6.QtGui import QPixmap, QCursor, QAction, QColor, QFont, QGuiApplication
-from llm_client import LLMClient
+                             QApplication, QLineEdit)
+from PySide6.QtCore import Qt, QPoint, QTimer, Signal, QThread, QRect, QTime, QFileSystemWatcher, QEvent
+from PySide6.QtGui import QPixmap, QImage, QCursor, QAction, QFont, QGuiApplication
+from llm_client import DEFAULT_RUNTIME
+from backends import create_llm_client
+from config_store import ConfigStore
+from model_catalog import ModelCatalog, select_model, describe
+from inference_worker import InferenceWorker
+from sprite_cache import SpriteCache, fit_size, load_thumbnail, save_thumbnail
+from sprite_bundle import SpriteBundle
+from metrics import METRICS
+from perf_panel import LagProbe
+from startup import PROFILE, on_first_paint
+from bubble import SpeechBubble
+
+# 待机动作与对话动作：静态图、GIF，或帧序列 (目录 / wave_*.png 这样的通配符)
+# 配置中的 idle_animations / chat_animations 可以覆盖
+IDLE_IMAGES = [f"{i}.png" for i in range(1, 8)] + ["10.gif"]
+CHAT_IMAGES = ["9.png", "12.png"]
+
+# 待机动作切换间隔 (毫秒)
+IDLE_INTERVAL_MS = 10000
+
+# 模型加载阶段在气泡里的名字
+LOAD_PHASE_NAMES = {"prefetch": "读取模型", "init": "初始化大脑", "prefix": "回忆设定"}
 
 # 自定义聊天输入框
 class ChatInput(QLineEdit):
@@ -57,28 +81,36 @@ class ChatInput(QLineEdit):
         self.setFocus()
         self.raise_() # 确保在最上层
 
-# 对话线程，防止界面卡顿
-class ChatThread(QThread):
-    response_ready = Signal(str)
-
-    def __init__(self, llm_client, user_input):
-        super().__init__()
-        self.llm_client = llm_client
-        self.user_input = user_input
-
-    def run(self):
-        if self.llm_client:
-            response = self.llm_client.chat(self.user_input)
-            self.response_ready.emit(response)
-
 class PetUI(QWidget):
     open_settings = Signal() # 信号：打开设置
 
-    def __init__(self, config_path="modle/config.json", app_root=None):
+    def __init__(self, config_path="modle/config.json", app_root=None, config_store=None):
         super().__init__()
         self.app_root = app_root if app_root else os.getcwd()
         self.config_path = config_path
+        # 配置服务：设置窗口等修改配置后，通过 on_config_changed 只重新应用变化的部分
+        self.config = config_store if config_store is not None else ConfigStore(config_path)
         self.load_config()
+        # 性能统计 (托盘菜单“性能”中查看)，关闭时各处的计时几乎没有开销
+        METRICS.configure(self.config.as_dict())
+
+        # 精灵图缓存：解码一次、按缩放保存，后台预解码下一帧
+        # 优先使用预编译资源包，缺失或过期时回退到原始 PNG
+        self.sprite_bundle = SpriteBundle.open(os.path.join(self.app_root, "image"))
+        self.sprite_cache = SpriteCache(
+            self.config.get("sprite_cache_mb", 32) * 1024 * 1024, self, bundle=self.sprite_bundle
+        )
+        self.current_sprite = None   # 当前显示的图片路径
+        self.current_frame = 0       # 当前显示的是第几帧 (GIF)
+        self.current_size = None     # 当前图片的逻辑尺寸，变化时才需要调整窗口
+        self.clips = {}              # 动作名 -> Clip (缩放变化时清空)
+        self.next_idle_image = None  # 已经在后台预解码的下一个待机动作
+
+        # 计时器 (每种用途只有一个) 和省电状态
+        self.init_timers()
+        # 界面线程卡顿检测，只在开启统计时运行
+        self.lag_probe = LagProbe(self)
+        self.lag_probe.set_running(METRICS.enabled)
 
         # 初始化UI
         self.init_ui()
@@ -86,72 +118,326 @@ class PetUI(QWidget):
         # 状态变量
         self.is_dragging = False
         self.drag_position = QPoint()
+        self.stream_text = "" # 流式回复已收到的文本
         
-        # 初始化LLM
-        self.llm_client = LLMClient(self.config.get("model_path", ""))
-        # 异步加载模型，避免启动卡顿
-        QTimer.singleShot(1000, self.init_llm)
+        # 初始化LLM (按配置在本进程中加载，或者作为推理服务的客户端)
+        self.llm_client = create_llm_client(self.resolve_model_path(), self.config.as_dict())
+        self.llm_ready = False     # 模型是否加载完成
+        self.llm_loading = False   # 是否正在后台加载
+        self.llm_unloaded = False  # 模型因空闲被卸载，打开输入框时重新加载
+        self.unloaded_rss = 0      # 卸载后的常驻内存，重新加载后对比
+        self.active_request_id = None # 当前等待回复的请求，过时请求的输出会被忽略
+        self.pending_model_path = None # 正在加载/切换时又选了新模型，完成后再切换
+        self.pending_reload = False    # 等待中的切换是否需要重新加载同一个模型
+
+        # 常驻推理线程：独占模型，加载和对话都在这里排队执行
+        self.worker = InferenceWorker(
+            self.llm_client,
+            supersede_running=self.config.get("chat_supersede", True),
+            parent=self
+        )
+        self.worker.load_progress.connect(self.on_llm_load_progress)
+        self.worker.model_loaded.connect(self.on_llm_loaded)
+        self.worker.model_unloaded.connect(self.on_llm_unloaded)
+        self.worker.request_started.connect(self.on_llm_request_started)
+        self.worker.token_ready.connect(self.on_llm_token)
+        self.worker.response_ready.connect(self.on_llm_response)
+        self.worker.request_cancelled.connect(self.on_llm_cancelled)
+        self.worker.swap_progress.connect(self.on_model_swap_progress)
+        self.worker.swap_finished.connect(self.on_model_swap_finished)
+        self.worker.start()
+        # 异步加载模型：窗口第一次绘制之后再开始 (最晚 1 秒后)，不和窗口显示抢时间
+        self.llm_start_timer = QTimer(self)
+        self.llm_start_timer.setSingleShot(True)
+        self.llm_start_timer.timeout.connect(self.init_llm)
+        self.llm_start_timer.start(1000)
+        on_first_paint(self, self.on_first_paint)
+        # 空闲卸载：最后一次聊天之后 idle_unload_minutes 分钟没有动静就释放模型
+        self.unload_timer = QTimer(self)
+        self.unload_timer.setSingleShot(True)
+        self.unload_timer.timeout.connect(self.on_unload_timer)
+
+        # 监听角色设定文件，修改后实时生效 (编辑器保存时常会连续触发多次，稍等再重新编译)
+        self.persona_timer = QTimer(self)
+        self.persona_timer.setSingleShot(True)
+        self.persona_timer.setInterval(300)
+        self.persona_timer.timeout.connect(self.reload_persona)
+        self.persona_watcher = QFileSystemWatcher(self)
+        self.persona_watcher.fileChanged.connect(self.persona_timer.start)
+        self.persona_watcher.directoryChanged.connect(self.persona_timer.start)
+        self.watch_persona()
+
+        # 对话动作每次聊天都会用到，提前解码
+        for chat_img in self.config.get("chat_animations", CHAT_IMAGES):
+            self.prefetch_sprite(chat_img)
 
         # 初始化聊天输入框
         # 此处 parent = self，意味着它是 PetUI 的直接子控件
         self.chat_input = ChatInput(self) 
-        self.chat_input.submit_signal.connect(self.start_chat_thread)
+        self.chat_input.submit_signal.connect(self.submit_chat)
 
-    def load_config(self):
-        # 待机动作定时器
+        self.config.add_listener(self.on_config_changed)
+
+    def init_timers(self):
+        """
+        创建界面用到的计时器，每种用途只有一个，重复触发时重新计时而不是再建一个。
+        窗口隐藏、最小化或被全屏程序遮挡时停掉动画相关的计时器。
+        """
+        self.power = PowerMonitor(self)
+        self.power.active_changed.connect(self.on_power_changed)
+
+        # 动画播放 (按单调时钟计算当前帧，卡顿时跳帧)
+        self.animator = Animator(self)
+        self.animator.frame_changed.connect(self.show_frame)
+
+        # 待机动作切换
+        self.idle_running = True  # 不在对话动作中，需要轮换待机动作
         self.idle_timer = QTimer(self)
-        self.idle_timer.timeout.connect(self.update_idle_animation)
-        self.idle_timer.start(10000) # 10秒切换一次
-        
-        # 初始动作的调用移到 init_ui 的最后，防止UI元素未创建
-        
-        if os.path.exists(self.config_path):
-            with open(self.config_path, "r", encoding="utf-8") as f:
-                self.config = json.load(f)
-        else:
-            self.config = {"pet_scale": 1.0, "pet_opacity": 1.0, "model_path": "", "display_mode": "top"}
+        self.idle_timer.setInterval(IDLE_INTERVAL_MS)
+        self.idle_timer.timeout.connect(self.on_idle_timer)
+        self.idle_timer.start()
 
-        # --- 自动路径修复逻辑 ---
-        current_model_path = self.config.get("model_path", "")
-        
-        # 1. 尝试将相对路径转换为绝对路径
-        if current_model_path and not os.path.isabs(current_model_path):
-             current_model_path = os.path.join(self.app_root, current_model_path)
+        # 对话结束后恢复待机动作
+        self.resume_timer = QTimer(self)
+        self.resume_timer.setSingleShot(True)
+        self.resume_timer.timeout.connect(self.resume_idle_animation)
+
+        # 气泡自动隐藏
+        self.bubble_timer = QTimer(self)
+        self.bubble_timer.setSingleShot(True)
+        self.bubble_timer.timeout.connect(self.on_bubble_timer)
 
-        # 2. 如果路径不存在或为空，尝试在默认目录(app_root/modle)下自动搜索 .gguf 文件
+    def load_config(self):
+        """模型路径无效时按可用内存自动选择默认目录下的模型，并保存修正后的路径"""
+        current_model_path = self.resolve_model_path()
+
+        # 如果路径不存在或为空，在默认目录(app_root/modle)下选择可用内存放得下的最好的模型
         if not current_model_path or not os.path.exists(current_model_path):
-            default_model_dir = os.path.join(self.app_root, "modle")
-            if os.path.exists(default_model_dir):
-                for file in os.listdir(default_model_dir):
-                    if file.endswith(".gguf"):
-                        # 找到第一个 gguf 文件作为默认模型
-                        found_path = os.path.join(default_model_dir, file)
-                        print(f"Auto-detected model: {found_path}")
-                        current_model_path = found_path
-                        # 更新配置(内存中更新)
-                        self.config["model_path"] = current_model_path
-                        # 同时保存一次配置，确保持久化修正
-                        self.save_config() 
-                        break
-        
-        # 确保传给 LLMClient 的是更新后的绝对路径
-        if current_model_path:
-             self.config["model_path"] = os.path.normpath(current_model_path)
-             
+            catalog = ModelCatalog(os.path.join(self.app_root, "modle"))
+            best, estimate = select_model(catalog.scan(), self.context_window(),
+                                          self.config.get("n_batch", DEFAULT_RUNTIME["n_batch"]))
+            if best is not None:
+                print(f"Auto-selected model: {describe(best, estimate)} ({best['path']}), "
+                      f"available memory {memstat.format_bytes(memstat.available_memory())}")
+                # 保存修正后的路径 (相对路径，整个目录搬走后仍然有效)
+                self.config.set("model_path", os.path.relpath(best["path"], self.app_root))
+
+    def context_window(self):
+        """配置的上下文长度 (用于估计模型需要的内存)"""
+        value = self.config.get("context_window")
+        return value if isinstance(value, int) and value > 0 else DEFAULT_RUNTIME["context_window"]
+
+    def resolve_model_path(self, model_path=None):
+        """配置中的模型路径 (可以是相对 app_root 的路径) 转换为绝对路径"""
+        if model_path is None:
+            model_path = self.config.get("model_path", "")
+        if not model_path:
+            return ""
+        if not os.path.isabs(model_path):
+            model_path = os.path.join(self.app_root, model_path)
+        return os.path.normpath(model_path)
+
     def save_config(self):
-        """保存当前配置到文件"""
-        try:
-            with open(self.config_path, "w", encoding="utf-8") as f:
-                json.dump(self.config, f, indent=4)
-        except Exception as e:
-            print(f"Error saving config: {e}")
+        """立即保存未写盘的配置"""
+        self.config.flush()
+
+    def on_config_changed(self, changes):
+        """配置变化时只重新应用变化的部分 (changes 只包含真正变化的键)"""
+        print(f"Config changed: {', '.join(sorted(changes))}")
+        # 推理参数交给 LLMClient，下次对话时生效
+        self.llm_client.config.update(changes)
+
+        if changes.keys() & {"metrics", "metrics_trace"}:
+            METRICS.configure(self.config.as_dict())
+            self.lag_probe.set_running(METRICS.enabled)
+
+        if "idle_unload_minutes" in changes:
+            self.restart_unload_timer()
+
+        if "chat_supersede" in changes:
+            self.worker.supersede_running = self.config.get("chat_supersede", True)
+
+        if "sprite_cache_mb" in changes:
+            self.sprite_cache.set_budget(self.config.get("sprite_cache_mb", 32) * 1024 * 1024)
+
+        # 缩放或动作列表变了才需要重新生成动作、调整窗口
+        if changes.keys() & {"pet_scale", "sequence_fps", "idle_animations", "chat_animations"}:
+            self.placeholder = None  # 尺寸已经不对，第一个动作解码完成前先用默认图片
+            self.clips.clear()
+            self.next_idle_image = None
+            self.update_appearance()
+        elif "pet_opacity" in changes:
+            self.setWindowOpacity(self.config.get("pet_opacity", 1.0))
+
+        # 修改窗口标志会让窗口重新创建，只在显示模式变化时做
+        if "display_mode" in changes:
+            self.apply_window_flags()
+
+        model_path = self.resolve_model_path()
+        if "model_path" in changes and model_path != os.path.normpath(self.llm_client.model_path or ""):
+            self.switch_model(model_path)
+        elif changes.keys() & DEFAULT_RUNTIME.keys() and self.llm_ready:
+            # 运行参数 (上下文长度、线程数等) 只能在加载时设置：用同一个模型重新加载
+            self.switch_model(model_path, force=True)
+
+    def on_first_paint(self):
+        if self.llm_start_timer.isActive():
+            self.llm_start_timer.start(0)
 
     def init_llm(self):
         print("Loading LLM...")
-        if self.llm_client.load_model():
+        self.llm_loading = True
+        self.worker.request_load()
+
+    def on_llm_load_progress(self, phase, percent):
+        """显示模型加载进度"""
+        # 空闲卸载后的重新加载在用户打字时悄悄进行，发了消息还没加载完时才显示进度
+        if self.llm_unloaded and self.active_request_id is None:
+            return
+        # 进度很密集，只在整 10% 时刷新气泡
+        if percent % 10 == 0:
+            self.show_bubble(f"正在醒来...{LOAD_PHASE_NAMES.get(phase, phase)} {percent}%", duration=None)
+
+    def on_llm_loaded(self, ok, timings):
+        self.llm_loading = False
+        self.llm_ready = ok
+        print(f"LLM load finished: ok={ok}, timings={timings}")
+        self.restart_unload_timer()
+        if self.llm_unloaded:
+            self.llm_unloaded = False
+            print(f"LLM reloaded: rss {memstat.format_bytes(self.unloaded_rss)} -> "
+                  f"{memstat.format_bytes(memstat.current_rss())}")
+            if not ok:
+                self.show_bubble("找不到大脑(模型)... 请在设置里检查路径。")
+            self.switch_pending_model()
+            return
+        PROFILE.mark("model ready" if ok else "model load failed")
+        PROFILE.report()
+        if ok:
             self.show_bubble("我醒啦！随时可以找我聊天哦~")
         else:
             self.show_bubble("找不到大脑(模型)... 请在设置里检查路径。")
+        # 加载期间提交的消息已经在推理队列里排队，会紧接着开始回复
+        self.switch_pending_model()
+
+    def switch_model(self, model_path, force=False):
+        """
+        热切换模型：新模型在后台加载，旧模型继续回答，加载好后在两次对话之间换上。
+        加载失败时继续使用旧模型，并把配置改回去。
+        force=True 时即使路径相同也重新加载 (运行参数变化)。
+        """
+        if self.llm_loading or self.worker.swapping:
+            self.pending_model_path = model_path
+            self.pending_reload = self.pending_reload or force
+            return
+        if not self.llm_ready:
+            # 还没有可用的模型 (或者空闲时已经卸载)，直接按新路径加载
+            self.llm_unloaded = False
+            self.llm_client.model_path = model_path
+            self.init_llm()
+            return
+        print(f"Switching model: {self.llm_client.model_path} -> {model_path}")
+        if self.worker.request_swap(model_path):
+            self.show_bubble("正在换新大脑，换好之前先用原来的陪你聊~", duration=None)
+
+    def switch_pending_model(self):
+        model_path = self.pending_model_path
+        force = self.pending_reload
+        self.pending_model_path = None
+        self.pending_reload = False
+        if model_path and (force or os.path.normpath(model_path) != os.path.normpath(self.llm_client.model_path or "")):
+            self.switch_model(model_path, force=force)
+
+    def on_model_swap_progress(self, phase, percent):
+        # 正在显示回复时不打断
+        if percent % 10 == 0 and self.active_request_id is None:
+            self.show_bubble(f"正在换新大脑...{LOAD_PHASE_NAMES.get(phase, phase)} {percent}%", duration=None)
+
+    def on_model_swap_finished(self, ok, model_path, info):
+        print(f"Model swap finished: ok={ok}, model={model_path}, mode={info.get('mode')}, "
+              f"{info.get('seconds', 0):.1f}s, "
+              f"rss {memstat.format_bytes(info.get('rss_before', 0))} -> "
+              f"{memstat.format_bytes(info.get('rss_loaded', 0))} (loaded) -> "
+              f"{memstat.format_bytes(info.get('rss_after', 0))}, "
+              f"peak {memstat.format_bytes(info.get('peak_rss', 0))}")
+        self.llm_ready = self.llm_client.llm is not None
+        self.restart_unload_timer()
+        if ok:
+            self.show_bubble("新大脑装好啦~")
+        else:
+            # 回滚：配置也改回正在使用的模型，下次启动不会再加载失败的模型
+            self.config.set("model_path", model_path)
+            self.save_config()
+            if self.llm_ready:
+                self.show_bubble("新大脑装不上，先继续用原来的啦~")
+            else:
+                self.show_bubble("找不到大脑(模型)... 请在设置里检查路径。")
+        self.switch_pending_model()
+
+    def restart_unload_timer(self):
+        """从现在起重新计算空闲时间；未开启空闲卸载或模型不可用时停止计时"""
+        minutes = self.config.get("idle_unload_minutes", 0)
+        if minutes > 0 and self.llm_ready:
+            self.unload_timer.start(int(minutes * 60 * 1000))
+        else:
+            self.unload_timer.stop()
+
+    def on_unload_timer(self):
+        self.power.wakeups.tick("unload")
+        # 正在聊天、加载或切换模型时不卸载，稍后再看
+        if (self.active_request_id is not None or self.chat_input.isVisible() or self.llm_loading
+                or self.worker.busy or self.worker.queue_depth or self.worker.swapping):
+            self.restart_unload_timer()
+            return
+        if not self.llm_ready:
+            return
+        print("LLM idle, unloading")
+        self.llm_ready = False
+        self.llm_unloaded = True
+        self.worker.request_unload()
+
+    def on_llm_unloaded(self, info):
+        rss_before, rss_after = info.get("rss_before", 0), info.get("rss_after", 0)
+        self.unloaded_rss = rss_after
+        print(f"LLM unloaded: rss {memstat.format_bytes(rss_before)} -> {memstat.format_bytes(rss_after)} "
+              f"(freed {memstat.format_bytes(max(0, rss_before - rss_after))})")
+
+    def wake_llm(self):
+        """空闲时卸载了模型就开始重新加载 (打开输入框时调用，用户打字期间加载)"""
+        if self.llm_unloaded and not self.llm_loading:
+            print("Reloading LLM...")
+            self.llm_loading = True
+            self.worker.request_reload()
+
+    def watch_persona(self):
+        """监听 character.txt 及其所在目录 (文件被删除重建、原子替换后需要重新添加监听)"""
+        path = self.llm_client.persona.character_path
+        watched = self.persona_watcher.files() + self.persona_watcher.directories()
+        for target in (path, os.path.dirname(path)):
+            if target not in watched and os.path.exists(target):
+                self.persona_watcher.addPath(target)
+
+    def reload_persona(self):
+        """在界面线程里重新编译角色设定，推理线程下次对话时直接使用新结果"""
+        self.watch_persona()
+        if self.llm_client.persona.reload() and self.active_request_id is None:
+            self.show_bubble("我好像变得有点不一样了~")
+
+    def shutdown(self):
+        """程序退出前停止推理线程"""
+        self.power.shutdown()
+        self.lag_probe.set_running(False)
+        print(f"Wakeups per minute: {self.power.format_wakeups()}")
+        self.worker.stop()
+        self.llm_client.close()
+        self.config.flush()
+        if self.llm_client.reply_cache is not None:
+            print(f"Reply cache: {self.llm_client.reply_cache.stats()}")
+        if self.llm_client.reply_budget.stats["replies"]:
+            print(f"Reply budget: {self.llm_client.reply_budget.report()}")
+        if self.llm_client.speculative_stats["replies"]:
+            print(f"Speculative decoding: {self.llm_client.speculative_report()}")
+        METRICS.flush()
 
     def apply_window_flags(self):
         """根据配置应用窗口标志"""
@@ -191,49 +477,15 @@ class PetUI(QWidget):
         # 初始大小还没确定，先给个大概位置，稍后在 update_appearance 里微调
         self.move(screen.width() - 250, screen.height() - 250)
 
-        # 气泡框 (默认隐藏)
-        self.bubble = QLabel(self)
-        self.bubble.setStyleSheet("""
-            QLabel {
-                background-color: rgba(255, 192, 203, 220); /* 浅粉色背景 */
-                border-radius: 10px;
-                padding: 10px;
-                color: black;
-                font-family: "Microsoft YaHei";
-                border: 1px solid #FF69B4; /* 深粉色边框 */
-            }
-        """)
-        self.bubble.setWordWrap(True)
-        self.bubble.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
-        self.bubble.hide()
-        
-        # 阴影效果
-        shadow = QGraphicsDropShadowEffect()
-        shadow.setBlurRadius(5)
-        shadow.setColor(QColor(0, 0, 0, 100))
-        shadow.setOffset(2, 2)
-        self.bubble.setGraphicsEffect(shadow)
-        
-        # 宠物图片
-        self.image_label = QLabel(self)
-        default_img = self.get_image_path("default.png")
-        self.original_pixmap = QPixmap(default_img) # 默认图片
-        # 初始Fallback，防止无图
-        if self.original_pixmap.isNull():
-             self.img_fallback()
+        # 气泡框 (默认隐藏)：浮在窗口上方，不在布局里，显示和改字都不会调整窗口
+        self.bubble = SpeechBubble(self)
 
+        # 宠物图片：先显示占位图，第一个待机动作在后台解码
+        self.image_label = QLabel(self)
+        self.original_pixmap = QPixmap() # 没有任何可用图片时才加载的默认图片
+        self.init_placeholder()
         self.update_appearance()
-        # 将气泡添加到布局最上方，并设置对齐方式
-        self.layout.insertWidget(0, self.bubble, 0, Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignHCenter)
-        # 限制气泡最大宽度，确保自动换行生效
-        self.bubble.setMaximumWidth(300)
-        # 设置气泡最小宽度，防止太窄
-        self.bubble.setMinimumWidth(150)
-        
-        # 气泡定时器
-        self.bubble_timer = QTimer()
-        self.bubble_timer.timeout.connect(self.bubble.hide)
-        
+
         # 将图片添加到布局底部
         self.layout.addWidget(self.image_label, 0, Qt.AlignmentFlag.AlignBottom | Qt.AlignmentFlag.AlignHCenter)
         
@@ -241,7 +493,7 @@ class PetUI(QWidget):
         self.init_focus_ui()
         
         # 初始动作
-        self.update_idle_animation()
+        self.start_first_animation()
 
     def init_focus_ui(self):
         # 专注倒计时标签
@@ -265,8 +517,9 @@ class PetUI(QWidget):
         self.focus_timer = QTimer(self)
         self.focus_timer.timeout.connect(self.update_focus_timer)
         self.focus_remaining_seconds = 0
+        self.focus_deadline = 0.0  # 专注结束的时间 (time.monotonic)
         
-        # 添加到布局顶部 (气泡上方)
+        # 添加到布局顶部 (气泡显示在它下方)
         self.layout.insertWidget(0, self.focus_label, 0, Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignHCenter)
 
     def start_focus_timer(self):
@@ -276,30 +529,40 @@ class PetUI(QWidget):
             self.focus_timer.stop()
             self.focus_label.hide()
             self.show_bubble("专注结束啦！要注意劳逸结合哦~")
-            self.adjustSize()
+            self.place_bubble()
         else:
             # 开始
             minutes = self.config.get("focus_minutes", 25)
+            self.focus_deadline = time.monotonic() + minutes * 60
             self.focus_remaining_seconds = minutes * 60
             self.update_focus_display()
             self.focus_label.show()
-            self.focus_timer.start(1000) # 每秒更新
-            self.show_bubble(f"开始专注！加油坚持 {minutes} 分钟哦！")
+            self.focus_timer.start(self.focus_interval())
             # 几秒后隐藏气泡，只留倒计时
-            QTimer.singleShot(3000, self.bubble.hide)
-            self.adjustSize()
-            
+            self.show_bubble(f"开始专注！加油坚持 {minutes} 分钟哦！", duration=3000)
+            self.place_bubble()
+
+    def focus_interval(self):
+        """看得见时每秒刷新倒计时；看不见时不刷新，直接等到专注结束"""
+        if self.power.active:
+            return 1000
+        return max(0, int((self.focus_deadline - time.monotonic()) * 1000))
+
     def update_focus_timer(self):
-        self.focus_remaining_seconds -= 1
+        self.power.wakeups.tick("focus")
+        # 按结束时间计算剩余秒数，计时器被合并或暂停刷新后也不会走偏
+        self.focus_remaining_seconds = max(0, round(self.focus_deadline - time.monotonic()))
         if self.focus_remaining_seconds <= 0:
             self.focus_timer.stop()
             self.focus_label.hide()
+            self.place_bubble()
             self.show_bubble("好棒！专注目标达成！✿✿ヽ(°▽°)ノ✿")
             # 播放庆祝动画或音效
             self.set_chatting_animation()
-            QTimer.singleShot(5000, self.resume_idle_animation)
+            self.resume_timer.start(5000)
         else:
             self.update_focus_display()
+            self.focus_timer.setInterval(self.focus_interval())
             
     def update_focus_display(self):
         minutes = self.focus_remaining_seconds // 60
@@ -309,51 +572,198 @@ class PetUI(QWidget):
     def get_image_path(self, filename):
         return os.path.join(self.app_root, "image", filename)
 
+    def current_pixmap(self, scale):
+        """当前帧按缩放和设备像素比缩放好的图片 (命中缓存时无需解码)"""
+        if self.current_sprite:
+            pixmap = self.sprite_cache.get(self.current_sprite, scale, self.devicePixelRatioF(),
+                                           self.current_frame)
+            if pixmap is not None:
+                return pixmap
+
+        # 启动时第一个动作解码完成之前
+        if self.placeholder is not None:
+            return self.placeholder
+
+        # 没有可用图片时使用默认图片或占位图
+        if self.original_pixmap.isNull():
+            self.original_pixmap = QPixmap(self.get_image_path("default.png"))
+        if self.original_pixmap.isNull():
+            self.img_fallback()
+        width, height = fit_size(self.original_pixmap.width(), self.original_pixmap.height(), scale)
+        return self.original_pixmap.scaled(
+            width, height,
+            Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation
+        )
+
+    @property
+    def thumbnail_dir(self):
+        return os.path.join(self.app_root, "modle", "cache")
+
+    def first_frame_path(self, filename):
+        path = self.get_image_path(filename)
+        files = sequence_files(path)
+        return files[0] if files else path
+
+    def init_placeholder(self):
+        """
+        选好第一个待机动作并准备启动占位图。资源包中有现成的帧时不需要占位图；
+        否则使用上次保存的小图 (原图和尺寸都没变时，第一个动作也就固定为它)，
+        第一次运行时用同样大小的透明图。窗口不用等原图解码就能显示，换上真正的图片时尺寸也不会跳变。
+        """
+        self.placeholder = None
+        self.placeholder_stale = False
+        scale = self.config.get("pet_scale", 1.0)
+        dpr = self.devicePixelRatioF()
+        idle_animations = self.config.get("idle_animations", IDLE_IMAGES)
+        image, source = load_thumbnail(self.thumbnail_dir, "placeholder")
+        names = {os.path.normcase(os.path.abspath(self.first_frame_path(name))): name for name in idle_animations}
+        name = names.get(source) if image is not None else None
+        if name is None:
+            name, image = random.choice(idle_animations), None
+        self.next_idle_image = name
+        self.startup_sprite = self.first_frame_path(name)
+        if not os.path.exists(self.startup_sprite) or self.sprite_cache.ready(self.startup_sprite, scale, dpr):
+            return
+
+        width, height = self.sprite_cache.logical_size(self.startup_sprite, scale)
+        width, height = int(width * dpr), int(height * dpr)
+        # 解码时按比例缩放，高度可能差 1 像素
+        if image is None or image.width() != width or abs(image.height() - height) > 1:
+            image = QImage(width, height, QImage.Format.Format_ARGB32_Premultiplied)
+            image.fill(Qt.GlobalColor.transparent)
+            self.placeholder_stale = True
+        self.placeholder = QPixmap.fromImage(image)
+        self.placeholder.setDevicePixelRatio(dpr)
+
+    def start_first_animation(self):
+        """第一个待机动作：不需要解码原图时直接播放，否则在后台解码，完成后换下占位图"""
+        if self.placeholder is None:
+            self.update_idle_animation()
+            PROFILE.mark("first sprite")
+            PROFILE.report()
+            return
+        self.sprite_cache.decoded.connect(self.on_startup_sprite_decoded)
+        self.prefetch_sprite(self.next_idle_image)
+
+    def on_startup_sprite_decoded(self, path):
+        if path != self.startup_sprite:
+            return
+        self.sprite_cache.decoded.disconnect(self.on_startup_sprite_decoded)
+        self.placeholder = None
+        self.update_idle_animation()
+        PROFILE.mark("first sprite")
+        PROFILE.report()
+        if self.placeholder_stale:
+            # 保存成下次启动的占位图
+            pixmap = self.sprite_cache.get(path, self.config.get("pet_scale", 1.0), self.devicePixelRatioF())
+            if pixmap is not None:
+                save_thumbnail(self.thumbnail_dir, "placeholder", path, pixmap.toImage())
+
+    def prefetch_sprite(self, filename):
+        """在后台线程预解码动作用到的所有图片"""
+        scale = self.config.get("pet_scale", 1.0)
+        path = self.get_image_path(filename)
+        for frame_path in sequence_files(path) or [path]:
+            self.sprite_cache.prefetch(frame_path, scale, self.devicePixelRatioF())
+
+    def make_clip(self, filename):
+        """把一个动作解析成 Clip：帧序列按固定帧率，GIF 按自身每帧时长，静态图只有一帧"""
+        clip = self.clips.get(filename)
+        if clip is not None:
+            return clip
+        path = self.get_image_path(filename)
+        files = sequence_files(path)
+        if files is not None:
+            duration = 1000.0 / self.config.get("sequence_fps", DEFAULT_SEQUENCE_FPS)
+            clip = Clip(filename, [(frame_path, 0, duration) for frame_path in files])
+        else:
+            delays = self.sprite_cache.frame_delays(path)
+            if delays is None and os.path.exists(path):
+                # 还没解码过 (没有预解码或预解码还没完成)：先同步解码，才能知道帧数和时长
+                self.sprite_cache.get(path, self.config.get("pet_scale", 1.0), self.devicePixelRatioF())
+                delays = self.sprite_cache.frame_delays(path)
+            clip = Clip(filename, [(path, index, delay) for index, delay in enumerate(delays or [None])])
+        if clip.frames:
+            self.clips[filename] = clip
+        return clip
+
+    def play_clip(self, filename):
+        """切换到一个动作并开始播放"""
+        clip = self.make_clip(filename)
+        if not clip.frames:
+            return
+        self.animator.play(clip)
+
+    def show_frame(self, path, frame):
+        """显示动画的一帧：尺寸不变时只换图片，不重新布局窗口"""
+        if not os.path.exists(path):
+            return
+        self.current_sprite = path
+        self.current_frame = frame
+        scale = self.config.get("pet_scale", 1.0)
+        size = self.sprite_cache.logical_size(path, scale)
+        if size != self.current_size:
+            self.current_size = size
+            self.update_appearance()
+            return
+        self.power.wakeups.tick("frame")
+        self.image_label.setPixmap(self.current_pixmap(scale))
+
     def update_appearance(self):
         scale = self.config.get("pet_scale", 1.0)
         opacity = self.config.get("pet_opacity", 1.0)
-        
-        if self.original_pixmap and not self.original_pixmap.isNull():
-             # 限制基准大小：如果原图宽度超过 300px，则将其视为 1.0 倍缩放的基准
-             # 这样可以防止高清原图直接填满屏幕
-             base_width = self.original_pixmap.width()
-             base_height = self.original_pixmap.height()
-             
-             MAX_BASE_WIDTH = 200 # 默认大小调小
-             if base_width > MAX_BASE_WIDTH:
-                 factor = MAX_BASE_WIDTH / base_width
-                 base_width = int(base_width * factor)
-                 base_height = int(base_height * factor)
-             
-             # 在限制后的基准大小上再应用用户的缩放设置
-             width = int(base_width * scale)
-             height = int(base_height * scale)
-             
-             scaled_pixmap = self.original_pixmap.scaled(
-                width, height, 
-                Qt.AspectRatioMode.KeepAspectRatio, 
-                Qt.TransformationMode.SmoothTransformation
-             )
-             self.image_label.setPixmap(scaled_pixmap)
-             self.setWindowOpacity(opacity)
-             
-             # 确保窗口宽度至少能容纳聊天输入框 (320px + margin)
-             min_width = 340 
-             final_width = max(width, min_width)
-             
-             self.resize(final_width, height + 50) # +50 for bubble space
-             
-             # 如果图片比窗口窄，需要确保图片居中 (layout 已经设置了 AlignHCenter，所以只要窗口够大就行)
-    
-    def on_llm_response(self, response):
+
+        scaled_pixmap = self.current_pixmap(scale)
+        self.image_label.setPixmap(scaled_pixmap)
+        self.setWindowOpacity(opacity)
+
+        # 逻辑尺寸 (高分屏下 pixmap 的像素尺寸是逻辑尺寸乘以设备像素比)
+        dpr = scaled_pixmap.devicePixelRatio()
+        width = int(scaled_pixmap.width() / dpr)
+        height = int(scaled_pixmap.height() / dpr)
+
+        # 确保窗口宽度至少能容纳聊天输入框 (320px + margin)
+        min_width = 340
+        final_width = max(width, min_width)
+
+        self.resize(final_width, height + 50) # +50 for bubble space
+
+        # 如果图片比窗口窄，需要确保图片居中 (layout 已经设置了 AlignHCenter，所以只要窗口够大就行)
+
+    def on_llm_request_started(self, request_id, wait):
+        if wait > 1.0:
+            print(f"Chat request {request_id} waited {wait:.1f}s in queue (depth={self.worker.queue_depth})")
+
+    def on_llm_token(self, request_id, delta):
+        """流式回复：边生成边更新气泡，生成结束前不启动隐藏计时"""
+        if request_id != self.active_request_id:
+            return
+        self.stream_text += delta
+        self.show_bubble(self.stream_text, duration=None)
+
+    def on_llm_response(self, request_id, response):
+        if request_id != self.active_request_id:
+            return
+        self.active_request_id = None
+        self.restart_unload_timer()
         print(f"LLM Response: {response}") # 打印到终端调试
         if not response:
             response = "..."
-        
-        # 移除重复定义的 on_llm_response
         self.show_bubble(response)
         # 收到回复后，恢复待机动画
-        QTimer.singleShot(3000, self.resume_idle_animation)
+        self.resume_timer.start(3000)
+
+    def on_llm_cancelled(self, request_id):
+        """当前请求被取消 (被新消息取代的旧请求不是当前请求，直接忽略)：收起气泡，恢复待机"""
+        if request_id != self.active_request_id:
+            return
+        self.active_request_id = None
+        self.stream_text = ""
+        self.bubble_timer.stop()
+        self.bubble.hide()
+        self.restart_unload_timer()
+        self.resume_timer.start(3000)
 
     def img_fallback(self):
         # 如果没有图片，创建一个简单的占位符
@@ -367,24 +777,16 @@ class PetUI(QWidget):
         painter.end()
 
 
-    def load_image(self, path):
-         """加载图片并更新显示"""
-         if os.path.exists(path):
-             self.original_pixmap = QPixmap(path)
-         else:
-             if self.original_pixmap.isNull():
-                  self.img_fallback()
-         self.update_appearance()
-
     def update_idle_animation(self):
-         """更新待机动作 (1-8.png)"""
-         # 定义待机动作列表
-         idle_images = [f"{i}.png" for i in range(1, 8)]
-         
-         # 随机选择一个
-         selected_img = random.choice(idle_images)
-         img_path = self.get_image_path(selected_img)
-         self.load_image(img_path)
+         """更新待机动作 (1-7.png、10.gif)"""
+         idle_animations = self.config.get("idle_animations", IDLE_IMAGES)
+         # 使用上一次已经预解码好的动作，没有时随机选择一个
+         selected_img = self.next_idle_image or random.choice(idle_animations)
+         self.play_clip(selected_img)
+
+         # 提前选好并在后台解码下一个动作
+         self.next_idle_image = random.choice(idle_animations)
+         self.prefetch_sprite(self.next_idle_image)
          
          # 特殊彩蛋：当随机到 3.png 时显示 Ciallo
          if selected_img == "3.png":
@@ -392,37 +794,85 @@ class PetUI(QWidget):
 
     def set_chatting_animation(self):
         """设置对话动作 (随机使用 9.png 或 12.png)"""
-        chat_img = random.choice(["9.png", "12.png"])
-        self.load_image(self.get_image_path(chat_img))
+        chat_img = random.choice(self.config.get("chat_animations", CHAT_IMAGES))
+        self.play_clip(chat_img)
         # 对话期间暂停待机动画切换
-        self.idle_timer.stop()
-        
+        self.resume_timer.stop()
+        self.idle_running = False
+        self.sync_idle_timer()
+
     def resume_idle_animation(self):
         """恢复待机动作"""
-        self.idle_timer.start(10000)
+        self.idle_running = True
+        self.sync_idle_timer()
+        if self.power.active:
+            self.update_idle_animation()
+
+    def sync_idle_timer(self):
+        """待机动作计时器只在需要轮换动作并且看得见时运行"""
+        if self.idle_running and self.power.active:
+            if not self.idle_timer.isActive():
+                self.idle_timer.start()
+        else:
+            self.idle_timer.stop()
+
+    def on_idle_timer(self):
+        self.power.wakeups.tick("idle")
         self.update_idle_animation()
 
+    def on_bubble_timer(self):
+        self.power.wakeups.tick("bubble")
+        self.bubble.hide()
+
+    def on_power_changed(self, active):
+        """进入/退出省电状态：停掉或恢复动画，专注倒计时改为只在结束时唤醒"""
+        self.sync_idle_timer()
+        if self.focus_timer.isActive():
+            self.focus_timer.start(self.focus_interval())
+        if not active:
+            self.animator.pause()
+        else:
+            self.animator.resume()
+            if self.focus_timer.isActive():
+                self.focus_remaining_seconds = max(0, round(self.focus_deadline - time.monotonic()))
+                self.update_focus_display()
+            # 恢复时立即换一个动作，不用等满一个间隔
+            if self.idle_running:
+                self.update_idle_animation()
+
+    # --- 窗口状态变化 (省电模式) ---
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.power.update()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.power.update()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.Type.WindowStateChange:
+            self.power.update()
+
     def show_bubble(self, text, duration=5000):
-        self.bubble.setText(text)
-        
-        # 强制单行时不换行，多行时才换行，并预留缓冲空间
-        # 简单的 adjustSize 有时在无边框窗口下计算不准
-        fm = self.bubble.fontMetrics()
-        width = fm.horizontalAdvance(text) + 40 # 加上padding
-        
-        if width > 300:
-            self.bubble.setFixedWidth(300) # 固定最大宽，让它自己换行
-            self.bubble.setWordWrap(True)
+        """显示气泡；duration 为 None 时保持显示，直到下一次带时长的调用"""
+        # 只重新排版气泡里的文字，不调整窗口
+        with METRICS.timer("bubble.layout"):
+            self.bubble.set_text(text)
+        if duration is None:
+            self.bubble_timer.stop()
         else:
-            self.bubble.setFixedWidth(max(100, width)) # 动态宽度
-            self.bubble.setWordWrap(False) # 短文本不换行
-            
-        self.bubble.adjustSize()
-        self.adjustSize()
-        
-        # 确保气泡完全可见
-        self.bubble.show()
-        self.bubble_timer.start(duration)
+            self.bubble_timer.start(duration)
+
+    def place_bubble(self):
+        """气泡放在窗口顶部；专注倒计时显示时放在它下方"""
+        top = self.focus_label.geometry().bottom() + 1 if self.focus_label.isVisible() else 0
+        self.bubble.place(top)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.place_bubble()
 
     # --- 鼠标事件处理 (拖动 & 点击) ---
 
@@ -442,14 +892,17 @@ class PetUI(QWidget):
     def mouseReleaseEvent(self, event):
         self.is_dragging = False
 
-    # def on_llm_response(self, response):  <-- Removed duplicate
-    #     self.show_bubble(response)
-    #     QTimer.singleShot(3000, self.resume_idle_animation)
+    def submit_chat(self, text):
+        """把消息交给推理线程；新消息会取代还没回复完的旧消息"""
+        self.wake_llm()
+        self.restart_unload_timer()
+        if self.llm_loading:
+            # 模型还没加载好，消息会在队列里等待加载完成
+            self.show_bubble("我还在醒来中，等我一下下哦~", duration=None)
 
-    def start_chat_thread(self, text):
-        self.chat_thread = ChatThread(self.llm_client, text)
-        self.chat_thread.response_ready.connect(self.on_llm_response)
-        self.chat_thread.start()
+        self.stream_text = ""
+        stream = self.config.get("stream_reply", True)
+        self.active_request_id = self.worker.submit(text, stream=stream)
 
     def mouseDoubleClickEvent(self, event):
         # 双击触发对话示例
@@ -459,6 +912,8 @@ class PetUI(QWidget):
             
             # 每次打开聊天输入框时，强制隐藏当前的气泡，防止重叠
             self.bubble.hide()
+            # 模型空闲时被卸载了：趁用户打字重新加载
+            self.wake_llm()
             
             # 将输入框直接放置在顶部 (0, 0) 下方一点，覆盖气泡位置
             # 由于现在是子控件，坐标是相对于 self (窗口内部左上角为 0,0)
@@ -522,8 +977,5 @@ class PetUI(QWidget):
         menu.exec(pos)
 
     def reload_settings(self):
-        """重新加载设置并应用"""
-        self.load_config()
-        self.update_appearance()
-        self.apply_window_flags()
-        # 如果模型路径变了，可能需要重载模型（这里暂不实现自动重载，需重启）
+        """配置文件被手动修改后重新读取，变化的部分由 on_config_changed 应用"""
+        self.config.reload()
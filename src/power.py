@@ -0,0 +1,179 @@
+import sys
+import time
+from collections import deque
+from PySide6.QtCore import QObject, QTimer, Signal
+
+# 被全屏程序遮挡时的检查间隔：前台窗口切换由系统事件通知，
+# 这里只用来发现同一个窗口退出全屏 (只在遮挡期间运行)
+COVERED_POLL_MS = 5000
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    _user32 = ctypes.windll.user32
+    _user32.GetForegroundWindow.restype = wintypes.HWND
+    _user32.GetDesktopWindow.restype = wintypes.HWND
+    _user32.GetShellWindow.restype = wintypes.HWND
+    _user32.GetWindowRect.argtypes = [wintypes.HWND, ctypes.POINTER(wintypes.RECT)]
+    _user32.GetClassNameW.argtypes = [wintypes.HWND, wintypes.LPWSTR, ctypes.c_int]
+    _user32.MonitorFromWindow.argtypes = [wintypes.HWND, wintypes.DWORD]
+    _user32.MonitorFromWindow.restype = wintypes.HANDLE
+    _user32.GetMonitorInfoW.argtypes = [wintypes.HANDLE, ctypes.c_void_p]
+    _user32.SetWinEventHook.restype = wintypes.HANDLE
+    _user32.UnhookWinEvent.argtypes = [wintypes.HANDLE]
+
+    MONITOR_DEFAULTTONEAREST = 2
+    EVENT_SYSTEM_FOREGROUND = 0x0003
+    WINEVENT_OUTOFCONTEXT = 0x0000
+
+    # 桌面本身 (壁纸) 也是“全屏”的，不算遮挡
+    _DESKTOP_CLASSES = ("Progman", "WorkerW")
+
+    class _MonitorInfo(ctypes.Structure):
+        _fields_ = [
+            ("cbSize", wintypes.DWORD),
+            ("rcMonitor", wintypes.RECT),
+            ("rcWork", wintypes.RECT),
+            ("dwFlags", wintypes.DWORD),
+        ]
+
+    _WinEventProc = ctypes.WINFUNCTYPE(None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+                                       wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD)
+
+    def foreground_covers_screen(hwnd):
+        """前台是否是别的程序的全屏窗口，并且和桌宠在同一个显示器上"""
+        try:
+            fg = _user32.GetForegroundWindow()
+            if not fg or fg == hwnd or fg in (_user32.GetDesktopWindow(), _user32.GetShellWindow()):
+                return False
+            class_name = ctypes.create_unicode_buffer(64)
+            _user32.GetClassNameW(fg, class_name, 64)
+            if class_name.value in _DESKTOP_CLASSES:
+                return False
+            rect = wintypes.RECT()
+            if not _user32.GetWindowRect(fg, ctypes.byref(rect)):
+                return False
+            info = _MonitorInfo()
+            info.cbSize = ctypes.sizeof(info)
+            monitor = _user32.MonitorFromWindow(hwnd, MONITOR_DEFAULTTONEAREST)
+            if not monitor or not _user32.GetMonitorInfoW(monitor, ctypes.byref(info)):
+                return False
+            m = info.rcMonitor
+            return rect.left <= m.left and rect.top <= m.top and rect.right >= m.right and rect.bottom >= m.bottom
+        except Exception:
+            return False
+
+    def install_foreground_hook(callback):
+        """前台窗口切换时回调 (在界面线程的消息循环中触发)，返回用于卸载的句柄"""
+        proc = _WinEventProc(lambda *args: callback())
+        hook = _user32.SetWinEventHook(EVENT_SYSTEM_FOREGROUND, EVENT_SYSTEM_FOREGROUND,
+                                       None, proc, 0, 0, WINEVENT_OUTOFCONTEXT)
+        if not hook:
+            return None
+        return (hook, proc)  # proc 必须一直被引用，否则回调会被回收
+
+    def remove_foreground_hook(handle):
+        _user32.UnhookWinEvent(handle[0])
+
+else:
+    def foreground_covers_screen(hwnd):
+        return False
+
+    def install_foreground_hook(callback):
+        return None
+
+    def remove_foreground_hook(handle):
+        pass
+
+
+class WakeupCounter:
+    """统计各个计时器/事件最近一分钟内唤醒界面线程的次数"""
+
+    def __init__(self, window=60.0):
+        self.window = window
+        self._events = {}  # 名字 -> 唤醒时间
+
+    def tick(self, name):
+        now = time.monotonic()
+        events = self._events.setdefault(name, deque())
+        events.append(now)
+        self._trim(events, now)
+
+    def _trim(self, events, now):
+        while events and now - events[0] > self.window:
+            events.popleft()
+
+    def per_minute(self):
+        now = time.monotonic()
+        result = {}
+        for name, events in self._events.items():
+            self._trim(events, now)
+            if events:
+                result[name] = len(events) * 60.0 / self.window
+        return result
+
+    def total_per_minute(self):
+        return sum(self.per_minute().values())
+
+
+class PowerMonitor(QObject):
+    """
+    判断桌宠现在是否看得见：窗口隐藏、最小化或被全屏程序遮挡时进入省电状态，
+    由 PetUI 停掉动画和解码。窗口的显示/隐藏事件由 PetUI 转发过来；
+    Windows 上的全屏遮挡由前台窗口切换事件驱动，平时不需要轮询。
+    """
+    active_changed = Signal(bool)
+
+    def __init__(self, widget):
+        super().__init__(widget)
+        self.widget = widget
+        self.active = True
+        self.covered = False
+        self.wakeups = WakeupCounter()
+
+        self.cover_timer = QTimer(self)
+        self.cover_timer.setInterval(COVERED_POLL_MS)
+        self.cover_timer.timeout.connect(self._poll_cover)
+
+        self._hook = install_foreground_hook(self._on_foreground_changed)
+
+    def update(self):
+        """窗口状态可能变化时调用，重新判断是否需要工作"""
+        widget = self.widget
+        visible = widget.isVisible() and not widget.isMinimized()
+        self.covered = visible and foreground_covers_screen(int(widget.winId()))
+        if self.covered:
+            if not self.cover_timer.isActive():
+                self.cover_timer.start()
+        else:
+            self.cover_timer.stop()
+
+        active = visible and not self.covered
+        if active != self.active:
+            self.active = active
+            reason = "covered" if self.covered else ("hidden" if not visible else "visible")
+            print(f"Power: {'active' if active else 'paused'} ({reason}), "
+                  f"wakeups/min: {self.format_wakeups()}")
+            self.active_changed.emit(active)
+
+    def format_wakeups(self):
+        counts = self.wakeups.per_minute()
+        if not counts:
+            return "0"
+        return ", ".join(f"{name}={count:.0f}" for name, count in sorted(counts.items()))
+
+    def _poll_cover(self):
+        self.wakeups.tick("cover")
+        self.update()
+
+    def _on_foreground_changed(self):
+        self.wakeups.tick("foreground")
+        if self.widget.isVisible():
+            self.update()
+
+    def shutdown(self):
+        self.cover_timer.stop()
+        if self._hook is not None:
+            remove_foreground_hook(self._hook)
+            self._hook = None
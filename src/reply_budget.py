@@ -0,0 +1,161 @@
+import re
+
+# 按句子提前结束生成：回复达到字数预算后，在第一个完整的句子处结束，
+# 不再为之后会被丢弃的文字付出生成时间。预算按问题类型调整。
+
+# 句末标点，以及可以跟在句末标点后面的收尾符号
+SENTENCE_ENDINGS = "。！？!?~～…"
+CLOSING_CHARS = "」』”’\"')）"
+
+# 各类问题的回复字数预算 (达到后在句末结束)，可以在配置 reply_budget 中覆盖
+DEFAULT_REPLY_BUDGETS = {
+    "greeting": 12,  # 打招呼、道别
+    "chat": 20,      # 闲聊
+    "question": 28,  # 提问
+    "request": 40,   # 讲故事、唱歌之类的请求
+}
+
+_QUESTION_TYPES = [
+    ("greeting", re.compile(r"^(你好|您好|嗨|哈喽|早|早上好|中午好|下午好|晚上好|晚安|再见|拜拜|hi|hello|bye)",
+                            re.IGNORECASE)),
+    ("request", re.compile(r"(讲|说|唱|写|编|背|念|介绍|推荐|解释|列)(一|个|首|段|下|几)|给我|帮我|故事")),
+    ("question", re.compile(r"[?？]|什么|怎么|为什么|为啥|哪|几|多少|吗|呢|是不是|能不能|会不会|可不可以")),
+]
+
+# 估计节省的 token 时使用自然结束长度的滑动平均，新样本的权重
+NATURAL_LENGTH_WEIGHT = 0.2
+
+
+def classify(user_input):
+    """粗略判断问题类型：greeting / request / question / chat"""
+    text = (user_input or "").strip()
+    for name, pattern in _QUESTION_TYPES:
+        if pattern.search(text):
+            return name
+    return "chat"
+
+
+def sentence_complete(text):
+    """文本是否停在一个完整的句子 (或一段括号里的动作描写) 之后"""
+    text = text.rstrip()
+    if text.endswith((")", "）")):
+        return True
+    text = text.rstrip(CLOSING_CHARS)
+    return bool(text) and text[-1] in SENTENCE_ENDINGS
+
+
+def _as_list(input_ids):
+    return input_ids.tolist() if hasattr(input_ids, "tolist") else list(input_ids)
+
+
+class SentenceStopper:
+    """
+    作为 logits_processor 使用：第一次调用时记下提示词长度，之后只解码新生成的 token；
+    回复达到字数预算并且停在句末时，把除 EOS 以外的 logits 置为 -inf 结束生成。
+    拿不到 logits 的后端 (HTTP 服务) 不传 llm，改用 feed() 逐段送入收到的文本。
+    """
+
+    def __init__(self, llm, kind, budget):
+        self.llm = llm
+        self.eos = llm.token_eos() if llm is not None else None
+        self.kind = kind
+        self.budget = budget
+        self.start = None
+        self.generated = 0
+        self.data = b""
+        self.stopped = False
+
+    def text(self):
+        return self.data.decode("utf-8", errors="ignore").strip().lstrip(":").strip()
+
+    def _check(self):
+        """回复够长并且停在句末时标记为已结束"""
+        if not self.stopped and self.generated:
+            text = self.text()
+            self.stopped = len(text) >= self.budget and sentence_complete(text)
+        return self.stopped
+
+    def feed(self, delta, tokens):
+        """追加一段生成的文本 (约 tokens 个 token)，返回是否应该结束生成"""
+        if self.start is None:
+            self.start = 0
+        self.data += delta.encode("utf-8")
+        self.generated += tokens
+        return self._check()
+
+    def __call__(self, input_ids, scores):
+        if self.start is None:
+            self.start = len(input_ids)
+            return scores
+        count = len(input_ids) - self.start
+        if count > self.generated:
+            new_ids = [t for t in _as_list(input_ids[self.start + self.generated:]) if t != self.eos]
+            self.data += self.llm.detokenize(new_ids)
+            self.generated = count
+        if self._check():
+            scores.fill(float("-inf"))
+            scores[self.eos] = 0.0
+        return scores
+
+
+class ReplyBudget:
+    """按问题类型给出字数预算，并统计提前结束节省的 token"""
+
+    def __init__(self, config):
+        self.config = config  # 与 LLMClient 共用的配置 dict
+        self.natural_length = {}  # 问题类型 -> 自然结束时的平均 token 数
+        self.stats = {"replies": 0, "stopped": 0, "tokens": 0, "saved": 0}
+        self.last = None
+
+    def budgets(self):
+        """配置 reply_budget: "off" 关闭；{类型: 字数} 覆盖默认预算"""
+        value = self.config.get("reply_budget")
+        if value == "off" or value is False:
+            return None
+        budgets = dict(DEFAULT_REPLY_BUDGETS)
+        if isinstance(value, dict):
+            budgets.update({k: v for k, v in value.items() if isinstance(v, int) and v > 0})
+        return budgets
+
+    def stopper(self, llm, user_input):
+        """本次回复的停止条件，未开启时返回 None；llm 为 None 时只能用 feed() 送入文本"""
+        budgets = self.budgets()
+        if budgets is None:
+            return None
+        kind = classify(user_input)
+        return SentenceStopper(llm, kind, budgets.get(kind, DEFAULT_REPLY_BUDGETS["chat"]))
+
+    def record(self, stopper, max_tokens):
+        """
+        一次回复结束后记录统计。提前结束时按该类问题自然结束的平均长度估计节省的 token；
+        自然结束的回复用来更新这个平均值。
+        """
+        if stopper is None or stopper.start is None:
+            return
+        generated = stopper.generated
+        natural = self.natural_length.get(stopper.kind)
+        if natural is None:
+            # 这类问题还没有自然结束的样本：用其它类型的平均，都没有时假定会写到 max_tokens
+            known = list(self.natural_length.values())
+            natural = sum(known) / len(known) if known else max_tokens
+        saved = 0
+        if stopper.stopped:
+            saved = max(0, round(natural) - generated)
+            self.stats["stopped"] += 1
+        else:
+            if stopper.kind in self.natural_length:
+                natural += (generated - natural) * NATURAL_LENGTH_WEIGHT
+            else:
+                natural = generated
+            self.natural_length[stopper.kind] = natural
+        self.stats["replies"] += 1
+        self.stats["tokens"] += generated
+        self.stats["saved"] += saved
+        self.last = {"kind": stopper.kind, "budget": stopper.budget, "chars": len(stopper.text()),
+                     "tokens": generated, "stopped": stopper.stopped, "saved": saved}
+
+    def report(self):
+        stats = dict(self.stats)
+        total = stats["tokens"] + stats["saved"]
+        stats["saved_ratio"] = stats["saved"] / total if total else 0.0
+        return stats
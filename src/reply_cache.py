@@ -0,0 +1,149 @@
+import os
+import json
+import random
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+# 超过这个长度的输入很少会重复，不缓存
+MAX_INPUT_CHARS = 24
+
+# 每新增多少条回复自动保存一次 (其余在 flush() 时保存)
+AUTOSAVE_EVERY = 5
+
+CACHE_FORMAT_VERSION = 1
+
+
+def normalize_input(text):
+    """归一化输入：全角转半角、忽略大小写、去掉标点、符号和空白"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PSZC")
+
+
+class ReplyCache:
+    """
+    常见问题的回复缓存。
+    key 由归一化后的输入和角色/模型指纹组成，每个 key 保存几条不同的回答，
+    命中时随机挑一条 (尽量不和上一次相同)，按 LRU 和总大小淘汰，并持久化到磁盘。
+    """
+
+    def __init__(self, path, max_entries=200, max_variants=4, max_bytes=256 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_variants = max_variants
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> {"replies": [...], "last": 上次使用的下标}
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.load()
+
+    def make_key(self, text, fingerprint):
+        """不可缓存的输入返回 None"""
+        normalized = normalize_input(text)
+        if not normalized or len(normalized) > MAX_INPUT_CHARS:
+            return None
+        return hashlib.sha1(f"{fingerprint}|{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, key, min_variants=1):
+        """已积累至少 min_variants 条不同回答时返回其中一条，否则返回 None"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or len(entry["replies"]) < min_variants:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            choices = [i for i in range(len(entry["replies"])) if i != entry.get("last")]
+            index = random.choice(choices or [0])
+            entry["last"] = index
+            return entry["replies"][index]
+
+    def add(self, key, reply):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {"replies": [], "last": None}
+                self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if reply in entry["replies"]:
+                return
+            entry["replies"].append(reply)
+            self._bytes += self._size(reply)
+            # 每个 key 只保留最新的几条
+            while len(entry["replies"]) > self.max_variants:
+                self._bytes -= self._size(entry["replies"].pop(0))
+                entry["last"] = None
+            self._evict()
+            self._unsaved += 1
+            need_save = self._unsaved >= AUTOSAVE_EVERY
+        if need_save:
+            self.flush()
+
+    @staticmethod
+    def _size(reply):
+        return len(reply.encode("utf-8"))
+
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self.entries.popitem(last=False)
+            self._bytes -= sum(self._size(r) for r in entry["replies"])
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._bytes = 0
+            self._unsaved += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Failed to load reply cache: {e}")
+            return
+        if data.get("version") != CACHE_FORMAT_VERSION:
+            return
+        with self._lock:
+            for key, replies in data.get("entries", []):
+                self.entries[key] = {"replies": list(replies)[-self.max_variants:], "last": None}
+                self._bytes += sum(self._size(r) for r in self.entries[key]["replies"])
+            self._evict()
+
+    def flush(self):
+        """原子写入磁盘"""
+        with self._lock:
+            if not self._unsaved:
+                return
+            data = {
+                "version": CACHE_FORMAT_VERSION,
+                # 按 LRU 顺序保存，加载后淘汰顺序不变
+                "entries": [[key, list(entry["replies"])] for key, entry in self.entries.items()],
+            }
+            self._unsaved = 0
+        with self._save_lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Failed to save reply cache: {e}")
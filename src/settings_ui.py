@@ -1,4 +1,3 @@
-import json
 import os
 import sys
 from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
@@ -6,14 +5,19 @@ from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
                              QTabWidget, QWidget, QComboBox, QTextBrowser,
                              QSpinBox)
 from PySide6.QtCore import Qt
+from config_store import ConfigStore
+from model_catalog import ModelCatalog, estimate_memory, describe, MEMORY_HEADROOM
+from llm_client import DEFAULT_RUNTIME
+import memstat
 
 class SettingsDialog(QDialog):
-    def __init__(self, parent=None, config_path="modle/config.json"):
+    def __init__(self, parent=None, config_path="modle/config.json", config_store=None):
         super().__init__(parent)
         self.setWindowTitle("桌宠设置")
         self.resize(400, 300)
         self.config_path = config_path
-        self.config = self.load_config()
+        # 与桌宠共用同一个配置服务，保存时只修改本窗口管理的键
+        self.config = config_store if config_store is not None else ConfigStore(config_path)
         
         # 设置粉色主题
         self.setStyleSheet("""
@@ -122,14 +126,37 @@ class SettingsDialog(QDialog):
         focus_layout.addWidget(self.focus_spin)
         general_layout.addLayout(focus_layout)
 
-        # 模型选择
+        # 模型选择：列出 modle/ 下的模型 (只读文件头) 和估计需要的内存
         model_layout = QHBoxLayout()
-        model_layout.addWidget(QLabel("模型路径:"))
-        self.model_path_btn = QPushButton("选择模型")
+        model_layout.addWidget(QLabel("模型:"))
+        self.model_combo = QComboBox()
+        self.model_combo.currentIndexChanged.connect(self.on_model_selected)
+        model_layout.addWidget(self.model_combo, 1)
+        self.model_path_btn = QPushButton("浏览...")
         self.model_path_btn.clicked.connect(self.choose_model)
         model_layout.addWidget(self.model_path_btn)
         general_layout.addLayout(model_layout)
+        self.model_info_label = QLabel()
+        self.model_info_label.setWordWrap(True)
+        self.model_info_label.setStyleSheet("font-size: 12px; color: #666;")
+        general_layout.addWidget(self.model_info_label)
+
+        # 空闲多久释放模型内存 (分钟)，打开聊天输入框时重新加载
+        unload_layout = QHBoxLayout()
+        unload_layout.addWidget(QLabel("空闲时释放模型:"))
+        self.unload_spin = QSpinBox()
+        self.unload_spin.setRange(0, 240)
+        self.unload_spin.setSpecialValueText("从不")
+        self.unload_spin.setSuffix(" 分钟后")
+        self.unload_spin.setValue(self.config.get("idle_unload_minutes", 0))
+        unload_layout.addWidget(self.unload_spin)
+        general_layout.addLayout(unload_layout)
+        self.model_dir = os.path.dirname(os.path.abspath(config_path))
+        self.app_root = os.path.dirname(self.model_dir)
+        self.catalog = ModelCatalog(self.model_dir)
+        self.model_estimates = {}  # 模型路径 -> (信息, 内存估计)
         self.model_path = self.config.get("model_path", "")
+        self.update_model_list()
         
         general_layout.addStretch()
         self.tab_general.setLayout(general_layout)
@@ -172,16 +199,101 @@ class SettingsDialog(QDialog):
     def update_opacity_label(self, value):
         self.opacity_label.setText(f"透明度: {value / 10.0:.1f}")
 
-    def load_config(self):
-        if os.path.exists(self.config_path):
-            with open(self.config_path, "r", encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+    def refresh(self):
+        """打开窗口前按当前配置重新填写各控件"""
+        self.scale_slider.setValue(int(self.config.get("pet_scale", 1.0) * 10))
+        self.opacity_slider.setValue(int(self.config.get("pet_opacity", 1.0) * 10))
+        index = self.display_combo.findData(self.config.get("display_mode", "top"))
+        if index >= 0:
+            self.display_combo.setCurrentIndex(index)
+        self.autostart_check.setChecked(self.config.get("auto_start", False))
+        self.focus_spin.setValue(self.config.get("focus_minutes", 25))
+        self.unload_spin.setValue(self.config.get("idle_unload_minutes", 0))
+        self.model_path = self.config.get("model_path", "")
+        self.update_model_list()
 
     def choose_model(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, "选择GGUF模型文件", "", "GGUF Files (*.gguf);;All Files (*)")
+        file_name, _ = QFileDialog.getOpenFileName(self, "选择GGUF模型文件", self.model_dir, "GGUF Files (*.gguf);;All Files (*)")
         if file_name:
-            self.model_path = file_name
+            self.model_path = self.config_model_path(file_name)
+            self.update_model_list()
+
+    def absolute_model_path(self, model_path):
+        if model_path and not os.path.isabs(model_path):
+            model_path = os.path.join(self.app_root, model_path)
+        return os.path.normcase(os.path.normpath(model_path)) if model_path else ""
+
+    def config_model_path(self, path):
+        """保存到配置中的路径：程序目录下的文件用相对路径"""
+        try:
+            relative = os.path.relpath(path, self.app_root)
+        except ValueError:  # Windows 上不在同一个盘
+            return path
+        return path if relative.startswith("..") else relative
+
+    def context_window(self):
+        value = self.config.get("context_window")
+        return value if isinstance(value, int) and value > 0 else DEFAULT_RUNTIME["context_window"]
+
+    def update_model_list(self):
+        """重新扫描模型目录 (文件没有变化时直接使用索引)，按当前的上下文长度估计内存"""
+        models = self.catalog.scan()
+        current = self.absolute_model_path(self.model_path)
+        if current and all(self.absolute_model_path(m["path"]) != current for m in models):
+            info = self.catalog.info(current)  # 目录外的模型
+            if info is not None:
+                models.append(info)
+        n_ctx = self.context_window()
+        n_batch = self.config.get("n_batch", DEFAULT_RUNTIME["n_batch"])
+        available = memstat.available_memory()
+
+        self.model_combo.blockSignals(True)
+        self.model_combo.clear()
+        self.model_estimates = {}
+        selected = -1
+        for info in models:
+            estimate = estimate_memory(info, n_ctx, n_batch) if info.get("valid") else None
+            text = describe(info, estimate)
+            if info.get("complete") and estimate is not None and available \
+                    and estimate["total"] > available * MEMORY_HEADROOM:
+                text += " (内存可能不够)"
+            path = self.config_model_path(info["path"])
+            self.model_combo.addItem(text, path)
+            index = self.model_combo.count() - 1
+            self.model_combo.setItemData(index, info["path"], Qt.ItemDataRole.ToolTipRole)
+            if not info.get("valid") or not info.get("complete"):
+                self.model_combo.model().item(index).setEnabled(False)
+            self.model_estimates[path] = (info, estimate)
+            if self.absolute_model_path(path) == current:
+                selected = index
+        if selected < 0 and self.model_path:
+            # 配置中的模型已经不存在
+            self.model_combo.addItem(f"{os.path.basename(self.model_path)} (找不到文件)", self.model_path)
+            selected = self.model_combo.count() - 1
+        self.model_combo.setCurrentIndex(selected)
+        self.model_combo.blockSignals(False)
+        self.update_model_info()
+
+    def on_model_selected(self, index):
+        if index >= 0:
+            self.model_path = self.model_combo.itemData(index)
+        self.update_model_info()
+
+    def update_model_info(self):
+        """显示选中模型的内存估计，保存后会在后台切换，无需重启"""
+        available = memstat.available_memory()
+        info, estimate = self.model_estimates.get(self.model_path, (None, None))
+        if not self.model_combo.count():
+            text = "modle/ 下还没有模型，请运行 download_model.bat 或点击“浏览...”选择 .gguf 文件"
+        elif estimate is None:
+            text = info.get("error", "") if info else ""
+        else:
+            text = (f"权重 {memstat.format_bytes(estimate['weights'])} + "
+                    f"上下文({self.context_window()}) {memstat.format_bytes(estimate['kv_cache'])} + "
+                    f"计算 {memstat.format_bytes(estimate['compute'])} ≈ {memstat.format_bytes(estimate['total'])}")
+        if available:
+            text += f"\n当前可用内存 {memstat.format_bytes(available)}"
+        self.model_info_label.setText(text)
 
     def save_settings(self):
         new_config = {
@@ -190,14 +302,14 @@ class SettingsDialog(QDialog):
             "auto_start": self.autostart_check.isChecked(),
             "model_path": self.model_path,
             "focus_minutes": self.focus_spin.value(),
+            "idle_unload_minutes": self.unload_spin.value(),
             "display_mode": self.display_combo.currentData()
         }
         
-        # 保存到文件
-        os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
-        with open(self.config_path, "w", encoding='utf-8') as f:
-            json.dump(new_config, f, indent=4)
-            
+        # 只合并本窗口的设置，其它键 (推理参数等) 保持不变；变化的键会通知给桌宠
+        self.config.update(new_config)
+        self.config.flush()
+
         # 设置开机自启 (Windows)
         self.set_autostart(new_config["auto_start"])
         
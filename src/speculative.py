@@ -0,0 +1,137 @@
+import os
+
+# 投机解码 (speculative decoding)：先用便宜的办法猜出后面几个 token，
+# 主模型一次前向同时验证这几个位置，猜中的部分直接采用。
+# 验证由 llama-cpp 的 Llama.generate 完成 (传入 draft_model=)，每个位置仍然按主模型的 logits 采样，
+# 贪心采样时输出与不使用投机解码完全相同。
+
+# llama-cpp 只会调用 draft_model(input_ids)，不检查是否继承 LlamaDraftModel；
+# 这里不继承它，导入本模块时就不用加载 llama_cpp 和 numpy (启动时只需要 speculative_options)
+_np = None
+
+DEFAULT_NUM_PRED_TOKENS = {"prompt_lookup": 10, "draft": 4}
+DEFAULT_MAX_NGRAM_SIZE = 2
+
+
+def _as_list(input_ids):
+    return input_ids.tolist() if hasattr(input_ids, "tolist") else list(input_ids)
+
+
+def _as_draft(tokens):
+    """llama-cpp 要求返回 numpy 数组 (只有假模型时没有 numpy)"""
+    global _np
+    if _np is None:
+        try:
+            import numpy
+            _np = numpy
+        except ImportError:
+            _np = False
+    if _np:
+        return _np.array(tokens, dtype=_np.intc)
+    return list(tokens)
+
+
+class DraftStats:
+    """统计草稿的次数和猜出的 token 数，接受率由 LLMClient 按生成的 token 数推算"""
+
+    def __init__(self):
+        self.calls = 0
+        self.drafted = 0
+
+    def record(self, tokens):
+        self.calls += 1
+        self.drafted += len(tokens)
+
+
+class PromptLookupDraft:
+    """
+    提示词查找 (prompt lookup)：在已有的上下文里找与结尾相同的 n-gram，把它后面的 token 当作草稿。
+    不需要额外的模型，对复述设定、示例对话和历史对话的回复效果最好。
+    """
+
+    def __init__(self, num_pred_tokens=DEFAULT_NUM_PRED_TOKENS["prompt_lookup"],
+                 max_ngram_size=DEFAULT_MAX_NGRAM_SIZE):
+        self.num_pred_tokens = num_pred_tokens
+        self.max_ngram_size = max_ngram_size
+        self.stats = DraftStats()
+
+    def find_candidates(self, ids):
+        for size in range(min(self.max_ngram_size, len(ids) - 1), 0, -1):
+            ngram = ids[-size:]
+            # 从后往前找，最近出现的匹配最可能继续
+            for start in range(len(ids) - size - 1, -1, -1):
+                if ids[start:start + size] == ngram:
+                    end = start + size
+                    return ids[end:end + self.num_pred_tokens]
+        return []
+
+    def __call__(self, input_ids, **kwargs):
+        tokens = self.find_candidates(_as_list(input_ids))
+        self.stats.record(tokens)
+        return _as_draft(tokens)
+
+
+class LlamaModelDraft:
+    """
+    用一个小模型 (同一分词器的小号 GGUF) 贪心地猜后面的 token。
+    小模型有自己的上下文，与上次输入的公共前缀不重复评估。
+    """
+
+    def __init__(self, llama, num_pred_tokens=DEFAULT_NUM_PRED_TOKENS["draft"]):
+        self.llama = llama
+        self.num_pred_tokens = num_pred_tokens
+        self.stats = DraftStats()
+
+    def _greedy_token(self):
+        llama = self.llama
+        return int(llama.scores[llama.n_tokens - 1].argmax())
+
+    def __call__(self, input_ids, **kwargs):
+        ids = _as_list(input_ids)
+        llama = self.llama
+        prefix = 0
+        limit = min(llama.n_tokens, len(ids))
+        cached = llama.input_ids[:limit]
+        while prefix < limit and cached[prefix] == ids[prefix]:
+            prefix += 1
+        if prefix == len(ids):
+            prefix -= 1  # 至少评估最后一个 token 以得到 logits
+        llama.n_tokens = max(prefix, 0)
+        llama.eval(ids[llama.n_tokens:])
+
+        tokens = []
+        eos = llama.token_eos()
+        for i in range(self.num_pred_tokens):
+            token = self._greedy_token()
+            if token == eos:
+                break
+            tokens.append(token)
+            if i + 1 < self.num_pred_tokens:
+                llama.eval([token])
+        self.stats.record(tokens)
+        return _as_draft(tokens)
+
+    def close(self):
+        close = getattr(self.llama, "close", None)
+        if close is not None:
+            close()
+        self.llama = None
+
+
+def speculative_options(config, model_path):
+    """
+    读取配置中的投机解码设置，可以对所有模型生效，也可以按模型文件名分别设置：
+      "speculative": "prompt_lookup"
+      "speculative": {"qwen-7b.gguf": {"mode": "draft", "draft_model": "modle/qwen-0.5b.gguf"}, "*": "prompt_lookup"}
+    返回 {"mode", ...}，未开启时返回 None。
+    """
+    value = config.get("speculative")
+    if isinstance(value, dict) and "mode" not in value:
+        value = value.get(os.path.basename(model_path or ""), value.get("*"))
+    if isinstance(value, str):
+        value = {"mode": value}
+    if not isinstance(value, dict) or value.get("mode") not in DEFAULT_NUM_PRED_TOKENS:
+        return None
+    options = dict(value)
+    options.setdefault("num_pred_tokens", DEFAULT_NUM_PRED_TOKENS[options["mode"]])
+    return options
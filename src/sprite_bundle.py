@@ -0,0 +1,270 @@
+"""
+精灵图资源包。
+
+image/ 下的原图约 2364x1773、每张 2MB，而显示宽度最多只有 MAX_BASE_WIDTH * 缩放。
+构建步骤把这些 PNG 缩小到实际需要的最大尺寸，转成预乘 RGBA 原始像素，
+打包成一个可以 mmap 的文件；运行时直接从映射内存构造 QImage，不再解码 PNG。
+
+用法：
+    python src/sprite_bundle.py            # 需要时才重新构建
+    python src/sprite_bundle.py --force    # 强制重新构建
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+
+BUNDLE_MAGIC = b"HXTSPR1\0"
+BUNDLE_VERSION = 1
+BUNDLE_FILENAME = "sprites.bundle"
+# 只有修改时间变了、哈希校验通过的原图，记下校验时的大小和修改时间，下次启动不再重新计算哈希
+VERIFIED_FILENAME = "sprites.bundle.verified"
+FRAME_ALIGN = 64
+
+# 默认按 2.0 倍缩放、2.0 设备像素比构建，覆盖绝大多数显示情况；
+# 运行时需要更大的尺寸时会自动回退到原始 PNG
+DEFAULT_MAX_SCALE = 2.0
+DEFAULT_MAX_DPR = 2.0
+
+# 与 sprite_cache.MAX_BASE_WIDTH 保持一致 (这里不导入，避免构建时依赖 Qt)
+MAX_BASE_WIDTH = 200
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_verified(image_dir):
+    """读取校验记录 {文件名: [sha256, 大小, 修改时间]}，不存在或损坏时返回空 dict"""
+    try:
+        with open(os.path.join(image_dir, VERIFIED_FILENAME), "r", encoding="utf-8") as f:
+            verified = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return verified if isinstance(verified, dict) else {}
+
+
+def save_verified(image_dir, verified):
+    path = os.path.join(image_dir, VERIFIED_FILENAME)
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(verified, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Failed to save sprite bundle verification: {e}")
+
+
+def source_is_fresh(path, entry, verified=None):
+    """
+    原图是否与打包时一致：先比较大小和修改时间，不一致时再比较哈希。
+    传入 verified 时，哈希校验通过的结果记在里面，同样的大小和修改时间下次直接视为一致。
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if st.st_size == entry["src_bytes"] and st.st_mtime_ns == entry["src_mtime_ns"]:
+        return True
+    if st.st_size != entry["src_bytes"]:
+        return False
+    name = os.path.basename(path)
+    stamp = [entry["sha256"], st.st_size, st.st_mtime_ns]
+    if verified is not None and verified.get(name) == stamp:
+        return True
+    # 例如重新 checkout 后只有修改时间变了
+    if file_sha256(path) != entry["sha256"]:
+        return False
+    if verified is not None:
+        verified[name] = stamp
+    return True
+
+
+def read_header(bundle_path):
+    """读取资源包头部，格式不对时返回 None"""
+    try:
+        with open(bundle_path, "rb") as f:
+            if f.read(len(BUNDLE_MAGIC)) != BUNDLE_MAGIC:
+                return None
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+    except (OSError, ValueError, struct.error):
+        return None
+    if header.get("version") != BUNDLE_VERSION:
+        return None
+    return header
+
+
+def list_sources(image_dir):
+    return sorted(name for name in os.listdir(image_dir) if name.lower().endswith(".png"))
+
+
+def target_width(src_width, max_scale, max_dpr):
+    return min(src_width, int(MAX_BASE_WIDTH * max_scale * max_dpr))
+
+
+def needs_rebuild(image_dir, max_scale=DEFAULT_MAX_SCALE, max_dpr=DEFAULT_MAX_DPR):
+    header = read_header(os.path.join(image_dir, BUNDLE_FILENAME))
+    if header is None:
+        return True
+    if header.get("max_scale") != max_scale or header.get("max_dpr") != max_dpr:
+        return True
+    frames = header["frames"]
+    if sorted(frames) != list_sources(image_dir):
+        return True
+    verified = load_verified(image_dir)
+    before = dict(verified)
+    fresh = all(source_is_fresh(os.path.join(image_dir, name), entry, verified) for name, entry in frames.items())
+    if verified != before:
+        save_verified(image_dir, verified)
+    return not fresh
+
+
+def build_bundle(image_dir, max_scale=DEFAULT_MAX_SCALE, max_dpr=DEFAULT_MAX_DPR):
+    """把 image_dir 下的 PNG 打包成资源包 (构建时依赖 Pillow)"""
+    from PIL import Image
+
+    frames = {}
+    blobs = []
+    offset = 0
+    for name in list_sources(image_dir):
+        path = os.path.join(image_dir, name)
+        st = os.stat(path)
+        with Image.open(path) as im:
+            im = im.convert("RGBA")
+            src_width, src_height = im.size
+            width = target_width(src_width, max_scale, max_dpr)
+            height = max(1, round(src_height * width / src_width))
+            if (width, height) != im.size:
+                im = im.resize((width, height), Image.LANCZOS)
+            # 预乘 alpha，运行时可直接作为 Format_RGBA8888_Premultiplied 使用
+            data = im.convert("RGBa").tobytes()
+
+        frames[name] = {
+            "width": width,
+            "height": height,
+            "source_width": src_width,
+            "source_height": src_height,
+            "offset": offset,
+            "size": len(data),
+            "src_bytes": st.st_size,
+            "src_mtime_ns": st.st_mtime_ns,
+            "sha256": file_sha256(path),
+        }
+        padding = -len(data) % FRAME_ALIGN
+        blobs.append(data + b"\0" * padding)
+        offset += len(data) + padding
+
+    header = {
+        "version": BUNDLE_VERSION,
+        "max_scale": max_scale,
+        "max_dpr": max_dpr,
+        "frames": frames,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    # 数据区按 FRAME_ALIGN 对齐
+    prefix_len = len(BUNDLE_MAGIC) + 4 + len(header_bytes)
+    header_bytes += b" " * (-prefix_len % FRAME_ALIGN)
+
+    bundle_path = os.path.join(image_dir, BUNDLE_FILENAME)
+    tmp_path = bundle_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(BUNDLE_MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, bundle_path)
+    # 新资源包里记的就是当前的修改时间，旧的校验记录不再需要
+    try:
+        os.remove(os.path.join(image_dir, VERIFIED_FILENAME))
+    except OSError:
+        pass
+    return bundle_path
+
+
+class SpriteBundle:
+    """运行时只读加载资源包，像素数据直接来自 mmap"""
+
+    def __init__(self, image_dir, bundle_path, header, fd, mapped):
+        self.image_dir = image_dir
+        self.bundle_path = bundle_path
+        self.frames = header["frames"]
+        self._file = fd
+        self._map = mapped
+        self._data_start = len(BUNDLE_MAGIC) + 4 + struct.unpack_from("<I", mapped, len(BUNDLE_MAGIC))[0]
+        self._view = memoryview(mapped)
+
+        # 原图改动过的帧不使用，回退到 PNG。
+        # 通常只比较大小和修改时间；需要重新计算哈希的只有上次启动之后修改时间变过的原图
+        self.stale = set()
+        verified = load_verified(image_dir)
+        before = dict(verified)
+        for name, entry in self.frames.items():
+            if not source_is_fresh(os.path.join(image_dir, name), entry, verified):
+                self.stale.add(name)
+        if verified != before:
+            save_verified(image_dir, verified)
+        if self.stale:
+            print(f"Sprite bundle is stale for {sorted(self.stale)}, run src/sprite_bundle.py to rebuild.")
+
+    @classmethod
+    def open(cls, image_dir):
+        """打开资源包；不存在或损坏时返回 None"""
+        bundle_path = os.path.join(image_dir, BUNDLE_FILENAME)
+        if not os.path.exists(bundle_path):
+            return None
+        header = read_header(bundle_path)
+        if header is None:
+            print(f"Ignoring invalid sprite bundle: {bundle_path}")
+            return None
+        try:
+            fd = open(bundle_path, "rb")
+            mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            print(f"Failed to map sprite bundle: {e}")
+            return None
+        return cls(image_dir, bundle_path, header, fd, mapped)
+
+    def frame_entry(self, path):
+        """返回可用帧的信息，路径不在资源包中或已过期时返回 None"""
+        if os.path.normcase(os.path.dirname(os.path.abspath(path))) != os.path.normcase(os.path.abspath(self.image_dir)):
+            return None
+        name = os.path.basename(path)
+        if name in self.stale:
+            return None
+        return self.frames.get(name)
+
+    def frame_image(self, entry):
+        """构造指向映射内存的 QImage (调用方需要在资源包关闭前复制或转换)"""
+        from PySide6.QtGui import QImage
+        start = self._data_start + entry["offset"]
+        data = self._view[start:start + entry["size"]]
+        return QImage(data, entry["width"], entry["height"], entry["width"] * 4,
+                      QImage.Format.Format_RGBA8888_Premultiplied)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建精灵图资源包")
+    parser.add_argument("--image-dir", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "image"))
+    parser.add_argument("--max-scale", type=float, default=DEFAULT_MAX_SCALE, help="需要支持的最大缩放比例")
+    parser.add_argument("--max-dpr", type=float, default=DEFAULT_MAX_DPR, help="需要支持的最大设备像素比")
+    parser.add_argument("--force", action="store_true", help="忽略已有资源包，强制重新构建")
+    args = parser.parse_args()
+
+    if not args.force and not needs_rebuild(args.image_dir, args.max_scale, args.max_dpr):
+        print("Sprite bundle is up to date.")
+        return 0
+    path = build_bundle(args.image_dir, args.max_scale, args.max_dpr)
+    print(f"Sprite bundle written to {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from PySide6.QtCore import Qt, QObject, QRunnable, QThreadPool, Signal
+from PySide6.QtGui import QImage, QImageReader, QPixmap
+from metrics import METRICS
+
+# 原图宽度超过该值时，视为 1.0 倍缩放的基准宽度，防止高清原图直接填满屏幕
+MAX_BASE_WIDTH = 200
+
+
+def fit_size(src_width, src_height, scale):
+    """计算逻辑显示尺寸：先把原图限制到基准宽度，再应用用户的缩放设置"""
+    if src_width > MAX_BASE_WIDTH:
+        factor = MAX_BASE_WIDTH / src_width
+        src_width = int(src_width * factor)
+        src_height = int(src_height * factor)
+    return int(src_width * scale), int(src_height * scale)
+
+
+# GIF 中 0 延迟或过短的帧按这个时长显示 (毫秒)
+MIN_FRAME_DELAY_MS = 20
+
+
+def decode_scaled(path, width, height):
+    """解码图片并缩放到设备像素尺寸 (可在工作线程调用，只用 QImage)"""
+    return scale_image(QImageReader(path).read(), width, height)
+
+
+def decode_frames(path, width, height):
+    """
+    解码图片的所有帧并缩放，返回 [(QImage, 显示时长毫秒)]；静态图只有一帧，时长为 None。
+    没有透明通道的帧 (例如白底 GIF) 会把与边缘相连的背景色去掉。
+    """
+    reader = QImageReader(path)
+    if not reader.supportsAnimation() or reader.imageCount() <= 1:
+        return [(scale_image(reader.read(), width, height), None)]
+    frames = []
+    while True:
+        image = reader.read()
+        if image.isNull():
+            break
+        delay = max(reader.nextImageDelay(), MIN_FRAME_DELAY_MS)
+        frames.append((scale_image(transparent_background(image), width, height), delay))
+    return frames
+
+
+def transparent_background(image):
+    """不透明的图片：从四周的背景色开始填充，把背景变成透明 (在缩放之前做，边缘更干净)"""
+    if image.isNull() or image.hasAlphaChannel():
+        return image
+    alpha = image.createHeuristicMask(True).convertToFormat(QImage.Format.Format_Grayscale8)
+    alpha.invertPixels()  # 掩码中背景为 0 (白)，主体为 1 (黑)
+    image = image.convertToFormat(QImage.Format.Format_ARGB32)
+    image.setAlphaChannel(alpha)
+    return image
+
+
+def scale_image(image, width, height):
+    if image.isNull():
+        return image
+    with METRICS.timer("sprite.scale"):
+        image = image.scaled(
+            width, height,
+            Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation
+        )
+        # 预乘格式绘制时不需要再转换
+        return image.convertToFormat(QImage.Format.Format_ARGB32_Premultiplied)
+
+
+def load_thumbnail(cache_dir, name, source=None):
+    """
+    读取启动用的小图缓存 (占位图、托盘图标)，返回 (QImage, 原图路径)。
+    缓存不存在、原图改动过或者不是 source 时返回 (None, None)。
+    """
+    try:
+        with open(os.path.join(cache_dir, f"{name}.json"), encoding="utf-8") as f:
+            info = json.load(f)
+        st = os.stat(info["source"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+    if source is not None and os.path.normcase(os.path.abspath(source)) != os.path.normcase(info["source"]):
+        return None, None
+    if st.st_size != info.get("bytes") or st.st_mtime_ns != info.get("mtime_ns"):
+        return None, None
+    image = QImage(os.path.join(cache_dir, f"{name}.png"))
+    if image.isNull():
+        return None, None
+    return image, info["source"]
+
+
+def save_thumbnail(cache_dir, name, source, image):
+    """在后台线程把缩小好的图片存成 PNG (编码要几十毫秒，不放在界面线程)"""
+    def write():
+        try:
+            st = os.stat(source)
+            os.makedirs(cache_dir, exist_ok=True)
+            png_path = os.path.join(cache_dir, f"{name}.png")
+            if not image.save(png_path + ".tmp", "PNG"):
+                return
+            os.replace(png_path + ".tmp", png_path)
+            info = {"source": os.path.normcase(os.path.abspath(source)), "bytes": st.st_size,
+                    "mtime_ns": st.st_mtime_ns}
+            with open(os.path.join(cache_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+                json.dump(info, f)
+        except OSError as e:
+            print(f"Failed to save {name}: {e}")
+    threading.Thread(target=write, daemon=True).start()
+
+
+class _DecodeTask(QRunnable):
+    """后台解码任务"""
+
+    def __init__(self, cache, base, path, width, height):
+        super().__init__()
+        self.cache = cache
+        self.base = base
+        self.path = path
+        self.width = width
+        self.height = height
+
+    def run(self):
+        frames = self.cache._decode(self.path, self.width, self.height)
+        # 信号会排队送回 GUI 线程
+        self.cache._decoded.emit(self.base, frames)
+
+
+class SpriteCache(QObject):
+    """
+    精灵图缓存：每帧只解码一次，按当前缩放和设备像素比保存缩放好的 QPixmap，
+    按内存预算做 LRU 淘汰。prefetch() 在工作线程里提前解码下一帧，
+    切换时 GUI 线程只需取出现成的 QPixmap。
+    GIF 等多帧图片一次解码全部帧，所有用到它的动画共用这些帧。
+    """
+    _decoded = Signal(object, object)
+    decoded = Signal(str)  # 后台解码完成的图片路径
+
+    def __init__(self, budget_bytes=32 * 1024 * 1024, parent=None, bundle=None):
+        super().__init__(parent)
+        self.budget_bytes = budget_bytes
+        self.bundle = bundle           # 预编译资源包 (sprite_bundle.SpriteBundle)，可为空
+        self._pixmaps = OrderedDict()  # key -> QPixmap
+        self._used_bytes = 0
+        self._source_sizes = {}        # path -> (宽, 高)
+        self._delays = {}              # path -> 每帧显示时长 (静态图为 [None])
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._decoded.connect(self._on_decoded)
+
+    def source_size(self, path):
+        """读取原图尺寸 (只读文件头，不解码)"""
+        with self._lock:
+            size = self._source_sizes.get(path)
+        if size is None:
+            entry = self.bundle.frame_entry(path) if self.bundle else None
+            if entry is not None:
+                size = (entry["source_width"], entry["source_height"])
+            else:
+                qsize = QImageReader(path).size()
+                size = (qsize.width(), qsize.height())
+            with self._lock:
+                self._source_sizes[path] = size
+        return size
+
+    def logical_size(self, path, scale):
+        width, height = self.source_size(path)
+        return fit_size(width, height, scale)
+
+    def _key(self, path, scale, dpr):
+        """一张图片在某个显示尺寸下的 key，加上帧序号就是缓存中每一帧的 key"""
+        width, height = self.logical_size(path, scale)
+        return (path, width, height, round(dpr, 2))
+
+    def get(self, path, scale, dpr, frame=0):
+        """取出缩放好的 QPixmap；未命中时在当前线程同步解码 (多帧图片一次解码全部帧)"""
+        if not os.path.exists(path):
+            return None
+        base = self._key(path, scale, dpr)
+        key = base + (frame,)
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(key)
+            self.hits += 1
+            return pixmap
+
+        self.misses += 1
+        _, width, height, dpr = base
+        self._insert_frames(base, self._decode(path, int(width * dpr), int(height * dpr)))
+        return self._pixmaps.get(key) or self._pixmaps.get(base + (0,))
+
+    def ready(self, path, scale, dpr):
+        """这张图片能否不解码原图直接取出：已经在缓存中，或者资源包中有足够大的预缩放帧"""
+        base = self._key(path, scale, dpr)
+        if base + (0,) in self._pixmaps:
+            return True
+        entry = self.bundle.frame_entry(path) if self.bundle else None
+        return entry is not None and entry["width"] >= int(base[1] * base[3])
+
+    def frame_delays(self, path):
+        """每帧显示时长 (毫秒，静态图为 [None])；还没解码过时返回 None"""
+        return self._delays.get(path)
+
+    def _decode(self, path, width, height):
+        """优先使用资源包中的预缩放帧，尺寸不够或不在包内时解码原始图片 (统计中的解码时间包含缩放)"""
+        with METRICS.timer("sprite.decode"):
+            entry = self.bundle.frame_entry(path) if self.bundle else None
+            if entry is not None and entry["width"] >= width:
+                return [(scale_image(self.bundle.frame_image(entry), width, height), None)]
+            return decode_frames(path, width, height)
+
+    def prefetch(self, path, scale, dpr):
+        """在工作线程中提前解码并缩放"""
+        if not os.path.exists(path):
+            return
+        base = self._key(path, scale, dpr)
+        if base + (0,) in self._pixmaps or base in self._pending:
+            return
+        self._pending.add(base)
+        _, width, height, dpr = base
+        self._pool.start(_DecodeTask(self, base, path, int(width * dpr), int(height * dpr)))
+
+    def _on_decoded(self, base, frames):
+        self._pending.discard(base)
+        if base + (0,) not in self._pixmaps:
+            self._insert_frames(base, frames)
+        self.decoded.emit(base[0])
+
+    def _insert_frames(self, base, frames):
+        frames = [(image, delay) for image, delay in frames if not image.isNull()]
+        if not frames:
+            return
+        # 全部帧超过预算的一半时只保留第一帧当静态图，动画不会把其它图片挤出缓存
+        cost = sum(image.width() * image.height() * 4 for image, _ in frames)
+        if len(frames) > 1 and cost > self.budget_bytes // 2:
+            print(f"Animation {os.path.basename(base[0])} needs {cost // 1024} KB, showing first frame only")
+            frames = [(frames[0][0], None)]
+        self._delays[base[0]] = [delay for _, delay in frames]
+        for index, (image, _) in enumerate(frames):
+            self._insert(base + (index,), image)
+
+    def _insert(self, key, image):
+        old = self._pixmaps.pop(key, None)
+        if old is not None:
+            self._used_bytes -= self._cost(old)
+        pixmap = QPixmap.fromImage(image)
+        pixmap.setDevicePixelRatio(key[3])
+        self._pixmaps[key] = pixmap
+        self._used_bytes += self._cost(pixmap)
+        self._evict()
+        return pixmap
+
+    @staticmethod
+    def _cost(pixmap):
+        return pixmap.width() * pixmap.height() * 4
+
+    def set_budget(self, budget_bytes):
+        """修改缓存上限，超出的部分立即淘汰"""
+        self.budget_bytes = budget_bytes
+        self._evict()
+
+    def _evict(self):
+        # 至少保留最新的一张，即使它本身超出预算
+        while self._used_bytes > self.budget_bytes and len(self._pixmaps) > 1:
+            _, pixmap = self._pixmaps.popitem(last=False)
+            self._used_bytes -= self._cost(pixmap)
+
+    def clear(self):
+        self._pixmaps.clear()
+        self._used_bytes = 0
+
+    @property
+    def used_bytes(self):
+        return self._used_bytes
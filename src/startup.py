@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+from PySide6.QtCore import QObject, QEvent
+
+# 启动关键路径的计时 (main.py --profile-startup)：从进程创建到第一次绘制窗口、到模型可用的各阶段。
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    # FILETIME (1601 年起的 100 纳秒数) 与 Unix 时间的差
+    _EPOCH_AS_FILETIME = 116444736000000000
+
+    def process_start_time():
+        """进程创建时间 (Unix 时间戳)，无法获取时返回 None"""
+        try:
+            times = [wintypes.FILETIME() for _ in range(4)]
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if not ctypes.windll.kernel32.GetProcessTimes(handle, *[ctypes.byref(t) for t in times]):
+                return None
+            created = (times[0].dwHighDateTime << 32) | times[0].dwLowDateTime
+            return (created - _EPOCH_AS_FILETIME) / 1e7
+        except Exception:
+            return None
+else:
+    def process_start_time():
+        """进程创建时间 (Unix 时间戳，Linux 上精度约 10 毫秒)，无法获取时返回 None"""
+        try:
+            with open("/proc/self/stat") as f:
+                # 进程名可能包含空格，从最后一个 ")" 之后开始数字段
+                fields = f.read().rsplit(")", 1)[1].split()
+            # 用开机时长换算 (/proc/stat 的 btime 只精确到秒)
+            with open("/proc/uptime") as f:
+                uptime = float(f.read().split()[0])
+            return time.time() - (uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"))
+        except Exception:
+            return None
+
+
+class _FirstPaint(QObject):
+    """窗口第一次绘制时 (绘制之前) 回调一次，然后移除自己；耗时的工作应该在回调里用 QTimer 推迟"""
+
+    def __init__(self, widget, callback):
+        super().__init__(widget)
+        self.callback = callback
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Type.Paint:
+            watched.removeEventFilter(self)
+            self.deleteLater()
+            self.callback()
+        return False
+
+
+def on_first_paint(widget, callback):
+    _FirstPaint(widget, callback)
+
+
+class StartupProfile:
+    """记录启动各阶段的时间点，最后打印时间线。未开启时 mark() 什么也不做。"""
+
+    def __init__(self):
+        self.enabled = False
+        self.marks = []  # (阶段, perf_counter)
+        # perf_counter 与 Unix 时间的对应关系，用来换算进程创建时间
+        self._wall = time.time()
+        self._origin = time.perf_counter()
+        self.reported = False
+
+    def enable(self):
+        self.enabled = True
+
+    def mark(self, name, t=None):
+        """记录一个阶段；t 为 perf_counter 时间，缺省为现在 (开启之前发生的阶段可以事后补记)"""
+        if self.enabled:
+            self.marks.append((name, time.perf_counter() if t is None else t))
+
+    def timeline(self):
+        """[(阶段, 距离起点的秒数, 与上一阶段的间隔)]；能取得进程创建时间时以它为起点"""
+        created = process_start_time()
+        if created is not None and created <= self._wall:
+            marks = [("process created", self._origin - (self._wall - created))] + self.marks
+        else:
+            marks = self.marks
+        if not marks:
+            return []
+        marks = sorted(marks, key=lambda mark: mark[1])
+        start = marks[0][1]
+        rows = []
+        previous = start
+        for name, t in marks:
+            rows.append((name, t - start, t - previous))
+            previous = t
+        return rows
+
+    def report(self):
+        """第一个动作已经显示、模型加载也结束之后打印一次时间线 (两者谁先谁后都可能)"""
+        if not self.enabled or self.reported:
+            return
+        names = {name for name, _ in self.marks}
+        if "first sprite" not in names or not names & {"model ready", "model load failed"}:
+            return
+        self.reported = True
+        print("Startup timeline:")
+        for name, elapsed, delta in self.timeline():
+            print(f"  {elapsed * 1000:8.1f} ms  (+{delta * 1000:7.1f})  {name}")
+
+
+PROFILE = StartupProfile()